@@ -116,6 +116,12 @@ from nive.definitions import SystemFlds, UserFlds, WorkflowFlds
 from nive.security import ALL_PERMISSIONS, Allow, Everyone, Deny
 from nive.application import Application
 
+from nive_datastore.cache import SetupResultCache, SetupFragmentCache
+from nive_datastore.querylog import SetupSlowQueryLog, InstallQueryTracer
+from nive_datastore.webapi.profiles import CompileSearchProfiles
+from nive_datastore.webapi.tree import CompileSubtreePlans
+from nive_datastore.webapi.templates import CompileTemplates
+
 #@nive_module
 configuration = AppConf(
     id = "storage",
@@ -172,5 +178,79 @@ class IDataStorage(Interface):
 class DataStorage(Application):
     """ the main cms application class """
 
-
-    
+    def Init(self):
+        self.searchCache = None
+        self.fragmentCache = None
+        self.slowQueryLog = None
+        self.ListenEvent("run", "SetupCache")
+        self.ListenEvent("run", "SetupQueryLog")
+        self.ListenEvent("run", "SetupProfiles")
+        self.ListenEvent("finishRegistration", "SetupTemplates")
+        self.ListenEvent("close", "CloseSearchExecutor")
+
+
+    def SetupCache(self, app=None):
+        """
+        Creates the search and list result cache if `configuration.searchCache` is set and
+        the template fragment cache if `configuration.fragmentCache` is set.
+        See `nive_datastore.cache`.
+        """
+        self.searchCache = SetupResultCache(self.configuration.get("searchCache"))
+        self.fragmentCache = SetupFragmentCache(self.configuration.get("fragmentCache"))
+
+
+    def SetupQueryLog(self, app=None):
+        """
+        Creates the slow query log if `configuration.slowQueryLog` is set and starts tracing
+        statements of the database connection. See `nive_datastore.querylog`.
+        """
+        self.slowQueryLog = SetupSlowQueryLog(self.configuration.get("slowQueryLog"))
+        if self.slowQueryLog is not None and self.db is not None:
+            InstallQueryTracer(self.db)
+
+
+    def SetupProfiles(self, app=None):
+        """
+        Compiles search and subtree profiles defined in the application configuration and
+        view settings on startup. See `nive_datastore.webapi.profiles` and
+        `nive_datastore.webapi.tree`.
+        """
+        cnt = CompileSearchProfiles(self)
+        self.log.debug("Compiled %d search profiles", cnt)
+        cnt = CompileSubtreePlans(self)
+        self.log.debug("Compiled %d subtree profiles", cnt)
+
+
+    def SetupTemplates(self, app=None, pyramidConfig=None):
+        """
+        Compiles the item and listing templates of all types on startup. Raises a
+        `ConfigurationError` if a template is missing or broken. See
+        `nive_datastore.webapi.templates`.
+        """
+        if pyramidConfig is None:
+            return
+        cnt = CompileTemplates(self, pyramidConfig.registry)
+        self.log.debug("Compiled %d templates", cnt)
+
+
+    def Close(self):
+        """
+        Closes the database and roots. The closed connection is detached from the datapool
+        afterwards: connections are shared per request and database name, so a garbage collected
+        datapool would otherwise close the connection of a later request.
+        """
+        Application.Close(self)
+        if self._dbpool is not None:
+            self._dbpool._conn = None
+
+
+    def CloseSearchExecutor(self, **kw):
+        """
+        Stops the worker threads used by `multiSearch`. The database connections of the
+        threads are thread local and released when the threads end.
+        """
+        executor = getattr(self, "_c_searchexecutor", None)
+        if executor is not None:
+            self._c_searchexecutor = None
+            self._c_searchworkers = 0
+            executor.shutdown(wait=True)
@@ -0,0 +1,404 @@
+# Copyright 2012-2020 Arndt Droullier, Nive GmbH. All rights reserved.
+# Released under GPL3. See license.txt
+
+"""
+Result caching
+--------------
+In memory cache for query results with tag based invalidation. Cached entries are tagged
+with the type ids (`pool_type`) the query reads. Writes of a type invalidate only entries
+tagged with this type. Entries tagged with `*` read all types and are invalidated by any
+write.
+
+The cache is activated for `search` and `listItems` by adding `searchCache` to the application
+configuration ::
+
+    app = AppConf("nive_datastore.app",
+                  searchCache = {"ttl": 300, "maxEntries": 1000},
+                  # ...
+    )
+
+- *ttl*: (number) seconds entries are valid. 0 = until invalidated.
+- *maxEntries*: (number) maximum number of entries. The least recently used entries are
+  removed if the cache is full.
+
+Single search profiles or list views can be excluded by setting `"cache": False`.
+
+Subtree results are not tagged by type but stamped with the version of the subtrees root
+container. Each write bumps the version of the written item and all its parents, so only
+cached subtrees including the item are invalidated.
+
+The initial markup of `newItemForm` and `setItemForm` is cached per user for GET requests
+without form values. Forms are tagged with the type id. Edit forms are stamped with the version
+of the edited item. Forms including csrf tokens are not cached.
+
+Rendered item templates (`renderTmpl`) can be cached in a separate size limited fragment cache ::
+
+    app = AppConf("nive_datastore.app",
+                  fragmentCache = {"maxBytes": 10000000},
+                  # ...
+    )
+
+- *maxBytes*: (number) maximum size of all cached fragments in bytes. The least recently used
+  fragments are removed if the cache is full.
+
+Fragment caching is opt-in per type (`ObjectConf.cacheTemplate = True`) or per call
+(`renderTmpl(cache=True)`). Fragments are keyed by item id, `pool_change`, template, locale and
+the principals of the request including the user id, `system.Everyone` and `system.Authenticated`.
+Anonymous users share one fragment per item. Templates rendering request specific values
+(e.g. csrf tokens) must not be cached.
+
+Invalidation is handled by the `CacheInvalidation` object extension which is included in the
+default item configuration `nive_datastore.item`. Fragments of the item and its parents are
+removed if the item is updated or deleted.
+
+Write events are signalled before the changes are committed. Concurrent requests may cache the
+old values until the commit. So caches are invalidated twice: when the event is signalled and
+again after the next commit or rollback of the database connection.
+"""
+
+import json
+import time
+import threading
+import weakref
+from collections import OrderedDict
+
+AllTypes = "*"
+# tag of cached subtrees. subtrees are invalidated by container versions.
+SubtreeTag = "subtree"
+# tag of cached form markup. forms are also tagged with the forms type.
+FormTag = "form"
+DefaultMaxEntries = 1000
+DefaultTTL = 300
+DefaultMaxBytes = 10000000
+
+
+class ResultCache(object):
+    """
+    Thread safe LRU cache with ttl and tag based invalidation.
+    """
+
+    def __init__(self, maxEntries=DefaultMaxEntries, ttl=DefaultTTL):
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.invalidations = self.evictions = 0
+
+
+    def Get(self, key, default=None):
+        """
+        Returns the cached value or `default` if not found or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, tags, expires = entry
+            if expires and expires < time.time():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+
+    def Set(self, key, value, tags=(AllTypes,)):
+        """
+        Stores the value tagged with the type ids in `tags`.
+        """
+        expires = time.time()+self.ttl if self.ttl else 0
+        with self._lock:
+            self._entries[key] = (value, frozenset(tags or (AllTypes,)), expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def Invalidate(self, tag):
+        """
+        Removes all entries tagged with `tag` or `*`. Invalidating `*` removes all
+        entries.
+        """
+        with self._lock:
+            if tag == AllTypes:
+                removed = list(self._entries.keys())
+            else:
+                removed = [key for key, entry in self._entries.items()
+                           if tag in entry[1] or AllTypes in entry[1]]
+            for key in removed:
+                del self._entries[key]
+            self.invalidations += len(removed)
+        return len(removed)
+
+
+    def Version(self, id):
+        """
+        Returns the current version of the container `id`.
+        """
+        with self._lock:
+            return self._versions.get(id, 0)
+
+
+    def BumpVersions(self, ids):
+        """
+        Increments the versions of the containers in `ids`.
+        """
+        with self._lock:
+            for id in ids:
+                self._versions[id] = self._versions.get(id, 0) + 1
+
+
+    def Clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+    def Stats(self):
+        """
+        Returns hit statistics as dictionary.
+        """
+        return {"entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions}
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FragmentCache(object):
+    """
+    Thread safe LRU cache for rendered markup limited by the size of all cached values. Each
+    fragment belongs to an item and is removed if the item is invalidated.
+    """
+
+    def __init__(self, maxBytes=DefaultMaxBytes):
+        self.maxBytes = maxBytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._items = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.invalidations = self.evictions = 0
+
+
+    def Get(self, key, default=None):
+        """
+        Returns the cached fragment or `default` if not found.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+
+    def Set(self, key, value, id, size=None):
+        """
+        Stores the fragment `value` of item `id`. `size` defaults to `len(value)`. Values
+        larger than the cache are not stored.
+        """
+        if size is None:
+            size = len(value)
+        if size > self.maxBytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._Remove(key)
+            self._entries[key] = (value, id, size)
+            self._items.setdefault(id, set()).add(key)
+            self.size += size
+            while self.size > self.maxBytes:
+                self._Remove(next(iter(self._entries)))
+                self.evictions += 1
+
+
+    def InvalidateItems(self, ids):
+        """
+        Removes all fragments of the items in `ids`.
+        """
+        cnt = 0
+        with self._lock:
+            for id in ids:
+                for key in list(self._items.get(id, ())):
+                    self._Remove(key)
+                    cnt += 1
+            self.invalidations += cnt
+        return cnt
+
+
+    def Clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._items.clear()
+            self.size = 0
+
+
+    def Stats(self):
+        """
+        Returns hit statistics as dictionary.
+        """
+        return {"entries": len(self._entries),
+                "size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions}
+
+
+    def _Remove(self, key):
+        value, id, size = self._entries.pop(key)
+        self.size -= size
+        keys = self._items.get(id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._items[id]
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def MakeCacheKey(*parts):
+    """
+    Creates a normalized cache key from the parts. Dictionaries are sorted by key.
+    """
+    return json.dumps(parts, sort_keys=True, default=repr)
+
+
+def QueryTags(typename=None, parameter=None, operators=None):
+    """
+    Returns the type ids a query reads from. Either `typename` or a `pool_type`
+    parameter. Returns `*` if the query is not restricted to types.
+    """
+    if typename:
+        return (typename,)
+    pool_type = (parameter or {}).get("pool_type")
+    if pool_type and (operators or {}).get("pool_type", "=") in ("=", "IN"):
+        if isinstance(pool_type, str):
+            return (pool_type,)
+        if isinstance(pool_type, (list, tuple)):
+            return tuple(pool_type)
+    return (AllTypes,)
+
+
+def SetupResultCache(conf):
+    """
+    Creates the result cache based on the `searchCache` configuration value. Returns
+    None if not configured.
+    """
+    if not conf:
+        return None
+    if not isinstance(conf, dict):
+        conf = {}
+    return ResultCache(maxEntries=conf.get("maxEntries", DefaultMaxEntries),
+                       ttl=conf.get("ttl", DefaultTTL))
+
+
+def SetupFragmentCache(conf):
+    """
+    Creates the fragment cache based on the `fragmentCache` configuration value. Returns
+    None if not configured.
+    """
+    if not conf:
+        return None
+    if not isinstance(conf, dict):
+        conf = {}
+    return FragmentCache(maxBytes=conf.get("maxBytes", DefaultMaxBytes))
+
+
+class CacheInvalidation(object):
+    """
+    Object extension. Invalidates cached results tagged with the objects type if the
+    object is created, updated, deleted or the workflow state changes. Also bumps the
+    versions of the object and all its parents for cached subtrees and removes rendered
+    fragments of the object and all its parents.
+    """
+
+    def Init(self):
+        self.ListenEvent("create", "InvalidateCaches")
+        self.ListenEvent("update", "InvalidateCaches")
+        self.ListenEvent("delete", "InvalidateCaches")
+        self.ListenEvent("wfAction", "InvalidateCaches")
+        self.ListenEvent("afterAdd", "InvalidateCaches")
+
+    def InvalidateCaches(self, obj=None, **kw):
+        app = self.app
+        if getattr(app, "searchCache", None) is None and getattr(app, "fragmentCache", None) is None:
+            return
+        obj = obj or self
+        typename = obj.GetTypeID()
+        ids = [obj.id] + obj.GetParentIDs()
+        InvalidateItems(app, typename, ids)
+        InvalidateAfterCommit(app, typename, ids)
+
+
+def InvalidateItems(app, typename, ids):
+    """
+    Invalidates cached results of the type, the versions of the items and rendered fragments
+    of the items.
+    """
+    cache = getattr(app, "searchCache", None)
+    if cache is not None:
+        cache.Invalidate(typename)
+        cache.BumpVersions(ids)
+    fragments = getattr(app, "fragmentCache", None)
+    if fragments is not None:
+        # parent templates may render the item
+        fragments.InvalidateItems(ids)
+
+
+_pending = threading.local()
+
+def InvalidateAfterCommit(app, typename, ids):
+    """
+    Invalidates the items again after the next commit or rollback of the applications database
+    connection in the current thread.
+    """
+    db = app.db
+    conn = db.usedconnection if db is not None else None
+    if conn is None:
+        return
+    if not getattr(conn, "_c_invalidation", False):
+        _InstallCommitHook(conn)
+    pending = getattr(_pending, "items", None)
+    if pending is None:
+        pending = _pending.items = OrderedDict()
+    pending[(id(app), typename, tuple(ids))] = weakref.ref(app)
+
+
+def _InstallCommitHook(conn):
+    # wraps the connections commit and rollback. see nive_datastore.querylog.InstallQueryTracer
+    # the connection is referenced weakly. connections close the database when deleted.
+    ref = weakref.ref(conn)
+    def hooked(name):
+        method = getattr(type(conn), name)
+        def call(*args, **kw):
+            try:
+                return method(ref(), *args, **kw)
+            finally:
+                _RunPending()
+        return call
+    conn.commit = hooked("commit")
+    conn.rollback = hooked("rollback")
+    conn._c_invalidation = True
+
+
+def _RunPending():
+    pending = getattr(_pending, "items", None)
+    if not pending:
+        return
+    _pending.items = None
+    for (appid, typename, ids), ref in pending.items():
+        app = ref()
+        if app is not None:
+            InvalidateItems(app, typename, ids)
@@ -0,0 +1,229 @@
+# Copyright 2012-2020 Arndt Droullier, Nive GmbH. All rights reserved.
+# Released under GPL3. See license.txt
+
+"""
+Full-text index
+---------------
+Database native full-text index for text fields. Searching text fields with the `LIKE` operator
+scans the whole table. Fields marked with `textIndex=True` are copied to a separate index table
+per collection which is maintained on write and queried with the databases full-text engine:
+
+- *Sqlite*: FTS5 virtual table, ranked by `bm25()`
+- *Postgres*: tsvector column with GIN index, ranked by `ts_rank()`
+- *MySql*: InnoDB table with FULLTEXT index, ranked by `MATCH() AGAINST()` in boolean mode
+
+The index table is named after the collections data table with the suffix `_fts` and created
+automatically on first use. ::
+
+    bookmark = ObjectConf("nive_datastore.item",
+        id = "bookmark",
+        dbparam = "bookmarks",
+        data = (
+          FieldConf(id="link",    datatype="url",  size=500,   default="", name="Link url"),
+          FieldConf(id="comment", datatype="text", size=50000, default="", name="Comment", textIndex=True)
+        ),
+        # ...
+    )
+
+Search profiles query the index with the `MATCH` operator. The parameter value is the search
+phrase; all words have to match. The parameter name is not used as column, the phrase is matched
+against all indexed fields of the profiles type. Results can be sorted by relevance with
+`sort: "relevance"` (most relevant first). ::
+
+    "comments": {
+        "type": "bookmark",
+        "fields": ["id", "link", "comment"],
+        "dynamic": {"text": ""},
+        "operators": {"text": "MATCH"},
+        "sort": "relevance"
+    }
+
+The index is updated by the `TextIndex` object extension included in the default item
+configuration `nive_datastore.item`. Existing data can be indexed with `RebuildTextIndex()`.
+"""
+
+from nive.definitions import ConfigurationError
+
+MatchOperator = "MATCH"
+RelevanceSort = "relevance"
+TableSuffix = "_fts"
+# text search configuration used for postgres tsvector
+TextSearchConfig = "simple"
+
+
+def DbBackend(db):
+    """
+    Returns the database backend name of the datapool: `sqlite`, `postgres`, `mysql` or None.
+    """
+    for cls in db.__class__.__mro__:
+        if cls.__name__ == "Sqlite3":
+            return "sqlite"
+        if cls.__name__ == "PostgreSql":
+            return "postgres"
+        if cls.__name__ == "MySql":
+            return "mysql"
+    return None
+
+
+def IndexFields(typeconf):
+    """
+    Returns the ids of all data fields of the type marked with `textIndex`.
+    """
+    return tuple(f.id for f in typeconf.get("data") or () if f.get("textIndex"))
+
+
+def IndexTable(dataTable):
+    return dataTable + TableSuffix
+
+
+def CreateTextIndex(db, dataTable):
+    """
+    Creates the index table if it does not exist.
+    """
+    table = IndexTable(dataTable)
+    backend = DbBackend(db)
+    if backend == "sqlite":
+        statements = ("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(text)" % (table),)
+    elif backend == "postgres":
+        statements = ("CREATE TABLE IF NOT EXISTS %s (id INT NOT NULL PRIMARY KEY, doc TSVECTOR)" % (table),
+                      "CREATE INDEX IF NOT EXISTS %s_doc ON %s USING GIN (doc)" % (table, table))
+    elif backend == "mysql":
+        statements = ("CREATE TABLE IF NOT EXISTS %s (id INT NOT NULL PRIMARY KEY, text LONGTEXT, "
+                      "FULLTEXT (text)) ENGINE=InnoDB" % (table),)
+    else:
+        raise ConfigurationError("Full-text index not supported by database (%s)" % (db.__class__.__name__))
+    for sql in statements:
+        db.Execute(sql).close()
+
+
+def WriteTextIndex(db, dataTable, id, text):
+    """
+    Replaces the indexed text of the item `id`.
+    """
+    table = IndexTable(dataTable)
+    ph = db.placeholder
+    backend = DbBackend(db)
+    DeleteTextIndex(db, dataTable, id)
+    if backend == "sqlite":
+        sql = "INSERT INTO %s (rowid, text) VALUES (%s, %s)" % (table, ph, ph)
+    elif backend == "postgres":
+        sql = "INSERT INTO %s (id, doc) VALUES (%s, to_tsvector('%s', %s))" % (table, ph, TextSearchConfig, ph)
+    else:
+        sql = "INSERT INTO %s (id, text) VALUES (%s, %s)" % (table, ph, ph)
+    db.Execute(sql, [id, text]).close()
+
+
+def DeleteTextIndex(db, dataTable, id):
+    """
+    Removes the item `id` from the index.
+    """
+    table = IndexTable(dataTable)
+    idColumn = "rowid" if DbBackend(db) == "sqlite" else "id"
+    db.Execute("DELETE FROM %s WHERE %s=%s" % (table, idColumn, db.placeholder), [id]).close()
+
+
+def FmtMatchJoin(db, dataTable, phrase):
+    """
+    Returns the join statement and values selecting all items matching the phrase. The join
+    is aliased as `fts__` and provides the columns `id` and `fts_rank`. Higher ranks are more
+    relevant.
+    """
+    table = IndexTable(dataTable)
+    ph = db.placeholder
+    backend = DbBackend(db)
+    if backend == "sqlite":
+        sql = "SELECT rowid AS id, -bm25(%s) AS fts_rank FROM %s WHERE %s MATCH %s" % (table, table, table, ph)
+        values = [SqliteQuery(phrase)]
+    elif backend == "postgres":
+        query = "plainto_tsquery('%s', %s)" % (TextSearchConfig, ph)
+        sql = "SELECT id, ts_rank(doc, %s) AS fts_rank FROM %s WHERE doc @@ %s" % (query, table, query)
+        values = [phrase, phrase]
+    elif backend == "mysql":
+        match = "MATCH (text) AGAINST (%s IN BOOLEAN MODE)" % (ph)
+        sql = "SELECT id, %s AS fts_rank FROM %s WHERE %s" % (match, table, match)
+        query = MysqlQuery(phrase)
+        values = [query, query]
+    else:
+        raise ConfigurationError("Full-text index not supported by database (%s)" % (db.__class__.__name__))
+    return "INNER JOIN (%s) AS fts__ ON (fts__.id = meta__.id)" % (sql), values
+
+
+def SqliteQuery(phrase):
+    # quote each word to prevent fts5 query syntax errors. words are combined by AND.
+    words = ['"%s"' % w.replace('"', '""') for w in phrase.split()]
+    return " ".join(words)
+
+
+def MysqlQuery(phrase):
+    # each word is required and quoted to prevent boolean mode operators. quotes in words are dropped.
+    words = ['+"%s"' % w.replace('"', '') for w in phrase.split()]
+    return " ".join(w for w in words if w != '+""')
+
+
+def EnsureTextIndex(app, db, dataTable):
+    """
+    Creates the index table once per application and table.
+    """
+    try:
+        known = app._c_textindex
+    except AttributeError:
+        known = app._c_textindex = set()
+    if dataTable in known:
+        return
+    CreateTextIndex(db, dataTable)
+    known.add(dataTable)
+
+
+def RebuildTextIndex(app, typename, user=None):
+    """
+    Writes the index for all existing items of type `typename`. Returns the number of
+    indexed items. Use to fill the index after adding `textIndex` to fields of existing
+    collections.
+    """
+    typeconf = app.configurationQuery.GetObjectConf(typename)
+    if typeconf is None:
+        raise ConfigurationError("Type not found (%s)" % (typename))
+    fields = IndexFields(typeconf)
+    if not fields:
+        return 0
+    db = app.db
+    dataTable = typeconf.dbparam
+    EnsureTextIndex(app, db, dataTable)
+    flds = ["id"] + ["data__.%s" % f for f in fields]
+    sql = "SELECT meta__.%s FROM %s AS meta__ INNER JOIN %s AS data__ ON (meta__.pool_dataref = data__.id) " \
+          "WHERE meta__.pool_type=%s" % (", ".join(flds), db.MetaTable, dataTable, db.placeholder)
+    cnt = 0
+    for rec in db.Query(sql, [typename]):
+        WriteTextIndex(db, dataTable, rec[0], FmtText(rec[1:]))
+        cnt += 1
+    db.Commit()
+    return cnt
+
+
+def FmtText(values):
+    return "\n".join([str(v) for v in values if v not in (None, "")])
+
+
+class TextIndex(object):
+    """
+    Object extension. Updates the full-text index of fields marked with `textIndex` on commit
+    and removes the item from the index if deleted. The index is written in the same transaction
+    as the item.
+    """
+
+    def Init(self):
+        if not IndexFields(self.configuration):
+            return
+        self.ListenEvent("commit", "UpdateTextIndex")
+        self.ListenEvent("delete", "RemoveTextIndex")
+
+    def UpdateTextIndex(self, **kw):
+        fields = IndexFields(self.configuration)
+        db = self.db
+        EnsureTextIndex(self.app, db, self.configuration.dbparam)
+        WriteTextIndex(db, self.configuration.dbparam, self.id, FmtText([self.data.get(f) for f in fields]))
+
+    def RemoveTextIndex(self, **kw):
+        db = self.db
+        EnsureTextIndex(self.app, db, self.configuration.dbparam)
+        DeleteTextIndex(db, self.configuration.dbparam, self.id)
@@ -0,0 +1,180 @@
+# Copyright 2012-2020 Arndt Droullier, Nive GmbH. All rights reserved.
+# Released under GPL3. See license.txt
+
+"""
+Materialized paths
+------------------
+Items only store a reference to their container (`pool_unitref`). Selecting all items below a
+container at any depth requires one query per level. The optional meta field `pool_path`
+stores the ids of all parents of an item (the root excluded) as string e.g. `/12/34/` for an
+item contained in 34 which itself is contained in 12. Items stored in the root have the
+path `/`. All items below a container share the same path prefix and can be selected with a
+single indexed range scan.
+
+Paths are activated by adding the `HierarchyFlds` to the applications meta fields ::
+
+    from nive_datastore.hierarchy import HierarchyFlds
+
+    app = AppConf("nive_datastore.app",
+                  # ...
+    )
+    app.meta = app.meta + list(HierarchyFlds)
+
+and updating the database structure. Paths of existing items are written with `RebuildPaths()`.
+
+Paths are maintained by the `PathIndex` object extension included in the default item
+configuration `nive_datastore.item`. The path is updated whenever an item is committed and
+its container changed. If a container is moved the paths of all contained items are
+rewritten with a single statement.
+
+Paths are used by
+
+- search profiles with `"container": "deep"` to search all items below the context,
+- `subtree` to load all levels with a single query,
+- `deleteItem` with `descendants` to delete items contained in sub containers.
+"""
+
+from nive.definitions import FieldConf
+from nive_datastore.i18n import _
+from nive_datastore.fulltext import DbBackend
+
+PathField = "pool_path"
+PathSeparator = "/"
+PathIndexName = "pool_meta_path"
+
+HierarchyFlds = (
+    FieldConf(id=PathField, datatype="string", size=255, default="", required=0, readonly=1, name=_("Path")),
+)
+
+
+def PathEnabled(app):
+    """
+    Returns True if the `pool_path` meta field is configured.
+    """
+    return app.configurationQuery.GetMetaFld(PathField) is not None
+
+
+def ItemPath(obj):
+    """
+    Returns the path of `obj` based on the loaded parent objects. The root has no path.
+    """
+    if obj.IsRoot():
+        return None
+    ids = [str(p.id) for p in reversed(obj.GetParents()) if not p.IsRoot()]
+    if not ids:
+        return PathSeparator
+    return PathSeparator + PathSeparator.join(ids) + PathSeparator
+
+
+def DescendantsPrefix(obj):
+    """
+    Returns the path prefix shared by all items contained in `obj` at any depth. Returns
+    None for the root.
+    """
+    path = ItemPath(obj)
+    if path is None:
+        return None
+    return path + str(obj.id) + PathSeparator
+
+
+def DescendantsRange(obj):
+    """
+    Returns the `BETWEEN` range selecting all items contained in `obj` at any depth or
+    None for the root. Paths always end with the separator and the separator is sorted before
+    digits, so all paths starting with the prefix are in the range `prefix` - `prefix[:-1]+"0"`.
+    """
+    prefix = DescendantsPrefix(obj)
+    if prefix is None:
+        return None
+    return (prefix, prefix[:-1] + "0")
+
+
+def EnsurePathIndex(app, db):
+    """
+    Creates the database index for `pool_path` once per application.
+    """
+    if getattr(app, "_c_pathindex", False):
+        return
+    backend = DbBackend(db)
+    table = db.MetaTable
+    if backend == "mysql":
+        if not db.Query("SHOW INDEX FROM %s WHERE Key_name='%s'" % (table, PathIndexName)):
+            db.Execute("CREATE INDEX %s ON %s (%s)" % (PathIndexName, table, PathField)).close()
+    else:
+        if backend == "postgres":
+            # paths are compared by byte order. locale collations may ignore the separator.
+            collation = db.Query("SELECT collation_name FROM information_schema.columns "
+                                 "WHERE table_name='%s' AND column_name='%s'" % (table, PathField))
+            if not collation or collation[0][0] != "C":
+                db.Execute('ALTER TABLE %s ALTER COLUMN %s TYPE VARCHAR(255) COLLATE "C"' % (table, PathField)).close()
+        db.Execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (PathIndexName, table, PathField)).close()
+    app._c_pathindex = True
+
+
+def MovePaths(db, oldPrefix, newPrefix):
+    """
+    Replaces the path prefix `oldPrefix` with `newPrefix` for all items below a moved
+    container.
+    """
+    ph = db.placeholder
+    if DbBackend(db) == "mysql":
+        concat = "CONCAT(%s, SUBSTRING(%s, %s))" % (ph, PathField, ph)
+    else:
+        concat = "%s || SUBSTR(%s, %s)" % (ph, PathField, ph)
+    sql = "UPDATE %s SET %s = %s WHERE %s BETWEEN %s AND %s" % (db.MetaTable, PathField, concat, PathField, ph, ph)
+    db.Execute(sql, [newPrefix, len(oldPrefix)+1, oldPrefix, oldPrefix[:-1]+"0"]).close()
+
+
+def RebuildPaths(app):
+    """
+    Writes the paths of all items. Use after activating paths for existing databases.
+    Returns the number of updated items.
+    """
+    db = app.db
+    EnsurePathIndex(app, db)
+    parents = dict(db.Query("SELECT id, pool_unitref FROM %s" % (db.MetaTable)))
+    paths = {}
+
+    def path(id):
+        if id in paths:
+            return paths[id]
+        ids = []
+        ref = parents.get(id)
+        while ref in parents and ref not in ids:
+            ids.append(ref)
+            ref = parents.get(ref)
+        ids.reverse()
+        paths[id] = PathSeparator + "".join([str(i) + PathSeparator for i in ids])
+        return paths[id]
+
+    ph = db.placeholder
+    sql = "UPDATE %s SET %s=%s WHERE id=%s" % (db.MetaTable, PathField, ph, ph)
+    for id in parents:
+        db.Execute(sql, [path(id), id]).close()
+    db.Commit()
+    return len(parents)
+
+
+class PathIndex(object):
+    """
+    Object extension. Writes the items path on commit if the items container changed and
+    rewrites the paths of contained items if a container is moved.
+    """
+
+    def Init(self):
+        if not PathEnabled(self.app):
+            return
+        self.ListenEvent("commit", "UpdatePath")
+
+    def UpdatePath(self, **kw):
+        path = ItemPath(self)
+        current = self.meta.get(PathField)
+        if current == path:
+            return
+        db = self.db
+        EnsurePathIndex(self.app, db)
+        self.meta[PathField] = path
+        if current:
+            # moved: update all contained items
+            id = str(self.id) + PathSeparator
+            MovePaths(db, current + id, path + id)
@@ -24,7 +24,8 @@ class item(Container):
 configuration = ObjectConf(
     id = "item",
     context = "nive_datastore.item.item",
-    extensions = ("nive_datastore.pydispatch.Dispatcher",),
+    extensions = ("nive_datastore.pydispatch.Dispatcher", "nive_datastore.cache.CacheInvalidation",
+                  "nive_datastore.fulltext.TextIndex", "nive_datastore.hierarchy.PathIndex"),
     name = _("Data item"),
     description = ""
 )
@@ -29,12 +29,25 @@ handles virtual request and reponse objects for view processing:
 - request.response
 - response.status
 
+Direct mode returns the views result without rendering. The result of json views is
+returned as python values instead of serializing and parsing the json string ::
+
+    result, status = todos.api.dispatch("search", direct=True, profile="todos")
+
+Values are not converted by the json renderer, e.g. dates are returned as datetime objects.
+Views returning a response object return the response.
 """
 import json
+import threading
 
-from pyramid.view import render_view
+from pyramid.view import render_view, render_view_to_response
+from pyramid.interfaces import IRendererFactory
 from pyramid import testing
 
+# renderer name used to capture view results in direct mode
+DirectRenderer = "nive_datastore_direct"
+_lock = threading.Lock()
+
 
 class DispatchResponse(object):
     status = None
@@ -48,12 +61,14 @@ class DispatchRequest(object):
 
 class Dispatcher(object):
   
-    def dispatch(self, method, secure=False, request=None, **kw):
+    def dispatch(self, method, secure=False, request=None, direct=False, **kw):
         """
         If *secure* is true permissions of the current user are checked against the view. If the
         user lacks the necessary permissions and empty string is returned or if *raiseUnauthorized*
         is True HTTPForbidden is raised. 
         
+        If *direct* is true the views result is returned without rendering.
+
         returns rendered result
         """
         if not request:
@@ -64,6 +79,8 @@ class Dispatcher(object):
         disprequest.POST = kw
         disprequest.method = "POST"
         disprequest.content_type = "dict"
+        if direct:
+            return self._dispatchDirect(method, secure, disprequest)
         value = render_view(self, disprequest, method, secure)
         if value is None:
             value = {}
@@ -72,5 +89,24 @@ class Dispatcher(object):
         return value, disprequest.response.status
 
 
-
-
+    def _dispatchDirect(self, method, secure, disprequest):
+        # the view is called with all view derivers including the permission check. the
+        # renderer is replaced by the direct renderer storing the views result on the request.
+        registry = disprequest.registry
+        if registry.queryUtility(IRendererFactory, name=DirectRenderer) is None:
+            with _lock:
+                registry.registerUtility(DirectRendererFactory, IRendererFactory, name=DirectRenderer)
+        disprequest.override_renderer = DirectRenderer
+        response = render_view_to_response(self, disprequest, method, secure)
+        if response is None:
+            return {}, disprequest.response.status
+        if "dispatchResult" in disprequest.__dict__:
+            return disprequest.dispatchResult, response.status
+        return response, response.status
+
+
+def DirectRendererFactory(info):
+    def _render(value, system):
+        system["request"].dispatchResult = value
+        return ""
+    return _render
@@ -0,0 +1,211 @@
+# Copyright 2012-2020 Arndt Droullier, Nive GmbH. All rights reserved.
+# Released under GPL3. See license.txt
+
+"""
+Slow query log
+--------------
+Records sql statements running longer than a threshold during api calls. Each record includes
+the statement, the bound values, the api view and search or subtree profile name and the query
+plan (`EXPLAIN`) of the statement.
+
+The log is activated by adding `slowQueryLog` to the application configuration ::
+
+    app = AppConf("nive_datastore.app",
+                  slowQueryLog = {"threshold": 0.5, "file": "/var/log/datastore/slow.log"},
+                  # ...
+    )
+
+- *threshold*: (number) seconds. Statements running longer are recorded. Default 0.5.
+- *maxRecords*: (number) number of recent records kept in memory. Default 100.
+- *explain*: (bool) capture the query plan for select statements. Default True.
+- *file*: (string) optional log file. Records are written as json lines. The file is rotated
+  after `maxBytes` (default 1MB) and `backupCount` (default 5) backups are kept.
+
+Recent records can be retrieved by admins with the `slowQueries` api view. Statements are traced
+for the views decorated with `TraceQueries()`: `search`, `listItems`, `subtree`, `getItem` and
+`deleteItem`. Other statements are not timed.
+"""
+
+import json
+import time
+import logging
+import functools
+import threading
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+from nive_datastore.fulltext import DbBackend
+
+DefaultThreshold = 0.5
+DefaultMaxRecords = 100
+DefaultMaxBytes = 1024*1024
+DefaultBackupCount = 5
+
+# the active trace context (log, view name, profile name) of the current thread
+_trace = threading.local()
+
+
+class SlowQueryLog(object):
+    """
+    Keeps the recent slow query records in memory and writes them to the logger
+    `nive_datastore.slowqueries`.
+    """
+
+    def __init__(self, threshold=DefaultThreshold, maxRecords=DefaultMaxRecords, explain=True,
+                 file=None, maxBytes=DefaultMaxBytes, backupCount=DefaultBackupCount):
+        self.threshold = threshold
+        self.explain = explain
+        self._records = deque(maxlen=maxRecords)
+        self._lock = threading.Lock()
+        self.log = logging.getLogger("nive_datastore.slowqueries")
+        if file:
+            self.log = logging.getLogger("nive_datastore.slowqueries.%s" % (file))
+            if not self.log.handlers:
+                handler = RotatingFileHandler(file, maxBytes=maxBytes, backupCount=backupCount)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self.log.addHandler(handler)
+                self.log.setLevel(logging.INFO)
+
+
+    def Record(self, sql, values, duration, view=None, profile=None, explain=None):
+        """
+        Adds a slow statement record.
+        """
+        record = {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                  "duration": round(duration, 4),
+                  "view": view,
+                  "profile": profile,
+                  "sql": " ".join(sql.split()),
+                  "values": [v if isinstance(v, (int, float, str, type(None))) else repr(v) for v in values or ()],
+                  "explain": explain}
+        with self._lock:
+            self._records.append(record)
+        self.log.warning(json.dumps(record))
+        return record
+
+
+    def Records(self):
+        """
+        Returns the recent records. Latest first.
+        """
+        with self._lock:
+            records = list(self._records)
+        records.reverse()
+        return records
+
+
+    def Clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+    def Explain(self, db, cursorFactory, sql, values):
+        """
+        Returns the query plan for select statements as list of strings or None.
+        """
+        if not self.explain or not sql.lstrip().upper().startswith("SELECT"):
+            return None
+        prefix = "EXPLAIN QUERY PLAN " if DbBackend(db) == "sqlite" else "EXPLAIN "
+        cursor = cursorFactory()
+        try:
+            cursor.execute(prefix + sql, values)
+            return [" | ".join([str(c) for c in row]) for row in cursor.fetchall()]
+        except Exception as e:
+            return ["explain failed: %s" % (str(e))]
+        finally:
+            cursor.close()
+
+
+class TimedCursor(object):
+    """
+    Database cursor proxy timing `execute()` calls.
+    """
+
+    def __init__(self, cursor, cursorFactory, db, context):
+        self._cursor = cursor
+        self._cursorFactory = cursorFactory
+        self._db = db
+        self._context = context
+
+    def execute(self, sql, values=None):
+        t = time.time()
+        result = self._cursor.execute(sql, values)
+        duration = time.time() - t
+        log, view, profile = self._context
+        if duration >= log.threshold:
+            explain = log.Explain(self._db, self._cursorFactory, sql, values)
+            log.Record(sql, values, duration, view=view, profile=profile, explain=explain)
+        return result
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def SetupSlowQueryLog(conf):
+    """
+    Creates the slow query log based on the `slowQueryLog` configuration value. Returns
+    None if not configured.
+    """
+    if not conf:
+        return None
+    if not isinstance(conf, dict):
+        conf = {}
+    return SlowQueryLog(threshold=conf.get("threshold", DefaultThreshold),
+                        maxRecords=conf.get("maxRecords", DefaultMaxRecords),
+                        explain=conf.get("explain", True),
+                        file=conf.get("file"),
+                        maxBytes=conf.get("maxBytes", DefaultMaxBytes),
+                        backupCount=conf.get("backupCount", DefaultBackupCount))
+
+
+def InstallQueryTracer(db):
+    """
+    Wraps the database connections cursor factory. While a view is traced cursors are
+    returned as `TimedCursor`, otherwise the plain cursor is returned.
+    """
+    conn = db.usedconnection
+    if conn is None or getattr(conn, "_c_traced", False):
+        return
+    cursorFactory = conn.cursor
+
+    def cursor():
+        c = cursorFactory()
+        context = getattr(_trace, "context", None)
+        if context is None:
+            return c
+        return TimedCursor(c, cursorFactory, db, context)
+
+    conn.cursor = cursor
+    conn._c_traced = True
+
+
+def TraceQueries(name, profile=False):
+    """
+    View decorator. Times all statements executed while the view is called and records slow
+    statements in the applications slow query log. If `profile` is True the profile name is
+    taken from the request or the customized views name.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(view, *args, **kw):
+            log = getattr(view.context.app, "slowQueryLog", None)
+            if log is None:
+                return func(view, *args, **kw)
+            label = None
+            if profile:
+                viewconf = view.GetViewConf()
+                if viewconf and viewconf.get("settings"):
+                    label = viewconf.get("name") or viewconf.get("attr")
+                else:
+                    label = view.GetFormValue("profile", "default")
+            previous = getattr(_trace, "context", None)
+            _trace.context = (log, name, label)
+            try:
+                return func(view, *args, **kw)
+            finally:
+                _trace.context = previous
+        return wrapper
+    return decorator
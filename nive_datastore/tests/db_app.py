@@ -8,6 +8,7 @@ from nive.utils.path import DvPath
 from nive.definitions import ObjectConf, FieldConf, AppConf, DatabaseConf
 from nive.portal import Portal
 from nive_datastore.app import DataStorage
+from nive_datastore.hierarchy import HierarchyFlds
 
 
 collection1 = ObjectConf("nive_datastore.item",
@@ -18,7 +19,7 @@ collection1 = ObjectConf("nive_datastore.item",
     data = (
         FieldConf(id="link",     datatype="url",  size=500,   default="",  name="Link url"),
         FieldConf(id="share",    datatype="bool", size=2,     default=False,name="Share link"),
-        FieldConf(id="comment",  datatype="text", size=50000, default="",  name="Comment"),
+        FieldConf(id="comment",  datatype="text", size=50000, default="",  name="Comment", textIndex=True),
     ),
     forms = {
         "newItem": {"fields": ("link", "share", "comment"), "ajax":True, "newItem": True}, 
@@ -54,6 +55,7 @@ appconf = AppConf("nive_datastore.app",
                  "fields": ["id", "link", "comment", "pool_changedby"],
                  "parameter": {},
                  "dynamic": {"size":10},
+                 "facets": ["share", "pool_state"],
                  "size": 10},
             "tracks":
                 {"pool_type": "track",
@@ -65,9 +67,11 @@ appconf = AppConf("nive_datastore.app",
                 {"container": False,
                  "fields": ["id", "pool_create", "pool_changedby"],
                  "dynamic": {"size":10, "start": 1},
+                 "facets": ["pool_type"],
                  "parameter": {}},
     },
 )
+appconf.meta = list(appconf.meta) + list(HierarchyFlds)
 appconf.modules.append(collection1)
 appconf.modules.append(collection2)
 appconf.lock()
@@ -87,6 +91,7 @@ def app_db(confs=None):
     try:
         a.Query("select id from pool_meta where id=1")
         a.Query("select pool_wfp from pool_meta where id=1")
+        a.Query("select pool_path from pool_meta where id=1")
         a.Query("select id from bookmarks where id=1")
         a.Query("select id from tracks where id=1")
         a.Query("select id from pool_files where id=1")
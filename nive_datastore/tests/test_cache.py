@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from nive.security import User
+from nive_datastore.cache import ResultCache, MakeCacheKey, QueryTags, SetupResultCache
+from nive_datastore.cache import FragmentCache, SetupFragmentCache
+from nive_datastore.tests import db_app
+from nive_datastore.tests import __local
+
+
+class CacheTest(unittest.TestCase):
+
+    def test_cache(self):
+        cache = ResultCache(maxEntries=3, ttl=0)
+        cache.Set("a", 1, tags=("bookmark",))
+        cache.Set("b", 2, tags=("track",))
+        cache.Set("c", 3, tags=("*",))
+        self.assertEqual(cache.Get("a"), 1)
+        self.assertEqual(cache.Get("x"), None)
+        self.assertEqual(cache.Stats()["hits"], 1)
+        self.assertEqual(cache.Stats()["misses"], 1)
+
+        # invalidates a and c
+        self.assertEqual(cache.Invalidate("bookmark"), 2)
+        self.assertEqual(cache.Get("a"), None)
+        self.assertEqual(cache.Get("b"), 2)
+        self.assertEqual(cache.Get("c"), None)
+        self.assertEqual(cache.Invalidate("*"), 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_lru(self):
+        cache = ResultCache(maxEntries=2, ttl=0)
+        cache.Set("a", 1)
+        cache.Set("b", 2)
+        cache.Get("a")
+        cache.Set("c", 3)
+        self.assertEqual(cache.Get("b"), None)
+        self.assertEqual(cache.Get("a"), 1)
+        self.assertEqual(cache.Stats()["evictions"], 1)
+
+    def test_ttl(self):
+        cache = ResultCache(maxEntries=2, ttl=0.01)
+        cache.Set("a", 1)
+        time.sleep(0.02)
+        self.assertEqual(cache.Get("a"), None)
+
+    def test_versions(self):
+        cache = ResultCache()
+        self.assertEqual(cache.Version(1), 0)
+        cache.BumpVersions([2, 1, 0])
+        cache.BumpVersions([1, 0])
+        self.assertEqual(cache.Version(2), 1)
+        self.assertEqual(cache.Version(0), 2)
+
+    def test_functions(self):
+        self.assertEqual(MakeCacheKey({"a": 1, "b": 2}), MakeCacheKey({"b": 2, "a": 1}))
+        self.assertEqual(QueryTags("bookmark"), ("bookmark",))
+        self.assertEqual(QueryTags(None, {"pool_type": ["a", "b"]}, {"pool_type": "IN"}), ("a", "b"))
+        self.assertEqual(QueryTags(None, {"pool_type": "a"}, {"pool_type": "<>"}), ("*",))
+        self.assertEqual(QueryTags(None, {}), ("*",))
+        self.assertEqual(SetupResultCache(None), None)
+        self.assertEqual(SetupResultCache(True).maxEntries, 1000)
+        self.assertEqual(SetupResultCache({"maxEntries": 10}).maxEntries, 10)
+        self.assertEqual(SetupFragmentCache(None), None)
+        self.assertEqual(SetupFragmentCache({"maxBytes": 10}).maxBytes, 10)
+
+    def test_fragments(self):
+        cache = FragmentCache(maxBytes=10)
+        cache.Set("a1", "1234", 1)
+        cache.Set("a2", "1234", 1)
+        cache.Set("b", "12", 2)
+        self.assertEqual(cache.size, 10)
+        self.assertEqual(cache.Get("a1"), "1234")
+        # lru by size
+        cache.Set("c", "123", 3)
+        self.assertEqual(cache.Get("a2"), None)
+        self.assertEqual(cache.size, 9)
+        self.assertEqual(cache.Stats()["evictions"], 1)
+        # too large
+        cache.Set("d", "12345678901", 4)
+        self.assertEqual(cache.Get("d"), None)
+
+        self.assertEqual(cache.InvalidateItems([1, 2]), 2)
+        self.assertEqual(cache.Get("a1"), None)
+        self.assertEqual(cache.Get("c"), "123")
+        self.assertEqual(cache.size, 3)
+        cache.Clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+
+class CacheTest_db(object):
+
+    def setUp(self):
+        self._loadApp()
+        self.app.searchCache = ResultCache()
+        self.app.fragmentCache = FragmentCache()
+
+    def tearDown(self):
+        u = User("test")
+        root = self.app.root
+        for r in root.GetObjsList(fields=["id"]):
+            root.Delete(r["id"], u)
+        self.app.Close()
+
+    def test_invalidation(self):
+        cache = self.app.searchCache
+        user = User("test")
+        r = self.app.root
+        cache.Set("b", 1, tags=("bookmark",))
+        cache.Set("t", 1, tags=("track",))
+        o = db_app.create_bookmark(r, user)
+        self.assertEqual(cache.Get("b"), None)
+        self.assertEqual(cache.Get("t"), 1)
+
+        cache.Set("b", 1, tags=("bookmark",))
+        o.Update({"comment": "new"}, user)
+        self.assertEqual(cache.Get("b"), None)
+        self.assertEqual(cache.Get("t"), 1)
+
+        cache.Set("b", 1, tags=("bookmark",))
+        r.Delete(o.id, user)
+        self.assertEqual(cache.Get("b"), None)
+        self.assertEqual(cache.Get("t"), 1)
+
+    def test_commitinvalidation(self):
+        cache = self.app.searchCache
+        user = User("test")
+        o = db_app.create_bookmark(self.app.root, user)
+        # a concurrent request caches the old values before the changes are committed
+        versions = []
+        def recache(**kw):
+            cache.Set("b", 1, tags=("bookmark",))
+            versions.append(cache.Version(o.id))
+        o.ListenEvent("commit", recache)
+        o.Update({"comment": "new"}, user)
+        self.assertEqual(cache.Get("b"), None)
+        # subtrees cached with the old version are not used anymore
+        self.assertTrue(cache.Version(o.id) > versions[0])
+
+    def test_fragmentinvalidation(self):
+        fragments = self.app.fragmentCache
+        user = User("test")
+        r = self.app.root
+        o = db_app.create_bookmark(r, user)
+        o2 = db_app.create_bookmark(o, user)
+        o3 = db_app.create_bookmark(r, user)
+        fragments.Set("o", "markup", o.id)
+        fragments.Set("o3", "markup", o3.id)
+        # parents are invalidated with the item
+        o2.Update({"comment": "new"}, user)
+        self.assertEqual(fragments.Get("o"), None)
+        self.assertEqual(fragments.Get("o3"), "markup")
+        r.Delete(o3.id, user)
+        self.assertEqual(fragments.Get("o3"), None)
+
+
+class CacheTest_db_Sqlite(CacheTest_db, __local.SqliteTestCase):
+    pass
+
+class CacheTest_db_MySql(CacheTest_db, __local.MySqlTestCase):
+    pass
+
+class CacheTest_db_Postgres(CacheTest_db, __local.PostgreSqlTestCase):
+    pass
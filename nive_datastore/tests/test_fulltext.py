@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from nive.security import User
+from nive.definitions import ConfigurationError
+from nive_datastore.fulltext import IndexFields, SqliteQuery, MysqlQuery, FmtText, RebuildTextIndex
+from nive_datastore.webapi.profiles import SearchProfile, GetSearchProfile
+from nive_datastore.tests import db_app
+from nive_datastore.tests import __local
+
+
+class FulltextTest(unittest.TestCase):
+
+    def test_functions(self):
+        self.assertEqual(IndexFields(db_app.collection1), ("comment",))
+        self.assertEqual(IndexFields(db_app.collection2), ())
+        self.assertEqual(SqliteQuery('some "text" -x'), '"some" """text""" "-x"')
+        self.assertEqual(MysqlQuery('some "text" -x ""'), '+"some" +"text" +"-x"')
+        self.assertEqual(FmtText(["a", None, "", 1]), "a\n1")
+
+
+class FulltextTest_db(object):
+
+    def setUp(self):
+        self._loadApp()
+
+    def tearDown(self):
+        u = User("test")
+        root = self.app.root
+        for r in root.GetObjsList(fields=["id"]):
+            root.Delete(r["id"], u)
+        self.app.Close()
+
+    def _search(self, text, sort=None, ascending=None):
+        profile = GetSearchProfile(self.app, self.profile)
+        return profile.Search(self.app.root.search, {"text": text}, start=0, max=10, sort=sort, ascending=ascending)
+
+    profile = {"type": "bookmark",
+               "fields": ["id", "comment"],
+               "operators": {"text": "MATCH"}}
+
+    def test_match(self):
+        user = User("test")
+        r = self.app.root
+        o1 = r.Create("bookmark", data={"link": "a", "comment": "red apples and green pears"}, user=user)
+        o2 = r.Create("bookmark", data={"link": "b", "comment": "green apples"}, user=user)
+        o3 = r.Create("bookmark", data={"link": "c", "comment": "bananas bananas bananas"}, user=user)
+        db_app.create_track(r, user)
+
+        result = self._search("apples")
+        self.assertEqual(set(i["id"] for i in result["items"]), {o1.id, o2.id})
+        self.assertEqual(result["total"], 2)
+        result = self._search("green apples")
+        self.assertEqual(len(result["items"]), 2)
+        result = self._search("red apples")
+        self.assertEqual([i["id"] for i in result["items"]], [o1.id])
+        # empty phrase does not filter
+        result = self._search("")
+        self.assertEqual(len(result["items"]), 3)
+        self.assertEqual(result["criteria"]["text"], "")
+
+        # relevance
+        r.Create("bookmark", data={"link": "d", "comment": "bananas and more"}, user=user)
+        result = self._search("bananas", sort="relevance")
+        self.assertEqual(result["items"][0]["id"], o3.id)
+        result = self._search("bananas", sort="relevance", ascending=1)
+        self.assertEqual(result["items"][-1]["id"], o3.id)
+
+        # update and delete
+        o2.Update({"comment": "yellow bananas"}, user)
+        result = self._search("apples")
+        self.assertEqual([i["id"] for i in result["items"]], [o1.id])
+        r.Delete(o1.id, user)
+        result = self._search("apples")
+        self.assertEqual(len(result["items"]), 0)
+
+        self.assertEqual(RebuildTextIndex(self.app, "bookmark"), 3)
+        self.assertEqual(RebuildTextIndex(self.app, "track"), 0)
+        result = self._search("bananas")
+        self.assertEqual(len(result["items"]), 3)
+
+    def test_profile(self):
+        compiled = SearchProfile(self.profile, self.app)
+        self.assertTrue("relevance" in compiled.sortFields)
+        self.assertRaises(ConfigurationError, SearchProfile, {"operators": {"text": "MATCH"}}, self.app)
+
+
+class FulltextTest_db_Sqlite(FulltextTest_db, __local.SqliteTestCase):
+    """
+    see tests.__local
+    """
+
+class FulltextTest_db_MySql(FulltextTest_db, __local.MySqlTestCase):
+    """
+    see tests.__local
+    """
+
+class FulltextTest_db_Postgres(FulltextTest_db, __local.PostgreSqlTestCase):
+    """
+    see tests.__local
+    """
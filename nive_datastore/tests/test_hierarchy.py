@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from nive.security import User
+from nive.definitions import ConfigurationError, Conf
+from nive_datastore.hierarchy import ItemPath, DescendantsRange, RebuildPaths, PathField
+from nive_datastore.webapi.profiles import SearchProfile, GetSearchProfile
+from nive_datastore.webapi.tree import ChildQuery, DefaultLevels
+from nive_datastore.tests import db_app
+from nive_datastore.tests import __local
+
+
+class HierarchyTest_db(object):
+
+    def setUp(self):
+        self._loadApp()
+
+    def tearDown(self):
+        u = User("test")
+        root = self.app.root
+        for r in root.GetObjsList(fields=["id"]):
+            root.Delete(r["id"], u)
+        self.app.Close()
+
+    def _tree(self):
+        user = User("test")
+        r = self.app.root
+        o1 = db_app.create_bookmark(r, user)
+        o2 = db_app.create_bookmark(o1, user)
+        o3 = db_app.create_bookmark(o2, user)
+        o4 = db_app.create_bookmark(r, user)
+        t1 = db_app.create_track(o3, user)
+        return o1, o2, o3, o4, t1
+
+    def test_paths(self):
+        o1, o2, o3, o4, t1 = self._tree()
+        self.assertEqual(ItemPath(self.app.root), None)
+        self.assertEqual(o1.meta[PathField], "/")
+        self.assertEqual(o3.meta[PathField], "/%d/%d/" % (o1.id, o2.id))
+        self.assertEqual(t1.meta[PathField], "/%d/%d/%d/" % (o1.id, o2.id, o3.id))
+        self.assertEqual(DescendantsRange(self.app.root), None)
+        self.assertEqual(DescendantsRange(o1), ("/%d/" % o1.id, "/%d0" % o1.id))
+
+        db = self.app.db
+        db.Execute("UPDATE pool_meta SET %s=''" % (PathField)).close()
+        db.Commit()
+        self.assertTrue(RebuildPaths(self.app) >= 5)
+        o3 = self.app.root.LookupObj(o3.id)
+        self.assertEqual(o3.meta[PathField], "/%d/%d/" % (o1.id, o2.id))
+
+    def test_search(self):
+        o1, o2, o3, o4, t1 = self._tree()
+        profile = GetSearchProfile(self.app, {"container": "deep", "fields": ["id"]})
+        self.assertEqual(profile.operators[PathField], "BETWEEN")
+        result = profile.Search(self.app.root.search, {PathField: DescendantsRange(o1)}, start=0, max=10)
+        self.assertEqual(set(i["id"] for i in result["items"]), {o2.id, o3.id, t1.id})
+        result = profile.Search(self.app.root.search, {PathField: DescendantsRange(o3)}, start=0, max=10)
+        self.assertEqual([i["id"] for i in result["items"]], [t1.id])
+
+    def test_childquery(self):
+        o1, o2, o3, o4, t1 = self._tree()
+        r = self.app.root
+        query = ChildQuery(r, {}, {}, ["id", "pool_unitref"], DefaultLevels)
+        self.assertTrue(query.usePath)
+        self.assertEqual([c["id"] for c in query.Select([o2.id, o3.id], "id")], [o3.id, t1.id])
+        self.assertEqual([c["id"] for c in query.Select([r.id], "id")], [o1.id, o4.id])
+        query = ChildQuery(o1, {}, {}, ["id", "pool_unitref"], 1)
+        self.assertFalse(query.usePath)
+        self.assertEqual([c["id"] for c in query.Select([o1.id], "id")], [o2.id])
+        # limited levels: items below the last level are not selected
+        query = ChildQuery(r, {}, {}, ["id", "pool_unitref"], 2)
+        self.assertFalse(query.usePath)
+        self.assertEqual([c["id"] for c in query.Select([r.id], "id")], [o1.id, o4.id])
+        self.assertEqual(query._descendants, None)
+
+
+class HierarchyTest_db_Sqlite(HierarchyTest_db, __local.SqliteTestCase):
+    """
+    see tests.__local
+    """
+
+class HierarchyTest_db_MySql(HierarchyTest_db, __local.MySqlTestCase):
+    """
+    see tests.__local
+    """
+
+class HierarchyTest_db_Postgres(HierarchyTest_db, __local.PostgreSqlTestCase):
+    """
+    see tests.__local
+    """
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from nive.security import User
+from nive_datastore.querylog import SlowQueryLog, SetupSlowQueryLog, InstallQueryTracer
+from nive_datastore.webapi.view import APIv1
+from nive_datastore.tests import db_app
+from nive_datastore.tests import __local
+
+from pyramid import testing
+
+
+class QueryLogTest(unittest.TestCase):
+
+    def test_log(self):
+        log = SlowQueryLog(threshold=0.1, maxRecords=2)
+        log.Record("select  1\n from x", [1, object()], 0.2, view="search", profile="default")
+        log.Record("select 2", [], 0.2)
+        log.Record("select 3", None, 0.3)
+        records = log.Records()
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]["sql"], "select 3")
+        self.assertEqual(records[1]["sql"], "select 2")
+        log.Clear()
+        self.assertEqual(log.Records(), [])
+
+    def test_setup(self):
+        self.assertEqual(SetupSlowQueryLog(None), None)
+        self.assertEqual(SetupSlowQueryLog(True).threshold, 0.5)
+        self.assertEqual(SetupSlowQueryLog({"threshold": 2}).threshold, 2)
+
+
+class QueryLogTest_db(object):
+
+    def setUp(self):
+        request = testing.DummyRequest()
+        request._LOCALE_ = "en"
+        self.request = request
+        self.request.content_type = ""
+        self.request.method = "POST"
+        self.config = testing.setUp(request=request)
+        self._loadApp()
+        self.app.Startup(self.config)
+        self.root = self.app.root
+        self.request.context = self.root
+
+    def tearDown(self):
+        self.app.slowQueryLog = None
+        user = User("test")
+        for r in self.root.GetObjsList(fields=["id"]):
+            self.root.Delete(r["id"], user)
+        self.app.Close()
+        testing.tearDown()
+
+    def test_trace(self):
+        user = User("test")
+        db_app.create_bookmark(self.root, user)
+        log = self.app.slowQueryLog = SlowQueryLog(threshold=0)
+        InstallQueryTracer(self.app.db)
+        # not traced
+        self.root.GetObjsList(fields=["id"])
+        self.assertEqual(log.Records(), [])
+
+        view = APIv1(self.root, self.request)
+        self.request.POST = {"profile": "bookmarks"}
+        result = view.search()
+        self.assertTrue(len(result["items"])==1)
+        records = log.Records()
+        self.assertTrue(records, records)
+        self.assertEqual(records[0]["view"], "search")
+        self.assertEqual(records[0]["profile"], "bookmarks")
+        self.assertTrue(records[0]["sql"].startswith("SELECT"))
+        self.assertTrue(records[0]["explain"])
+
+        result = view.slowQueries()
+        self.assertTrue(result["records"])
+        self.request.POST = {"clear": "1"}
+        view.slowQueries()
+        self.assertEqual(log.Records(), [])
+
+        view.listItems()
+        self.assertEqual(log.Records()[0]["view"], "listItems")
+        self.assertEqual(log.Records()[0]["profile"], None)
+
+
+class QueryLogTest_db_Sqlite(QueryLogTest_db, __local.SqliteTestCase):
+    """
+    see tests.__local
+    """
+
+class QueryLogTest_db_MySql(QueryLogTest_db, __local.MySqlTestCase):
+    """
+    see tests.__local
+    """
+
+class QueryLogTest_db_Postgres(QueryLogTest_db, __local.PostgreSqlTestCase):
+    """
+    see tests.__local
+    """
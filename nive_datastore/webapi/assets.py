@@ -0,0 +1,233 @@
+# Copyright 2012-2020 Arndt Droullier, Nive GmbH. All rights reserved.
+# Released under GPL3. See license.txt
+
+"""
+Form asset bundles
+------------------
+Form widgets require a number of css and js files. `HTMLForm.HTMLHead()` links each file
+separately, so browsers fetch a dozen small files per form.
+
+If `bundleAssets` is set in the application configuration the form views link one css and
+one js bundle instead ::
+
+    app = AppConf("nive_datastore.app",
+                  bundleAssets = True,
+                  # ...
+    )
+
+Bundles are built once per set of files and kept in memory. The bundle name is the hash of
+its contents, so bundles are served by the `assetBundle` view with far future cache headers.
+The bundle url also lists the bundled files: a process not knowing the bundle yet (e.g.
+after a restart or in a multi process setup) builds it on request.
+
+Relative urls in css files are rewritten to the static urls of the referenced files. Files
+not located in python packages (absolute urls) are linked as before.
+
+Bundles requested by url can only include resources of the registered form widgets
+(`reform.Field.default_resource_registry`) or files linked by `FormHead()` in this process.
+At most `BundleMaxEntries` bundles are kept, the least recently used are removed.
+"""
+
+import re
+import hashlib
+import posixpath
+from urllib.parse import quote
+
+from pyramid.path import AssetResolver
+
+from nive.components.reform.field import Field
+
+from nive_datastore.cache import ResultCache
+
+# name of the view serving bundles
+BundleViewName = "assetBundle"
+# browsers cache bundles for one year
+BundleMaxAge = 365*24*3600
+# bundle types and their mime types
+BundleTypes = {"css": "text/css", "js": "application/javascript"}
+# separates file names in bundle urls
+BundleSeparator = ","
+# maximum number of cached bundles
+BundleMaxEntries = 100
+
+_cssUrl = re.compile(rb"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+class AssetBundle(object):
+    """
+    A bundle of css or js files. `name` is `<content hash>.<kind>`.
+    """
+
+    def __init__(self, kind, specs, body):
+        self.kind = kind
+        self.specs = tuple(specs)
+        self.body = body
+        self.mime = BundleTypes[kind]
+        self.name = "%s.%s" % (hashlib.sha1(body).hexdigest()[:16], kind)
+
+
+def FormResources(form, ignore=()):
+    """
+    Returns the css and js files required by the forms widgets as two lists. Uses the same
+    selection as `HTMLForm.HTMLHead()`: `ignore` lists file names included elsewhere.
+    """
+    form._SetUpSchema()
+    resources = form.get_widget_resources()
+    js = [r for r in resources.get("js") or () if r not in ignore]
+    css = [r for r in resources.get("css") or () if r not in ignore]
+    for name, spec in resources.get("seq") or ():
+        if name in ignore:
+            continue
+        if spec.endswith(".js"):
+            js.append(spec)
+        elif spec.endswith(".css"):
+            css.append(spec)
+    return css, js
+
+
+def Bundleable(spec, kind):
+    """
+    Returns True if `spec` is a package asset specification of the bundle type.
+    """
+    if spec.startswith(("http://", "https://", "/")) or not ":" in spec:
+        return False
+    return spec.endswith("." + kind) and not ".." in spec.split(":", 1)[1].split("/")
+
+
+def BuildBundle(request, kind, specs):
+    """
+    Reads and concatenates the files. Relative urls in css files are rewritten to static urls.
+    Raises IOError if a file does not exist.
+    """
+    resolver = AssetResolver()
+    parts = []
+    for spec in specs:
+        with open(resolver.resolve(spec).abspath(), "rb") as f:
+            data = f.read()
+        if kind == "css":
+            data = _RewriteCssUrls(request, spec, data)
+        parts.append(data)
+    if kind == "js":
+        # files not ending with a semicolon
+        return AssetBundle(kind, specs, b"\n;\n".join(parts))
+    return AssetBundle(kind, specs, b"\n".join(parts))
+
+
+def GetBundle(app, request, kind, specs):
+    """
+    Returns the bundle for the files. Bundles are built once and cached by file list and name.
+    """
+    bundles = _Bundles(app)
+    key = (kind, tuple(specs))
+    bundle = bundles.Get(key)
+    if bundle is None:
+        bundle = BuildBundle(request, kind, specs)
+        _StoreBundle(bundles, bundle)
+    return bundle
+
+
+def LookupBundle(app, request, name, specs=None):
+    """
+    Returns the bundle `name` or None. Unknown bundles are built from `specs` if all files
+    are known form resources and the contents match the name.
+    """
+    bundles = _Bundles(app)
+    bundle = bundles.Get(name)
+    if bundle is not None or not specs:
+        return bundle
+    kind = name.rsplit(".", 1)[-1]
+    if kind not in BundleTypes or not all(Bundleable(s, kind) for s in specs):
+        return None
+    known = WidgetResources(app)
+    if not all(s in known for s in specs):
+        return None
+    try:
+        bundle = BuildBundle(request, kind, specs)
+    except (IOError, ValueError):
+        return None
+    if bundle.name != name:
+        # not cached. the file list does not match the name.
+        return None
+    _StoreBundle(bundles, bundle)
+    return bundle
+
+
+def WidgetResources(app):
+    """
+    Returns the resources bundles can be built from: all files of the default widget resource
+    registry and the files linked by `FormHead()`.
+    """
+    resources = set(_LinkedResources(app))
+    for versions in Field.default_resource_registry.registry.values():
+        for sources in versions.values():
+            for thing in ("js", "css"):
+                value = sources.get(thing) or ()
+                resources.update((value,) if isinstance(value, str) else value)
+            resources.update(spec for name, spec in sources.get("seq") or ())
+    return resources
+
+
+def FormHead(view, form, ignore=()):
+    """
+    Returns the css and js tags for the form like `HTMLForm.HTMLHead()` but links bundles
+    instead of single files.
+    """
+    css, js = FormResources(form, ignore)
+    app = view.context.app
+    base = view.Url(view.context.root) + BundleViewName + "/"
+    links = {}
+    linked = _LinkedResources(app)
+    for kind, specs in (("css", css), ("js", js)):
+        bundled = [s for s in specs if Bundleable(s, kind)]
+        linked.update(bundled)
+        links[kind] = [view.StaticUrl(s) for s in specs if not Bundleable(s, kind)]
+        if bundled:
+            bundle = GetBundle(app, view.request, kind, bundled)
+            links[kind].append("%s%s?files=%s" % (base, bundle.name, quote(BundleSeparator.join(bundled), safe="")))
+    js_tags = ['<script src="%s" type="text/javascript"></script>' % link for link in links["js"]]
+    css_tags = ['<link href="%s" rel="stylesheet" type="text/css" media="all">' % link for link in links["css"]]
+    return ("\r\n").join(css_tags + js_tags)
+
+
+def _RewriteCssUrls(request, spec, data):
+    # relative urls point to files next to the css file
+    package, path = spec.split(":", 1)
+    directory = posixpath.dirname(path)
+
+    def replace(match):
+        url = match.group(2).strip()
+        if url.startswith((b"data:", b"http:", b"https:", b"/", b"#")):
+            return match.group(0)
+        url = url.decode("utf-8")
+        # keep query strings and fragments e.g. `font.eot?#iefix`
+        pos = min([i for i in (url.find("?"), url.find("#")) if i != -1] or [len(url)])
+        url, suffix = url[:pos], url[pos:]
+        target = "%s:%s" % (package, posixpath.normpath(posixpath.join(directory, url)))
+        try:
+            return b'url("' + (request.static_path(target) + suffix).encode("utf-8") + b'")'
+        except ValueError:
+            # no static view registered for the package directory
+            return match.group(0)
+
+    return _cssUrl.sub(replace, data)
+
+
+def _Bundles(app):
+    bundles = getattr(app, "_c_assetbundles", None)
+    if bundles is None:
+        bundles = app._c_assetbundles = ResultCache(maxEntries=BundleMaxEntries*2, ttl=0)
+    return bundles
+
+
+def _StoreBundle(bundles, bundle):
+    # bundles are stored by file list and name
+    bundles.Set((bundle.kind, bundle.specs), bundle)
+    bundles.Set(bundle.name, bundle)
+
+
+def _LinkedResources(app):
+    try:
+        return app._c_assetlinked
+    except AttributeError:
+        app._c_assetlinked = set()
+        return app._c_assetlinked
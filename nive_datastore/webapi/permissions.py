@@ -0,0 +1,276 @@
+# Copyright 2012-2020 Arndt Droullier, Nive GmbH. All rights reserved.
+# Released under GPL3. See license.txt
+
+"""
+Batched permission checks
+-------------------------
+`request.has_permission()` walks the whole acl lineage (item, containers, root, application,
+portal) for every checked item. Views checking many items (subtrees, lists, batches) repeat
+the same work for each item.
+
+`PermissionEvaluator` evaluates acls like `pyramid.authorization.ACLHelper` for the principals
+of the current request but memoizes the results:
+
+- the result for each container in the lineage is computed once per permission and principals,
+- acls of types without runtime callbacks are evaluated once per type, permission and principals.
+
+Local groups (`nive.extensions.localgroups`) of the user are added to the principals for each
+checked item and its containers, like the principals of a request with the item as context.
+The local groups are loaded once per item and container.
+
+Items can be checked as objects with `Allowed()` and `FilterAllowed()`, or as rows without
+objects with `RowAllowed()` if the types acl is static.
+
+The evaluator is created once per request with `GetPermissionEvaluator(request, app)`.
+If the security policy is not the default `nive.security.AuthTktSecurityPolicy` all checks are
+passed to `request.has_permission()`.
+"""
+
+from pyramid.interfaces import ISecurityPolicy
+from pyramid.util import is_nonstr_iter
+
+from nive.definitions import IObject, ILocalGroups
+from nive.security import Allow, Everyone, Authenticated, AuthTktSecurityPolicy
+
+# maximum number of ids passed to one `IN` query
+MaxInList = 500
+
+
+class PermissionEvaluator(object):
+    """
+    Memoizing acl evaluation for the principals of one request.
+    """
+
+    def __init__(self, request, app):
+        self.request = request
+        self.app = app
+        self.principals = None
+        self.userid = None
+        self.allowAll = False
+        self.requestPrincipals = RequestPrincipals(request)
+        policy = request.registry.queryUtility(ISecurityPolicy)
+        if policy is None:
+            # same as request.has_permission(): no policy, no restrictions
+            self.allowAll = True
+        elif isinstance(policy, AuthTktSecurityPolicy):
+            identity = request.identity
+            if identity is not None:
+                self.userid = identity["userid"]
+            self.principals = self.requestPrincipals
+        self._lineage = {}
+        self._types = {}
+        self._rows = {}
+        # row id: (type id, parent, principals)
+        self._rowParents = {}
+        # location: principals including local groups
+        self._locations = {}
+        # security id: local groups of the user
+        self._groups = {}
+
+
+    def PrincipalsKey(self):
+        """
+        Returns the sorted principals of the request as tuple to be used in cache keys.
+        """
+        return tuple(sorted(self.requestPrincipals))
+
+
+    def Allowed(self, item, permission):
+        """
+        Returns True if `permission` is granted for `item`.
+        """
+        if self.allowAll:
+            return True
+        if self.principals is None:
+            return bool(self.request.has_permission(permission, item))
+        return self._Decision(item, permission, self.Principals(item)) == Allow
+
+
+    def FilterAllowed(self, items, permission):
+        """
+        Returns the items `permission` is granted for. The order is kept.
+        """
+        if self.allowAll:
+            return list(items)
+        return [item for item in items if self.Allowed(item, permission)]
+
+
+    def StaticTypes(self, typenames):
+        """
+        Returns True if rows of all types in `typenames` can be checked with `RowAllowed()`.
+        """
+        if self.allowAll:
+            return True
+        if self.principals is None:
+            return False
+        query = self.app.configurationQuery
+        for typename in typenames:
+            conf = query.GetObjectConf(typename)
+            if conf is None or not _StaticAcl(conf):
+                return False
+        return True
+
+
+    def RowAllowed(self, id, typename, parent, permission):
+        """
+        Checks an item without loading the object. `parent` is either the containers object or
+        the id of a container checked before with `RowAllowed()`. The types acl must be static
+        (see `StaticTypes()`). Use `LoadLocalGroups()` to load the local groups of many rows
+        at once.
+        """
+        if self.allowAll:
+            return True
+        info = self._rowParents.get(id)
+        if info is None:
+            if isinstance(parent, int):
+                principals = self._rowParents[parent][2] if parent in self._rowParents else self.principals
+            else:
+                principals = self.Principals(parent)
+            principals = principals | self._LocalGroups(id)
+            info = self._rowParents[id] = (typename, parent, principals)
+        return self._RowDecision(id, permission, info[2]) == Allow
+
+
+    def Principals(self, location):
+        """
+        Returns the principals for checks of `location`: the principals of the request and the
+        local groups of the user assigned to the location and its containers.
+        """
+        if self.userid is None:
+            return self.principals
+        key = id(location)
+        memo = self._locations.get(key)
+        if memo is not None and memo[0] is location:
+            return memo[1]
+        parent = getattr(location, "__parent__", None)
+        principals = self.Principals(parent) if parent is not None else self.principals
+        if ILocalGroups.providedBy(location):
+            principals = principals | self._LocalGroups(location.securityID)
+        self._locations[key] = (location, principals)
+        return principals
+
+
+    def LoadLocalGroups(self, ids):
+        """
+        Loads the local groups of the user for the item ids with one query per `MaxInList` ids.
+        """
+        if self.userid is None:
+            return
+        ids = [id for id in ids if id not in self._groups]
+        for pos in range(0, len(ids), MaxInList):
+            chunk = ids[pos:pos+MaxInList]
+            groups = {}
+            for userid, group, id in self.app.db.GetGroups(tuple(chunk), userid=self.userid):
+                groups.setdefault(id, []).append(group)
+            for id in chunk:
+                self._groups[id] = frozenset(groups.get(id, ()))
+
+
+    def _LocalGroups(self, securityID):
+        # local groups of the user assigned to the item. loaded once per item.
+        if self.userid is None:
+            return frozenset()
+        groups = self._groups.get(securityID)
+        if groups is None:
+            groups = frozenset(r[1] for r in self.app.db.GetGroups(securityID, userid=self.userid))
+            self._groups[securityID] = groups
+        return groups
+
+
+    def _RowDecision(self, id, permission, principals):
+        # decision of the row and its parents checked before with the principals of the row
+        key = (id, permission, principals)
+        if key in self._rows:
+            return self._rows[key]
+        info = self._rowParents.get(id)
+        decision = None
+        if info is not None:
+            typename, parent, _ = info
+            decision = self._TypeDecision(typename, permission, principals)
+            if decision is None:
+                if isinstance(parent, int):
+                    decision = self._RowDecision(parent, permission, principals)
+                else:
+                    decision = self._Decision(parent, permission, principals)
+        self._rows[key] = decision
+        return decision
+
+
+    def _Decision(self, location, permission, principals):
+        # returns Allow, Deny or None for the location. results are memoized per location and
+        # principals.
+        key = (id(location), permission, principals)
+        memo = self._lineage.get(key)
+        if memo is not None and memo[0] is location:
+            return memo[1]
+        decision = None
+        conf = getattr(location, "configuration", None)
+        if IObject.providedBy(location) and conf is not None and _StaticAcl(conf):
+            decision = self._TypeDecision(conf.id, permission, principals)
+        else:
+            decision = self._AclDecision(getattr(location, "__acl__", None), permission, principals)
+        if decision is None:
+            parent = getattr(location, "__parent__", None)
+            if parent is not None:
+                decision = self._Decision(parent, permission, principals)
+        self._lineage[key] = (location, decision)
+        return decision
+
+
+    def _TypeDecision(self, typename, permission, principals):
+        # decision of the types static acl. items without acl inherit the containers acl.
+        key = (typename, permission, principals)
+        if key not in self._types:
+            conf = self.app.configurationQuery.GetObjectConf(typename)
+            self._types[key] = self._AclDecision(conf.acl if conf is not None else None, permission, principals)
+        return self._types[key]
+
+
+    def _AclDecision(self, acl, permission, principals):
+        # see pyramid.authorization.ACLHelper.permits
+        if not acl:
+            return None
+        if callable(acl):
+            acl = acl()
+        for ace in acl:
+            action, principal, permissions = ace[:3]
+            if principal in principals:
+                if not is_nonstr_iter(permissions):
+                    permissions = [permissions]
+                if permission in permissions:
+                    return action
+        return None
+
+
+def RequestPrincipals(request):
+    """
+    Returns the principals of the request like `nive.security.AuthTktSecurityPolicy.permits()`:
+    `system.Everyone` and for authenticated users `system.Authenticated`, the user id and the
+    principals of the identity.
+    """
+    principals = {Everyone}
+    identity = request.identity
+    if identity is not None:
+        principals.add(Authenticated)
+        userid = request.authenticated_userid
+        if userid is not None:
+            principals.add(userid)
+        if isinstance(identity, dict):
+            principals.update(identity.get("principals") or ())
+    return frozenset(principals)
+
+
+def _StaticAcl(conf):
+    # acls with runtime callbacks depend on the item. see nive.security.SetupRuntimeAcls
+    return all(len(ace) == 3 for ace in conf.get("acl") or ())
+
+
+def GetPermissionEvaluator(request, app):
+    """
+    Returns the permission evaluator of the request. Created on first use.
+    """
+    try:
+        return request._c_permissions
+    except AttributeError:
+        request._c_permissions = PermissionEvaluator(request, app)
+        return request._c_permissions
@@ -0,0 +1,585 @@
+# Copyright 2012-2020 Arndt Droullier, Nive GmbH. All rights reserved.
+# Released under GPL3. See license.txt
+
+"""
+Compiled search profiles
+------------------------
+Search profiles are plain dictionaries stored in `AppConf.search` or in the settings of
+customized `search` views. Interpreting a profile on each call is expensive: dynamic values,
+fixed parameters and operators have to be merged, the parameter callback has to be inspected
+and the sql statement has to be formatted from scratch.
+
+`SearchProfile` resolves all static parts of a profile once. Sql statements are cached per
+query shape (parameter names, value types and sort order) with bind placeholders for all
+values, so repeated calls with different values reuse the same statement text. Database
+connections reuse prepared statements for identical statement texts (e.g. sqlite3's
+per connection statement cache). Per request work is reduced to binding values.
+
+The number of matching records (`total`) can be computed in different modes set as profile
+option `total`:
+
+- *exact*: (default) counts all matching records with a second query.
+- *none*: skips the count. `total` is returned as None.
+- *estimate*: uses the database statistics for the searched table (Postgres `pg_class.reltuples`,
+  Sqlite `sqlite_stat1` or MySql `information_schema.tables`). Falls back to `exact` if
+  no statistics are available.
+- *capped:N*: counts up to N+1 records and returns `"N+"` if there are more than N.
+
+Profiles can list fields in the `facets` option. `Facets()` counts the items per value of
+each field with one GROUP BY query per field over the same filtered set as the search.
+
+Parameters with the operator `MATCH` query the types full-text index and support the sort
+order `relevance`. See `nive_datastore.fulltext`.
+
+Profiles with `"container": "deep"` search all items below the context at any depth with a
+range condition on the items materialized path. See `nive_datastore.hierarchy`.
+
+Profiles from `AppConf.search` and search view settings are compiled on application
+startup. Profiles not known at startup are compiled on first use. ::
+
+    profile = GetSearchProfile(app, profileSettings)
+    result = profile.Search(root.search, parameter, start=0, max=20)
+
+"""
+
+import time
+import inspect
+import collections
+from datetime import datetime, date
+
+from nive.definitions import IViewModuleConf, FieldConf
+from nive.definitions import ConfigurationError, ConnectionError, OperationalError, ProgrammingError
+from nive.views import FieldRenderer
+
+from nive_datastore.cache import MakeCacheKey, QueryTags
+from nive_datastore.hierarchy import PathEnabled, PathField
+from nive_datastore.fulltext import MatchOperator, RelevanceSort, DbBackend, EnsureTextIndex, FmtMatchJoin
+
+# maximum number of cached statements per profile
+MaxStatements = 100
+# maximum number of compiled profiles per application
+MaxProfiles = 500
+# `container` option value searching all items below the context
+DeepContainer = "deep"
+# datatypes storing multiple values. facets count each value.
+MultipleValueTypes = ("multilist", "checkbox", "mselection", "mcheckboxes", "urllist", "unitlist")
+
+
+class SearchProfile(object):
+    """
+    A search profile compiled into a query template. Instances are immutable after
+    creation except for the internal statement cache and can be shared between requests.
+    """
+
+    def __init__(self, profile, app):
+        self.source = profile
+        get = profile.get
+        self.typename = get("type") or get("pool_type")
+        self.container = get("container")
+        self.groups = get("groups")
+        self.dynamic = get("dynamic") or {}
+        self.ignoreEmpty = get("ignoreEmpty")
+        self.start = get("start", 0)
+        self.size = get("size")
+        self.order = get("order")
+        self.sort = get("sort")
+        self.deserialize = get("deserialize")
+        self.operators = dict(get("operators") or {})
+        if self.container == DeepContainer:
+            if not PathEnabled(app):
+                raise ConfigurationError("container: deep requires the meta field %s" % (PathField))
+            self.operators[PathField] = "BETWEEN"
+        self.advanced = dict(get("advanced") or {})
+        self.totalMode, self.totalCap = ParseTotalMode(get("total"))
+        self.matchKeys = tuple(k for k, o in self.operators.items() if o == MatchOperator)
+        self.cache = get("cache", True)
+        self.key = MakeCacheKey(profile)
+
+        # the parameter callback signature is resolved once
+        self.parameter = {}
+        self.parameterCallback = None
+        self.passView = False
+        p = get("parameter")
+        if isinstance(p, collections.abc.Callable):
+            self.parameterCallback = p
+            self.passView = "view" in inspect.getfullargspec(p).args
+        elif p:
+            self.parameter = dict(p)
+
+        query = app.configurationQuery
+        if self.typename:
+            typeconf = query.GetObjectConf(self.typename)
+            if typeconf is None:
+                raise ConfigurationError("Type not found (%s)" % (self.typename))
+            self.dataTable = typeconf["dbparam"]
+        else:
+            self.dataTable = ""
+            if self.matchKeys:
+                raise ConfigurationError("The MATCH operator requires a type (%s)" % (", ".join(self.matchKeys)))
+
+        # fields allowed as dynamic sort values
+        sortFields = [f["id"] for f in query.GetAllMetaFlds(False)]
+        if self.typename:
+            sortFields += [f["id"] for f in query.GetAllObjectFlds(self.typename)]
+        if self.matchKeys:
+            sortFields.append(RelevanceSort)
+        self.sortFields = frozenset(sortFields)
+
+        # facet fields and their table alias used in group by statements
+        metaFlds = [f["id"] for f in query.GetAllMetaFlds(False)]
+        self.facets = tuple(get("facets") or ())
+        self.facetDefs = {}
+        for fld in self.facets:
+            if fld not in self.sortFields or fld == RelevanceSort:
+                raise ConfigurationError("Invalid facet field (%s)" % (fld))
+            self.facetDefs[fld] = (query.GetFld(fld, self.typename),
+                                   ("meta__." if fld in metaFlds else "data__.") + fld)
+
+        # field definitions used to select and convert records
+        self.fields = get("fields")
+        fields, selectFlds = self._PrepareFields(self.fields or [], query)
+        self.fieldDefs = tuple(fields)
+        self.selectFlds = tuple(selectFlds)
+        self.resultFlds = tuple(_RenameFieldAlias(list(selectFlds)))
+        self._statements = {}
+
+
+    def Tags(self, parameter):
+        """
+        Returns the type ids the query reads from. Used to tag cached results.
+        """
+        return QueryTags(self.typename, parameter, self.operators)
+
+
+    def Parameter(self, view):
+        """
+        Returns the fixed query parameters of the profile. If the profile uses a callback it
+        is called with the views context, request and the view itself if the callback
+        supports a `view` argument.
+        """
+        if self.parameterCallback is None:
+            return dict(self.parameter)
+        if self.passView:
+            p = self.parameterCallback(view.context, view.request, view)
+        else:
+            p = self.parameterCallback(view.context, view.request)
+        return dict(p or {})
+
+
+    def Search(self, search, parameter, start=0, max=100, sort=None, ascending=None, db=None):
+        """
+        Runs the query. `search` is the roots `nive.search.Search` instance. Pass a datapool
+        instance as `db` to run the query on a different connection.
+
+        Supports the same keyword options as `nive.search.Search` and `SearchType` (through the
+        profiles `advanced` settings) and returns the same search result.
+        """
+        t = time.time()
+        db = db or search.db
+        if db is None:
+            raise ConnectionError("No database connection")
+        kws = dict(self.advanced)
+        if sort is not None:
+            kws["sort"] = sort
+        if ascending is not None:
+            kws["ascending"] = ascending
+        else:
+            kws.setdefault("ascending", 1)
+        parameter = dict(parameter or {})
+        operators = dict(self.operators)
+        if self.typename:
+            self._HandleTypeJoins(parameter, operators, kws)
+        criteria = parameter
+        if self.matchKeys:
+            parameter = dict(parameter)
+            self._HandleMatch(search.app, db, parameter, kws, ascending)
+
+        sql, values = self.Statement(db, parameter, operators, kws, start, max)
+        records = db.Query(sql, values)
+
+        converter = self._PrepareRenderer(search, kws)
+        items = self._ConvertRecords(db, records, converter, kws)
+        cnt = len(items)
+
+        # total records
+        total = cnt + start
+        exceeded = False
+        if self.totalMode != "none" and (total==max or start>0) and kws.get("skipCount") != 1:
+            if self.totalMode == "capped":
+                total = self.CappedCount(db, parameter, operators, kws, self.totalCap)
+                exceeded = total > self.totalCap
+                total = min(total, self.totalCap)
+            elif self.totalMode == "estimate":
+                estimate = EstimateCount(db, self.dataTable or db.MetaTable)
+                if estimate is None:
+                    total = self.Count(db, parameter, operators, kws)
+                elif estimate > total:
+                    total = estimate
+            else:
+                total = self.Count(db, parameter, operators, kws)
+
+        items = search._HandleRelations(kws.get("relations"), items, kws)
+        result = search._PrepareResult(items, criteria, cnt, total, start, max, t, sql)
+        if self.totalMode == "none":
+            result["total"] = None
+        elif exceeded:
+            result["total"] = "%d+" % self.totalCap
+        return result
+
+
+    def Facets(self, search, parameter, facets=None, db=None):
+        """
+        Counts the matching items per value for each field in `facets` (default: the profiles
+        facets). Returns a dictionary with a list of `{"value": value, "count": number}` entries
+        for each field, ordered by count.
+        """
+        db = db or search.db
+        if db is None:
+            raise ConnectionError("No database connection")
+        kws = dict(self.advanced)
+        kws.pop("sort", None)
+        parameter = dict(parameter or {})
+        operators = dict(self.operators)
+        if self.typename:
+            self._HandleTypeJoins(parameter, operators, kws)
+        if self.matchKeys:
+            self._HandleMatch(search.app, db, parameter, kws, None)
+        de = db.structure._de
+        result = {}
+        for fld in facets or self.facets:
+            fielddef, column = self.facetDefs[fld]
+            kws["groupby"] = column
+            sql, values = self.Statement(db, parameter, operators, kws, fields=(fld, "-count(*) as cnt"))
+            counts = collections.OrderedDict()
+            for value, cnt in db.Query(sql, values):
+                value = de(value, fielddef["datatype"], fielddef)
+                if fielddef["datatype"] in MultipleValueTypes:
+                    for v in value or ():
+                        counts[v] = counts.get(v, 0) + cnt
+                    continue
+                if isinstance(value, list):
+                    value = tuple(value)
+                counts[value] = counts.get(value, 0) + cnt
+            result[fld] = [{"value": v, "count": c}
+                           for v, c in sorted(counts.items(), key=lambda i: i[1], reverse=True)]
+        return result
+
+
+    def Count(self, db, parameter, operators, kws):
+        """
+        Counts all records matching the query.
+        """
+        kws = dict(kws)
+        if "sort" in kws:
+            del kws["sort"]
+        if not kws.get("groupby"):
+            flds = ("-count(*) as cnt",)
+        else:
+            flds = ("-count(DISTINCT %s) as cnt" % (kws.get("groupby")),)
+        sql, values = self.Statement(db, parameter, operators, kws, fields=flds)
+        val = db.Query(sql, values)
+        if not kws.get("groupby"):
+            return val[0][0] if val else 0
+        return len(val) if val else 0
+
+
+    def CappedCount(self, db, parameter, operators, kws, cap):
+        """
+        Counts matching records up to `cap`+1.
+        """
+        kws = dict(kws)
+        if "sort" in kws:
+            del kws["sort"]
+        sql, values = self.Statement(db, parameter, operators, kws, start=0, max=cap+1, fields=("-1",))
+        val = db.Query("SELECT COUNT(*) FROM (%s) AS capped__" % (sql), values)
+        return val[0][0] if val else 0
+
+
+    def Statement(self, db, parameter, operators, kws, start=0, max=0, fields=None):
+        """
+        Returns the sql statement and values for the query. Statements are cached by
+        query shape and reused for different values.
+        """
+        fields = fields or self.selectFlds
+        shape, values = BindValues(db, parameter, operators)
+        if shape is None:
+            # uncachable shape. let the database format the statement and values
+            sql, values = self._FmtStatement(db, fields, parameter, operators, kws)
+        else:
+            key = (fields, shape, kws.get("sort"), kws.get("ascending"), kws.get("join"), kws.get("groupby"))
+            sql = self._statements.get(key)
+            if sql is None:
+                sql, v = self._FmtStatement(db, fields, parameter, operators, kws)
+                if len(self._statements) >= MaxStatements:
+                    self._statements.clear()
+                self._statements[key] = sql
+            if kws.get("extraValues"):
+                # custom condition values are appended after the parameter values
+                values = list(values) + list(kws["extraValues"])
+        if kws.get("joinValues"):
+            # the join is placed in front of the where clause
+            values = list(kws["joinValues"]) + list(values)
+        if max:
+            sql += FmtLimit(db)
+            values = list(values) + [max, start]
+        return sql, values
+
+
+    def _FmtStatement(self, db, fields, parameter, operators, kws):
+        return db.FmtSQLSelect(list(fields), parameter=parameter, operators=operators,
+                               dataTable=self.dataTable, start=None, max=0, **kws)
+
+
+    def _HandleMatch(self, app, db, parameter, kws, ascending):
+        # replaces MATCH parameters with a join on the full-text index
+        phrase = " ".join([str(parameter[k]) for k in self.matchKeys if parameter.get(k)])
+        for k in self.matchKeys:
+            parameter.pop(k, None)
+        relevance = kws.get("sort") == RelevanceSort
+        if relevance:
+            del kws["sort"]
+        if not phrase.strip():
+            return
+        EnsureTextIndex(app, db, self.dataTable)
+        join, values = FmtMatchJoin(db, self.dataTable, phrase)
+        if kws.get("join"):
+            join = kws["join"] + "\n" + join
+        kws["join"] = join
+        kws["joinValues"] = values
+        if relevance:
+            # most relevant first unless ascending is requested
+            kws["sort"] = "!fts__.fts_rank"
+            kws["ascending"] = 1 if ascending == 1 else 0
+
+
+    def _PrepareFields(self, fields, query):
+        # lookup field definitions. see nive.search.Search._PrepareFields
+        defs = []
+        for fld in fields:
+            if not isinstance(fld, str):
+                defs.append(fld)
+                continue
+            if fld in ("__preview__",) or fld[0] == "+":
+                continue
+            if fld[0] == "-":
+                defs.append(FieldConf(**{"id": fld, "name": fld, "datatype": "string"}))
+                continue
+            fl = query.GetFld(fld, self.typename)
+            if fl:
+                defs.append(fl)
+        selectFlds = [f["id"] for f in defs]
+        groupcol = len([f for f in selectFlds if f[0] == "-"])
+        # add id. required for group by queries
+        if (not "id" in selectFlds and groupcol == 0 and self.advanced.get("groupby") == None) or self.advanced.get("addID")==1:
+            selectFlds.append("id")
+            defs.append(query.GetFld("id"))
+        return defs, selectFlds
+
+
+    def _HandleTypeJoins(self, parameter, operators, kws):
+        # see nive.search.Search._HandleTypeJoins
+        default_join = 0
+        if "jointype" not in kws or kws.get("jointype")=="inner":
+            default_join = 1
+            if not kws.get("skiptype"):
+                parameter["pool_type"] = self.typename
+        if "pool_type" not in operators:
+            operators["pool_type"] = "="
+        if not default_join:
+            operators["jointype"] = kws.get("jointype")
+
+
+    def _PrepareRenderer(self, search, kws):
+        skipRender = kws.get("skipRender", False)
+        if skipRender == True:
+            skipRender = self.resultFlds
+        elif not skipRender:
+            skipRender = ("pool_type", "pool_wfa", "pool_wfp")
+        return FieldRenderer(search, skip=skipRender)
+
+
+    def _ConvertRecords(self, db, records, converter, kws):
+        de = db.structure._de
+        fields = self.fieldDefs
+        names = self.resultFlds
+        items = []
+        for rec in records:
+            rec2 = []
+            for p in range(len(fields)):
+                value = de(rec[p], fields[p]["datatype"], fields[p])
+                rec2.append(converter.Render(fields[p], value, False, **kws))
+            items.append(dict(zip(names, rec2)))
+        return items
+
+
+def ParseTotalMode(value):
+    """
+    Parses the profiles `total` option. Returns the mode and the cap for `capped:N`.
+    """
+    if not value or value == "exact":
+        return "exact", 0
+    if value in ("none", "estimate"):
+        return value, 0
+    if isinstance(value, str) and value.startswith("capped:"):
+        try:
+            cap = int(value[7:])
+        except ValueError:
+            cap = 0
+        if cap > 0:
+            return "capped", cap
+    raise ConfigurationError("Invalid search profile total option (%s)" % (str(value)))
+
+
+def EstimateCount(db, table):
+    """
+    Looks up the estimated number of rows in `table` from the database statistics.
+    Returns None if no statistics are available.
+    """
+    backend = DbBackend(db)
+    try:
+        if backend == "sqlite":
+            # requires ANALYZE. the first number in stat is the number of rows
+            if not db.Query("SELECT name FROM sqlite_master WHERE type='table' AND name='sqlite_stat1'"):
+                return None
+            recs = db.Query("SELECT stat FROM sqlite_stat1 WHERE tbl=%s" % (db.placeholder), [table])
+            if not recs:
+                return None
+            return max([int(r[0].split(" ")[0]) for r in recs])
+        elif backend == "postgres":
+            recs = db.Query("SELECT reltuples FROM pg_class WHERE relname=%s" % (db.placeholder), [table])
+        elif backend == "mysql":
+            recs = db.Query("SELECT table_rows FROM information_schema.tables WHERE table_schema=DATABASE() AND table_name=%s" % (db.placeholder), [table])
+        else:
+            return None
+    except (OperationalError, ProgrammingError):
+        return None
+    if not recs or recs[0][0] is None or recs[0][0] < 0:
+        return None
+    return int(recs[0][0])
+
+
+def FmtLimit(db):
+    """
+    Limit and offset clause with placeholders. Values are appended as `max, start`.
+    """
+    ph = db.placeholder
+    return "LIMIT %s OFFSET %s\n" % (ph, ph)
+
+
+def BindValues(db, parameter, operators):
+    """
+    Converts parameter values to the list of sql values in the same order and format
+    as `FmtSQLSelect()`. Also returns the query shape. The shape is a hashable key
+    identifying the sql statement generated for the parameters.
+
+    Returns `(None, None)` if the statement cannot be cached.
+    """
+    shape = []
+    values = []
+    for key, value in parameter.items():
+        operator = operators.get(key, "=") if operators else "="
+        if isinstance(value, str):
+            if operator in ("LIKE", "BETWEEN") and value == "":
+                shape.append((key, None))
+                continue
+            if operator == "LIKE":
+                value = "%%%s%%" % value.replace("*", "%")
+            shape.append((key, "s", operator))
+            values.append(value)
+
+        elif isinstance(value, (tuple, list)):
+            if not value:
+                shape.append((key, None))
+                continue
+            if operator == "BETWEEN":
+                if len(value) < 2:
+                    return None, None
+                shape.append((key, "b", operator))
+                values.append(value[0])
+                values.append(value[1])
+            elif operator.startswith("LIKE:"):
+                kinds = []
+                for v in value:
+                    if not v:
+                        kinds.append(0)
+                        values.append(v)
+                    else:
+                        kinds.append(1)
+                        values.append("%%%s%%" % v.replace("*", "%"))
+                shape.append((key, "l", operator, tuple(kinds)))
+            elif len(value) == 1:
+                shape.append((key, "s", operator))
+                values.append(value[0])
+            else:
+                v = db._FmtListForQuery(value)
+                if isinstance(v, str):
+                    # lists formatted as part of the sql statement
+                    shape.append((key, "i", operator, v))
+                else:
+                    shape.append((key, "t", operator))
+                    values.append(tuple(value))
+
+        elif isinstance(value, (int, float, datetime, date)):
+            shape.append((key, type(value).__name__, operator))
+            values.append(value)
+
+        else:
+            shape.append((key, None))
+    return tuple(shape), values
+
+
+def _RenameFieldAlias(fldList):
+    # parse alias field names used in sql query
+    p = 0
+    for f in fldList:
+        if f[0] == "-" and f.find(" as ") != -1:
+            a = f.split(" as ")[-1]
+            a = a.replace(" ", "")
+            a = a.replace(")", "")
+            fldList[p] = a
+        p += 1
+    return fldList
+
+
+# profile lookup and startup compilation -----------------------------------------------
+
+def GetSearchProfile(app, profile):
+    """
+    Returns the compiled `SearchProfile` for the profile settings. Compiled profiles are
+    cached by profile identity. Profiles not compiled on startup are compiled and cached
+    on first use.
+    """
+    cache = _ProfileCache(app)
+    compiled = cache.get(id(profile))
+    if compiled is not None and compiled.source is profile:
+        return compiled
+    compiled = SearchProfile(profile, app)
+    if len(cache) >= MaxProfiles:
+        cache.clear()
+    cache[id(profile)] = compiled
+    return compiled
+
+
+def CompileSearchProfiles(app):
+    """
+    Compiles all search profiles defined in `AppConf.search` and in customized `search`
+    view settings. Called on application startup.
+    """
+    profiles = []
+    if app.configuration.get("search"):
+        profiles.extend(app.configuration.search.values())
+    for viewmod in app.registry.getAllUtilitiesRegisteredFor(IViewModuleConf):
+        for view in viewmod.views or ():
+            if view.get("attr") == "search" and view.get("settings"):
+                profiles.append(view.settings)
+    for profile in profiles:
+        GetSearchProfile(app, profile)
+    return len(profiles)
+
+
+def _ProfileCache(app):
+    try:
+        return app._c_searchprofiles
+    except AttributeError:
+        app._c_searchprofiles = {}
+        return app._c_searchprofiles
@@ -0,0 +1,195 @@
+# Copyright 2012-2020 Arndt Droullier, Nive GmbH. All rights reserved.
+# Released under GPL3. See license.txt
+
+"""
+Template precompilation
+-----------------------
+Item templates (`ObjectConf.template`) used by `renderTmpl` and listing templates
+(`ObjectConf.listing`) used by `renderListItem` are looked up and compiled by the template
+engine on first use. After a restart the first requests of each process pay for compiling.
+
+`CompileTemplates()` is called on application startup (`finishRegistration`) and compiles all
+configured templates of all types. Missing or broken templates raise a `ConfigurationError`
+on startup instead of failing on the first request. The compile time of each template is logged.
+
+Templates are compiled for renderers registered in the pyramid configuration only. Include the
+template engine (e.g. `config.include("pyramid_chameleon")`) before the application is started.
+Relative template names are resolved like `renderTmpl` and `renderListItem` do: item templates
+(`template="bookmark.pt"`) in the `templates` directories of the registered view modules and
+their parents, listings relative to `nive_datastore.webapi`. Item templates found in more than
+one view module are compiled for each. Relative item templates not found in any view module
+are logged and skipped.
+
+List rendering
+--------------
+`ListingTemplate()` caches the listing template names of all types on the application, so
+lookups are shared by all requests. `ListRenderer` resolves a template once and renders
+any number of rows with shared system values (`view`, `request`, `options`). Used by
+`renderList` to render result lists in one pass instead of one renderer dispatch per row.
+"""
+
+import os
+import time
+from functools import partial
+
+from pyramid.interfaces import IRendererFactory
+from pyramid.renderers import RendererHelper
+from pyramid.events import BeforeRender
+from pyramid.util import hide_attrs
+from pyramid.csrf import get_csrf_token
+from pyramid.path import AssetResolver
+
+from nive.definitions import ConfigurationError, IViewModuleConf
+
+# template slots of object configurations
+TemplateSlots = ("template", "listing")
+
+
+def ConfiguredTemplates(app):
+    """
+    Returns the configured templates as list of `(type id, slot, template name)`.
+    """
+    templates = []
+    for conf in app.configurationQuery.GetAllObjectConfs():
+        for slot in TemplateSlots:
+            name = conf.get(slot)
+            if name and isinstance(name, str):
+                templates.append((conf.id, slot, name))
+    return templates
+
+
+def TemplateSpecs(app, name, slot):
+    """
+    Returns the template names as looked up at runtime. Relative item templates are looked up
+    in the `templates` directories of the registered view modules like `View._LookupTemplate()`.
+    Returns an empty list if the relative item template is not found.
+    """
+    if ":" in name or os.path.isabs(name):
+        return [name]
+    if slot != "template":
+        return ["%s:%s" % (_ViewPackage().__name__, name)]
+    specs = []
+    for conf in app.configurationQuery.QueryConf(IViewModuleConf):
+        for path in (conf.templates, conf.parent.templates if conf.parent else None):
+            if not path:
+                continue
+            if not path.endswith((":", "/")):
+                path += "/"
+            spec = path + name
+            if spec not in specs and _TemplateExists(spec):
+                specs.append(spec)
+                break
+    return specs
+
+
+def CompileTemplate(spec, registry, package=None):
+    """
+    Looks up and compiles the template. Returns the compile time in seconds or None if no
+    renderer is registered for the templates file type.
+
+    raises ConfigurationError if the template cannot be loaded or compiled
+    """
+    ext = os.path.splitext(spec)[1]
+    if registry.queryUtility(IRendererFactory, name=ext) is None:
+        return None
+    t = time.time()
+    try:
+        renderer = RendererHelper(name=spec, package=package or _ViewPackage(), registry=registry).renderer
+        implementation = getattr(renderer, "implementation", None)
+        if implementation is not None:
+            template = implementation()
+            if hasattr(template, "cook_check"):
+                template.cook_check()
+    except Exception as e:
+        raise ConfigurationError("Template compilation failed: %s (%s)" % (spec, str(e)))
+    return time.time() - t
+
+
+def CompileTemplates(app, registry):
+    """
+    Compiles all configured item and listing templates. Returns the number of compiled
+    templates.
+    """
+    cnt = 0
+    for typename, slot, name in ConfiguredTemplates(app):
+        specs = TemplateSpecs(app, name, slot)
+        if not specs:
+            app.log.warning("Template not compiled, not found in view module templates: %s", name)
+            continue
+        for spec in specs:
+            seconds = CompileTemplate(spec, registry)
+            if seconds is None:
+                app.log.debug("Template not compiled, no renderer registered: %s", spec)
+                continue
+            app.log.info("Compiled %s %s template %s in %.4f seconds", typename, slot, spec, seconds)
+            cnt += 1
+    return cnt
+
+
+def _TemplateExists(spec):
+    if os.path.isabs(spec):
+        return os.path.isfile(spec)
+    try:
+        return AssetResolver().resolve(spec).exists()
+    except (ImportError, ValueError):
+        return False
+
+
+def _ViewPackage():
+    # relative template names are resolved relative to the view module package
+    import nive_datastore.webapi
+    return nive_datastore.webapi
+
+
+def ListingTemplate(app, typename):
+    """
+    Returns the listing template of the type or None. Template names are cached on the
+    application.
+    """
+    try:
+        cache = app._c_listings
+    except AttributeError:
+        cache = app._c_listings = {}
+    try:
+        return cache[typename]
+    except KeyError:
+        pass
+    typeconf = app.configurationQuery.GetObjectConf(typename)
+    tmpl = typeconf.get("listing") if typeconf is not None else None
+    cache[typename] = tmpl
+    return tmpl
+
+
+class ListRenderer(object):
+    """
+    Renders rows with one template. The renderer and the system values are looked up once,
+    each row is passed to the template as values.
+    """
+
+    def __init__(self, template, request, system=None, package=None):
+        self.request = request
+        helper = RendererHelper(name=template, package=package or _ViewPackage(), registry=request.registry)
+        self.renderer = helper.renderer
+        values = {"view": None,
+                  "renderer_name": helper.name,
+                  "renderer_info": helper,
+                  "context": getattr(request, "context", None),
+                  "request": request,
+                  "req": request,
+                  "get_csrf_token": partial(get_csrf_token, request)}
+        if system:
+            values.update(system)
+        event = BeforeRender(values)
+        helper.registry.notify(event)
+        self.system = dict(event)
+
+
+    def Render(self, rows):
+        """
+        Renders the rows and returns a list of rendered strings.
+        """
+        renderer = self.renderer
+        system = self.system
+        with hide_attrs(self.request, "response"):
+            # templates may update the system values
+            return [renderer(row, system.copy()) for row in rows]
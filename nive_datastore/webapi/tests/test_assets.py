@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pyramid.httpexceptions import HTTPNotFound
+
+from nive.definitions import Conf
+from nive_datastore.webapi.view import APIv1
+from nive_datastore.webapi import assets
+from nive_datastore.webapi.assets import Bundleable, BuildBundle, GetBundle, LookupBundle, WidgetResources
+from nive_datastore.tests.db_app import *
+from nive_datastore.tests import __local
+
+from pyramid import testing
+
+
+JQUERY = "nive.components.reform:static/scripts/jquery.min.js"
+REFORM = "nive.components.reform:static/scripts/reform.js"
+JQUERYUI_CSS = "nive.components.reform:static/css/ui-lightness/jquery-ui-1.8.11.custom.css"
+BOOTSTRAP = "nive.components.adminview:static/mods/bootstrap-4.3.1-dist/js/bootstrap.min.js"
+
+
+class tAssets_db(object):
+
+    def setUp(self):
+        request = testing.DummyRequest()
+        request._LOCALE_ = "en"
+        self.request = request
+        self.request.content_type = ""
+        self.request.method = "GET"
+        self.config = testing.setUp(request=request)
+        self.config.include('pyramid_chameleon')
+        self.config.add_static_view("reform-static", "nive.components.reform:static")
+        self._loadApp()
+        self.app.Startup(self.config)
+        self.root = self.app.root
+        self.request.context = self.root
+
+    def tearDown(self):
+        self.app.Close()
+        testing.tearDown()
+
+    def test_bundles(self):
+        self.assertTrue(Bundleable(JQUERY, "js"))
+        self.assertFalse(Bundleable(JQUERY, "css"))
+        self.assertFalse(Bundleable("/static/jquery.js", "js"))
+        self.assertFalse(Bundleable("nive:../secret.js", "js"))
+
+        bundle = GetBundle(self.app, self.request, "js", [JQUERY, REFORM])
+        self.assertTrue(bundle is GetBundle(self.app, self.request, "js", [JQUERY, REFORM]))
+        self.assertTrue(bundle.name.endswith(".js"))
+        self.assertTrue(bundle.mime == "application/javascript")
+        self.assertTrue(BuildBundle(self.request, "js", [JQUERY, REFORM]).name == bundle.name)
+        self.assertTrue(LookupBundle(self.app, self.request, bundle.name) is bundle)
+
+        # relative urls point to the static files
+        css = BuildBundle(self.request, "css", [JQUERYUI_CSS])
+        self.assertTrue(css.body.find(b'url("/reform-static/css/ui-lightness/images/')!=-1)
+        self.assertTrue(css.body.find(b"url(images/")==-1)
+
+        # unknown bundles are built from the file list
+        self.app._c_assetbundles = None
+        self.assertTrue(LookupBundle(self.app, self.request, bundle.name) is None)
+        self.assertTrue(LookupBundle(self.app, self.request, bundle.name, [JQUERY, REFORM]).body == bundle.body)
+        # file list not matching the name
+        self.app._c_assetbundles = None
+        self.assertTrue(LookupBundle(self.app, self.request, bundle.name, [REFORM]) is None)
+        self.assertTrue(LookupBundle(self.app, self.request, "abc.js", ["nive:unknown.js"]) is None)
+        self.assertTrue(LookupBundle(self.app, self.request, "abc.py", ["nive:app.py"]) is None)
+
+    def test_lookuplimits(self):
+        self.assertTrue(JQUERY in WidgetResources(self.app))
+        self.assertFalse(BOOTSTRAP in WidgetResources(self.app))
+        # files not used by form widgets
+        bundle = BuildBundle(self.request, "js", [BOOTSTRAP])
+        self.assertTrue(LookupBundle(self.app, self.request, bundle.name, [BOOTSTRAP]) is None)
+        # mismatching file lists are not cached
+        self.app._c_assetbundles = None
+        self.assertTrue(LookupBundle(self.app, self.request, "0000000000000000.js", [JQUERY, REFORM]) is None)
+        self.assertTrue(len(self.app._c_assetbundles) == 0)
+        # least recently used bundles are removed
+        maxEntries = assets.BundleMaxEntries
+        assets.BundleMaxEntries = 1
+        self.app._c_assetbundles = None
+        try:
+            first = GetBundle(self.app, self.request, "js", [JQUERY])
+            GetBundle(self.app, self.request, "js", [REFORM])
+            self.assertTrue(len(self.app._c_assetbundles) == 2)
+            self.assertTrue(LookupBundle(self.app, self.request, first.name) is None)
+        finally:
+            assets.BundleMaxEntries = maxEntries
+            self.app._c_assetbundles = None
+
+    def test_views(self):
+        view = APIv1(self.root, self.request)
+        view.__configuration__ = lambda: Conf(assets=(), views=())
+        self.request.GET = {"pool_type": "bookmark", "assets": "only"}
+        single = view.newItemForm()["content"]
+
+        self.app.configuration.unlock()
+        self.app.configuration.bundleAssets = True
+        try:
+            head = view.newItemForm()["content"]
+        finally:
+            del self.app.configuration.bundleAssets
+            self.app.configuration.lock()
+        self.assertTrue(head.find("assetBundle/")!=-1)
+        self.assertTrue(head.count("<script")==1)
+        self.assertTrue(single.count("<script")>1)
+
+        name = head.split("assetBundle/")[1].split("?")[0]
+        self.request.subpath = (name,)
+        self.request.GET = {}
+        response = view.assetBundle()
+        self.assertTrue(response.body.find(b"jQuery")!=-1)
+        self.assertTrue(response.cache_control.max_age == 365*24*3600)
+
+        self.request.subpath = ("unknown.js",)
+        self.assertRaises(HTTPNotFound, view.assetBundle)
+
+
+class tAssets_db_sqlite(tAssets_db, __local.SqliteTestCase):
+    """
+    see tests.__local
+    """
+
+class tAssets_db_mysql(tAssets_db, __local.MySqlTestCase):
+    """
+    see tests.__local
+    """
+
+class tAssets_db_pg(tAssets_db, __local.PostgreSqlTestCase):
+    """
+    see tests.__local
+    """
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import json
 import unittest
 
 from nive.security import User
 from nive_datastore.tests import __local
 
 from pyramid import testing
+from pyramid.httpexceptions import HTTPForbidden
 
 
 
@@ -107,6 +109,37 @@ class tWebapiDispatch_db(object):
         result, stat = self.root.dispatch("newItem", True, self.request, **param)
         self.assertTrue(len(result["result"])==1)
         self.root.Delete(result["result"][0], user=user)
+
+
+    def test_direct(self):
+        user = User("test")
+        user.groups.append("group:manager")
+
+        param = {"pool_type": "bookmark", "link": "the link", "comment": "some text"}
+        result, stat = self.root.dispatch("newItem", direct=True, **param)
+        self.assertTrue(len(result["result"])==1)
+        self.assertTrue(stat == "200 OK")
+        self.remove.append(result["result"][0])
+
+        # same values as json results. rows are not converted to lists.
+        result, stat = self.root.dispatch("list", direct=True)
+        jsresult, jsstat = self.root.dispatch("list")
+        self.assertTrue(len(result["items"])==1)
+        self.assertTrue(json.loads(json.dumps(result)) == jsresult)
+        self.assertTrue(stat == jsstat)
+
+        # permissions are checked. views are secured if registered with a security policy.
+        self.app.Close()
+        testing.tearDown()
+        self.config = testing.setUp(request=self.request)
+        self.config.testing_securitypolicy(permissive=False)
+        self._loadApp()
+        self.app.Startup(self.config)
+        self.root = self.app.root
+        self.assertRaises(HTTPForbidden, self.root.dispatch, "list", True, self.request, direct=True)
+        self.assertRaises(HTTPForbidden, self.root.dispatch, "list", True, self.request)
+        result, stat = self.root.dispatch("list", False, self.request, direct=True)
+        self.assertTrue(result["items"] == [tuple(r) for r in jsresult["items"]])
         
         
 
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from nive.security import User, AuthTktSecurityPolicy
+from nive_datastore.webapi.permissions import PermissionEvaluator, GetPermissionEvaluator
+from nive_datastore.tests.db_app import *
+from nive_datastore.tests import __local
+
+from pyramid import testing
+
+
+class Policy(AuthTktSecurityPolicy):
+    # fixed identity instead of auth cookies
+    def __init__(self, identity):
+        AuthTktSecurityPolicy.__init__(self, "secret")
+        self._identity = identity
+
+    def identity(self, request):
+        return self._identity
+
+
+class tPermissions_db(object):
+
+    permissions = ("view", "api-getItem", "api-subtree", "api-delete", "api-search", "unknown")
+
+    def setUp(self):
+        request = testing.DummyRequest()
+        request._LOCALE_ = "en"
+        self.request = request
+        self.config = testing.setUp(request=request)
+        self._loadApp()
+        self.app.Startup(self.config)
+        self.root = self.app.root
+        self.request.context = self.root
+
+    def tearDown(self):
+        user = User("test")
+        for r in self.root.GetObjsList(fields=["id"]):
+            self.root.Delete(r["id"], user)
+        self.app.Close()
+        testing.tearDown()
+
+    def _tree(self):
+        user = User("test")
+        o1 = create_bookmark(self.root, user)
+        o2 = create_bookmark(o1, user)
+        t1 = create_track(o2, user)
+        t2 = create_track(self.root, user)
+        return [o1, o2, t1, t2]
+
+    def _compare(self, identity):
+        self.config.set_security_policy(Policy(identity))
+        items = self._tree()
+        evaluator = PermissionEvaluator(self.request, self.app)
+        for permission in self.permissions:
+            expected = [i for i in items if self.request.has_permission(permission, i)]
+            self.assertEqual(evaluator.FilterAllowed(items, permission), expected, permission)
+            # rows
+            self.assertTrue(evaluator.StaticTypes(["bookmark", "track"]))
+            for item in items:
+                parent = item.parent if item.parent.IsRoot() else item.parent.id
+                if not item.parent.IsRoot():
+                    evaluator.RowAllowed(item.parent.id, item.parent.GetTypeID(), item.parent.parent, permission)
+                self.assertEqual(evaluator.RowAllowed(item.id, item.GetTypeID(), parent, permission),
+                                 bool(self.request.has_permission(permission, item)))
+        return evaluator
+
+    def test_anonymous(self):
+        evaluator = self._compare(None)
+        self.assertTrue(evaluator.Allowed(self.root, "view"))
+        self.assertFalse(evaluator.Allowed(self.root, "api-delete"))
+
+    def test_admin(self):
+        evaluator = self._compare({"userid": "admin", "principals": ["group:admin"]})
+        self.assertTrue(evaluator.Allowed(self.root, "api-delete"))
+
+    def test_localgroups(self):
+        # owners may delete. the requests context is not owned by the user.
+        self.config.set_security_policy(Policy({"userid": "test", "principals": []}))
+        other = User("other")
+        folder = create_bookmark(self.root, other)
+        owned = create_track(folder, User("test"))
+        notowned = create_track(folder, other)
+        evaluator = PermissionEvaluator(self.request, self.app)
+        self.assertEqual(evaluator.FilterAllowed([folder, owned, notowned], "api-deleteItem"), [owned])
+        self.assertTrue("group:owner" in evaluator.Principals(owned))
+        self.assertFalse("group:owner" in evaluator.Principals(folder))
+
+        # rows with local groups loaded in one query
+        evaluator = PermissionEvaluator(self.request, self.app)
+        evaluator.LoadLocalGroups([folder.id, owned.id, notowned.id])
+        self.assertFalse(evaluator.RowAllowed(folder.id, "bookmark", self.root, "api-deleteItem"))
+        self.assertTrue(evaluator.RowAllowed(owned.id, "track", folder.id, "api-deleteItem"))
+        self.assertFalse(evaluator.RowAllowed(notowned.id, "track", folder.id, "api-deleteItem"))
+
+        # anonymous users have no local groups
+        self.config.set_security_policy(Policy(None))
+        evaluator = PermissionEvaluator(self.request, self.app)
+        self.assertEqual(evaluator.FilterAllowed([folder, owned, notowned], "api-deleteItem"), [])
+
+    def test_nopolicy(self):
+        items = self._tree()
+        evaluator = GetPermissionEvaluator(self.request, self.app)
+        self.assertTrue(evaluator is GetPermissionEvaluator(self.request, self.app))
+        self.assertEqual(evaluator.FilterAllowed(items, "api-delete"), items)
+
+
+class tPermissions_db_sqlite(tPermissions_db, __local.SqliteTestCase):
+    """
+    see tests.__local
+    """
+
+class tPermissions_db_mysql(tPermissions_db, __local.MySqlTestCase):
+    """
+    see tests.__local
+    """
+
+class tPermissions_db_pg(tPermissions_db, __local.PostgreSqlTestCase):
+    """
+    see tests.__local
+    """
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from nive.security import User
+from nive.definitions import Conf, ConfigurationError
+from nive_datastore.webapi.profiles import SearchProfile, GetSearchProfile, BindValues, CompileSearchProfiles
+from nive_datastore.webapi.view import APIv1
+from nive_datastore.cache import ResultCache
+from nive_datastore.tests.db_app import *
+from nive_datastore.tests import __local
+
+from pyramid import testing
+
+
+class tProfiles_db(object):
+
+    def setUp(self):
+        request = testing.DummyRequest()
+        request._LOCALE_ = "en"
+        self.request = request
+        self.request.content_type = ""
+        self.request.method = "POST"
+        self.config = testing.setUp(request=request)
+        self._loadApp()
+        self.app.Startup(self.config)
+        self.root = self.app.root
+        self.request.context = self.root
+
+    def tearDown(self):
+        user = User("test")
+        for r in self.root.GetObjsList(fields=["id"]):
+            self.root.Delete(r["id"], user)
+        self.app.Close()
+        testing.tearDown()
+
+
+    def test_bind(self):
+        db = self.app.db
+        shape, values = BindValues(db, {"a": "text", "b": 1, "c": ""}, {"a": "LIKE", "c": "LIKE"})
+        self.assertTrue(values == ["%text%", 1])
+        shape2, values = BindValues(db, {"a": "other", "b": 2, "c": ""}, {"a": "LIKE", "c": "LIKE"})
+        self.assertTrue(shape == shape2)
+        self.assertTrue(values == ["%other%", 2])
+        shape3, values = BindValues(db, {"a": "other", "b": 2, "c": "x"}, {"a": "LIKE", "c": "LIKE"})
+        self.assertTrue(shape != shape3)
+        shape, values = BindValues(db, {"a": (1, 3)}, {"a": "BETWEEN"})
+        self.assertTrue(values == [1, 3])
+        shape, values = BindValues(db, {"a": (1,)}, {"a": "BETWEEN"})
+        self.assertTrue(shape is None)
+
+
+    def test_compiled(self):
+        CompileSearchProfiles(self.app)
+        profile = self.app.configuration.search["bookmarks"]
+        compiled = GetSearchProfile(self.app, profile)
+        self.assertTrue(compiled.source is profile)
+        self.assertTrue(compiled is GetSearchProfile(self.app, profile))
+        self.assertTrue(compiled.typename == "bookmark")
+        self.assertTrue("link" in compiled.sortFields)
+
+        profile = {"type": "nonono"}
+        self.assertRaises(ConfigurationError, SearchProfile, profile, self.app)
+
+
+    def test_parameter(self):
+        view = APIv1(self.root, self.request)
+        compiled = GetSearchProfile(self.app, {"parameter": lambda context, request: {"id": context.id}})
+        self.assertFalse(compiled.passView)
+        self.assertTrue(compiled.Parameter(view) == {"id": self.root.id})
+        compiled = GetSearchProfile(self.app, {"parameter": lambda context, request, view: {"view": view}})
+        self.assertTrue(compiled.passView)
+        self.assertTrue(compiled.Parameter(view)["view"] is view)
+
+
+    def test_search(self):
+        user = User("test")
+        r = self.root
+        for i in range(5):
+            create_bookmark(r, user)
+        create_track(r, user)
+        compiled = GetSearchProfile(self.app, {"type": "bookmark",
+                                               "fields": ["id", "link"],
+                                               "operators": {"link": "LIKE"}})
+        result = compiled.Search(r.search, {"link": "link"}, start=0, max=2)
+        self.assertTrue(len(result["items"]) == 2)
+        self.assertTrue(result["total"] == 5)
+        result2 = compiled.Search(r.search, {"link": "the"}, start=4, max=2)
+        self.assertTrue(len(result2["items"]) == 1)
+        self.assertTrue(result2["total"] == 5)
+        # statement reused
+        self.assertTrue(result["sql"] == result2["sql"])
+        result = compiled.Search(r.search, {"link": "nothing"}, start=0, max=2)
+        self.assertTrue(len(result["items"]) == 0)
+        self.assertTrue(result["total"] == 0)
+
+
+    def test_extravalues(self):
+        user = User("test")
+        r = self.root
+        ids = [create_bookmark(r, user).id for i in range(3)]
+        ph = self.app.db.placeholder
+        compiled = GetSearchProfile(self.app, {"type": "bookmark",
+                                               "fields": ["id"],
+                                               "advanced": {"condition": "meta__.id > %s" % ph,
+                                                            "extraValues": [ids[0]]}})
+        for i in range(2):
+            # cached statement
+            result = compiled.Search(r.search, {}, start=0, max=10)
+            self.assertTrue(sorted([i["id"] for i in result["items"]]) == ids[1:], result)
+            self.assertTrue(result["total"] == 2)
+
+
+    def test_total(self):
+        user = User("test")
+        r = self.root
+        for i in range(5):
+            create_bookmark(r, user)
+        profile = {"type": "bookmark", "fields": ["id"]}
+
+        profile["total"] = "none"
+        result = SearchProfile(profile, self.app).Search(r.search, {}, start=0, max=2)
+        self.assertTrue(len(result["items"]) == 2)
+        self.assertTrue(result["total"] is None)
+
+        profile["total"] = "capped:3"
+        result = SearchProfile(profile, self.app).Search(r.search, {}, start=0, max=2)
+        self.assertTrue(result["total"] == "3+", result["total"])
+        profile["total"] = "capped:10"
+        result = SearchProfile(profile, self.app).Search(r.search, {}, start=0, max=2)
+        self.assertTrue(result["total"] == 5)
+
+        profile["total"] = "estimate"
+        result = SearchProfile(profile, self.app).Search(r.search, {}, start=0, max=2)
+        self.assertTrue(result["total"] >= 2)
+
+        profile["total"] = "capped:x"
+        self.assertRaises(ConfigurationError, SearchProfile, profile, self.app)
+        profile["total"] = "maybe"
+        self.assertRaises(ConfigurationError, SearchProfile, profile, self.app)
+
+
+
+    def test_facets(self):
+        user = User("test")
+        r = self.root
+        for i in range(3):
+            create_bookmark(r, user)
+        r.Create("bookmark", data={"link": "shared", "share": True}, user=user)
+        create_track(r, user)
+        compiled = GetSearchProfile(self.app, self.app.configuration.search["bookmarks"])
+        facets = compiled.Facets(r.search, {})
+        self.assertTrue(facets["share"] == [{"value": False, "count": 3}, {"value": True, "count": 1}], facets)
+        self.assertTrue(sum([f["count"] for f in facets["pool_state"]]) == 4, facets)
+
+        facets = compiled.Facets(r.search, {"link": "shared"}, facets=["share"])
+        self.assertTrue(facets == {"share": [{"value": True, "count": 1}]}, facets)
+
+        compiled = GetSearchProfile(self.app, self.app.configuration.search["default"])
+        facets = compiled.Facets(r.search, {})
+        self.assertTrue(facets["pool_type"] == [{"value": "bookmark", "count": 4}, {"value": "track", "count": 1}], facets)
+
+        self.assertRaises(ConfigurationError, SearchProfile, {"facets": ["share"]}, self.app)
+
+        # view
+        view = APIv1(r, self.request)
+        self.request.POST = {"profile": "default"}
+        result = view.facets()
+        self.assertTrue(result["facets"]["pool_type"][0] == {"value": "bookmark", "count": 4}, result)
+        self.request.POST = {"profile": "tracks"}
+        result = view.facets()
+        self.assertTrue(result["error"])
+
+    def test_facetscache(self):
+        user = User("test")
+        r = self.root
+        create_bookmark(r, user)
+        create_track(r, user)
+        self.app.searchCache = ResultCache()
+        try:
+            view = APIv1(r, self.request)
+            self.request.POST = {"profile": "default"}
+            result = view.facets()
+            self.assertTrue(result["facets"]["pool_type"][0]["count"] == 1, result)
+            result["facets"]["pool_type"][0]["count"] = 100
+            result = view.facets()
+            self.assertTrue(result["facets"]["pool_type"][0]["count"] == 1, result)
+            self.assertTrue(self.app.searchCache.Stats()["hits"] == 1)
+        finally:
+            self.app.searchCache = None
+
+
+class tProfiles_db_sqlite(tProfiles_db, __local.SqliteTestCase):
+    """
+    see tests.__local
+    """
+
+class tProfiles_db_mysql(tProfiles_db, __local.MySqlTestCase):
+    """
+    see tests.__local
+    """
+
+class tProfiles_db_pg(tProfiles_db, __local.PostgreSqlTestCase):
+    """
+    see tests.__local
+    """
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pyramid_chameleon.interfaces import ITemplateRenderer
+
+from nive.definitions import ConfigurationError, ObjectConf, ViewModuleConf
+from nive_datastore.webapi.templates import ConfiguredTemplates, TemplateSpecs, CompileTemplate, CompileTemplates
+from nive_datastore.webapi.templates import ListingTemplate, ListRenderer
+from nive_datastore.webapi.view import APIv1
+from nive_datastore.cache import FragmentCache
+from nive.security import User, AuthTktSecurityPolicy
+from nive_datastore.tests.db_app import *
+from nive_datastore.tests import __local
+
+from pyramid import testing
+
+
+class Policy(AuthTktSecurityPolicy):
+    # fixed identity instead of auth cookies
+    def __init__(self, identity):
+        AuthTktSecurityPolicy.__init__(self, "secret")
+        self._identity = identity
+
+    def identity(self, request):
+        return self._identity
+
+
+BOOKMARK = "nive_datastore.webapi.tests:bookmark.pt"
+LISTING = "nive_datastore.webapi.tests:bookmark-list.pt"
+
+
+class tTemplates_db(object):
+
+    def setUp(self):
+        request = testing.DummyRequest()
+        request._LOCALE_ = "en"
+        self.request = request
+        self.config = testing.setUp(request=request)
+        self.config.include('pyramid_chameleon')
+        self._loadApp()
+        self.app.Startup(self.config)
+        self.root = self.app.root
+        self.request.context = self.root
+
+    def tearDown(self):
+        self.app.Close()
+        testing.tearDown()
+
+    def test_configured(self):
+        self.assertTrue(("bookmark", "template", BOOKMARK) in ConfiguredTemplates(self.app))
+        self.assertTrue(TemplateSpecs(self.app, BOOKMARK, "template") == [BOOKMARK])
+        self.assertTrue(TemplateSpecs(self.app, "/templates/item.pt", "template") == ["/templates/item.pt"])
+        self.assertTrue(TemplateSpecs(self.app, "item-list.pt", "listing") == ["nive_datastore.webapi:item-list.pt"])
+        # not found in any view module
+        self.assertTrue(TemplateSpecs(self.app, "item.pt", "template") == [])
+
+    def test_startup(self):
+        # compiled on startup
+        renderer = self.config.registry.queryUtility(ITemplateRenderer, name=BOOKMARK)
+        self.assertTrue(renderer is not None)
+        self.assertTrue(renderer.implementation()._cooked)
+        self.assertTrue(CompileTemplates(self.app, self.config.registry) >= 1)
+
+    def test_relative(self):
+        # relative names are resolved in the view module templates like renderTmpl does
+        app = self.app
+        views = ViewModuleConf(id="notes", templates="nive_datastore.webapi.tests:")
+        note = ObjectConf("nive_datastore.item", id="note", name="Note", dbparam="notes",
+                          template="bookmark.pt", listing="tests/bookmark-list.pt")
+        unknown = ObjectConf("nive_datastore.item", id="unknown", name="Unknown", dbparam="notes",
+                             template="unknown.pt")
+        self._loadApp([views, note, unknown])
+        try:
+            self.app.Startup(self.config)
+            self.assertTrue(TemplateSpecs(self.app, "bookmark.pt", "template") == [BOOKMARK])
+            self.assertTrue(self.config.registry.queryUtility(ITemplateRenderer, name="nive_datastore.webapi:tests/bookmark-list.pt"))
+            # bookmark and note templates, note listing. unknown.pt is skipped
+            self.assertTrue(CompileTemplates(self.app, self.config.registry) == 3)
+        finally:
+            self.app.Close()
+            self.app = app
+
+    def test_errors(self):
+        self.assertRaises(ConfigurationError, CompileTemplate, "nive_datastore.webapi.tests:missing.pt", self.config.registry)
+        # no renderer registered for the file type
+        self.assertTrue(CompileTemplate("nive_datastore.webapi.tests:missing.xyz", self.config.registry) is None)
+
+    def test_listing(self):
+        self.assertTrue(ListingTemplate(self.app, "bookmark") is None)
+        self.assertTrue(ListingTemplate(self.app, "unknown") is None)
+        self.app._c_listings["bookmark"] = LISTING
+        self.assertTrue(ListingTemplate(self.app, "bookmark") == LISTING)
+
+        renderer = ListRenderer(LISTING, self.request, system={"options": {"css": "x"}})
+        result = renderer.Render([{"title": "a"}, {"title": "b"}])
+        self.assertTrue(result == ["<li>a x</li>\n", "<li>b x</li>\n"])
+        # row values do not change the shared system values
+        self.assertTrue("title" not in renderer.system)
+
+    def test_renderlist(self):
+        view = APIv1(self.root, self.request)
+        rows = [{"title": "a", "type": "bookmark"}, {"title": "b", "type": "bookmark"}]
+        self.assertTrue(view.renderList(rows, template=LISTING, css="x") == "<li>a x</li>\n<li>b x</li>\n")
+        self.app._c_listings = {"bookmark": LISTING}
+        self.assertTrue(view.renderList(rows, "bookmark") == "<li>a </li>\n<li>b </li>\n")
+        self.assertTrue(view.renderList(rows + [{"title": "c"}]) == "<li>a </li>\n<li>b </li>\n-no type-")
+        self.assertTrue(view.renderList(rows[:1]) == view.renderListItem(rows[0]))
+        self.assertTrue(view.renderList([], "bookmark") == "")
+
+        # types without listing template
+        self.app._c_listings = {}
+        self.assertTrue(view.renderList(rows, "bookmark") == "-no listing--no listing-")
+        self.assertTrue(view.renderList(rows[:1]) == "-no listing-")
+        self.assertTrue(view.renderListItem(rows[0]) == "-no listing-")
+
+    def _view(self, item, user):
+        # new request for each call. permissions are evaluated once per request.
+        request = testing.DummyRequest()
+        request._LOCALE_ = "en"
+        request.context = item
+        view = APIv1(item, request)
+        view.User = lambda sessionuser=True: user
+        return view
+
+    def test_fragments(self):
+        user = User("test")
+        item = create_bookmark(self.root, user)
+        try:
+            view = APIv1(item, self.request)
+            view.User = lambda sessionuser=True: user
+            # not enabled
+            view.renderTmpl(cache=True)
+            self.app.fragmentCache = fragments = FragmentCache()
+            view.renderTmpl()
+            self.assertTrue(len(fragments) == 0)
+
+            body = view.renderTmpl(cache=True).body
+            self.assertTrue(len(fragments) == 1)
+            self.assertTrue(view.renderTmpl(cache=True).body == body)
+            self.assertTrue(fragments.Stats()["hits"] == 1)
+            # other groups
+            self.config.testing_securitypolicy(userid="test", identity={"principals": ["test", "group:editor"]})
+            self._view(item, user).renderTmpl(cache=True)
+            self.assertTrue(len(fragments) == 2)
+
+            # anonymous requests with the nive security policy share the fragment of requests
+            # without policy. authenticated users without groups do not.
+            self.config.set_security_policy(AuthTktSecurityPolicy("secret"))
+            self.assertTrue(self._view(item, user).renderTmpl(cache=True).body == body)
+            self.assertTrue(len(fragments) == 2)
+            self.assertTrue(fragments.Stats()["hits"] == 2)
+            self.config.set_security_policy(Policy({"userid": "test", "principals": []}))
+            self._view(item, user).renderTmpl(cache=True)
+            self.assertTrue(len(fragments) == 3)
+
+            item.Update({"comment": "new"}, user)
+            self.assertTrue(len(fragments) == 0)
+        finally:
+            self.root.Delete(item.id, user)
+
+
+class tTemplates_db_sqlite(tTemplates_db, __local.SqliteTestCase):
+    """
+    see tests.__local
+    """
+
+class tTemplates_db_mysql(tTemplates_db, __local.MySqlTestCase):
+    """
+    see tests.__local
+    """
+
+class tTemplates_db_pg(tTemplates_db, __local.PostgreSqlTestCase):
+    """
+    see tests.__local
+    """
@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import json
 
-from nive.security import User
+from nive.security import User, AuthTktSecurityPolicy
 from nive.definitions import Conf, ConfigurationError
 from nive.views import ExceptionalResponse
-from nive_datastore.webapi.view import ExtractJSValue, DeserializeItems, APIv1
+from nive.helper import JsonDataEncoder
+from nive_datastore.webapi.view import ExtractJSValue, DeserializeItems, APIv1, SearchExecutor
+from nive_datastore.cache import ResultCache
+from nive_datastore.webapi.tree import LoadSubtree, StreamTree, GetSubtreePlan
 from nive_datastore.tests.db_app import *
 from nive_datastore.tests import __local
 
@@ -308,6 +312,22 @@ class tWebapi_db(object):
         self.request.POST = {"id": "oh no"}
         result = view.deleteItem()
         self.assertTrue(len(result["result"])==0)
+
+        # delete descendants
+        o1 = create_bookmark(r, user)
+        self.remove.append(o1.id)
+        o2 = create_bookmark(o1, user)
+        o3 = create_track(o2, user)
+        o4 = create_track(r, user)
+        self.remove.append(o4.id)
+        self.request.POST = {"id": [str(o3.id), str(o4.id)]}
+        result = view.deleteItem()
+        self.assertTrue(result["result"]==[o4.id])
+        view = APIv1(o1, self.request)
+        self.request.POST = {"id": [str(o3.id), str(o2.id)], "descendants": "1"}
+        result = view.deleteItem()
+        self.assertTrue(result["result"]==[o2.id, o3.id])
+        self.assertTrue(self.root.LookupObj(o3.id)==None)
         
         
     def test_itemcontext(self):
@@ -629,6 +649,134 @@ class tWebapi_db(object):
         self.assertTrue(len(result["items"])==0)
         self.app.configuration.lock()
 
+    def test_multisearch(self):
+        user = User("test")
+        user.groups.append("group:manager")
+        r = self.root
+        view = APIv1(r, self.request)
+        o1 = create_bookmark(r, user)
+        create_bookmark(r, user)
+        create_track(o1, user)
+
+        self.request.POST = {"queries": [{"profile": "bookmarks"},
+                                         {"profile": "default", "parameter": {"size": 1}},
+                                         {"profile": "tracks"},
+                                         {"profile": "nonono"}]}
+        result = view.multiSearch()
+        results = result["results"]
+        self.assertTrue(len(results)==4, result)
+        self.assertTrue(results[0]["profile"]=="bookmarks")
+        self.assertTrue(len(results[0]["items"])==2, results[0])
+        self.assertTrue(len(results[1]["items"])==1)
+        self.assertTrue(results[1]["total"]==3, results[1])
+        # container search in root
+        self.assertTrue(len(results[2]["items"])==0)
+        self.assertTrue(results[3]["error"])
+        self.assertTrue("time" in results[0])
+
+        self.request.POST = {"queries": '[{"profile": "bookmarks"}]'}
+        result = view.multiSearch()
+        self.assertTrue(len(result["results"][0]["items"])==2, result)
+
+        self.request.POST = {"queries": "no json"}
+        result = view.multiSearch()
+        self.assertTrue(result["error"])
+        self.request.POST = {"queries": [{"profile": "bookmarks"}]*11}
+        result = view.multiSearch()
+        self.assertTrue(result["error"])
+
+        # groups
+        profiles = self.app.configuration.search
+        profiles["restricted"] = {"groups": ("group:admin",)}
+        try:
+            self.request.POST = {"queries": [{"profile": "restricted"}, {"profile": "bookmarks"}]}
+            result = view.multiSearch()
+        finally:
+            del profiles["restricted"]
+        self.assertTrue(result["results"][0]["error"], result)
+        self.assertTrue(len(result["results"][1]["items"])==2, result)
+
+        # worker connections see later writes
+        self.request.POST = {"queries": [{"profile": "bookmarks"}, {"profile": "default"}]}
+        view.multiSearch()
+        create_bookmark(r, user)
+        result = view.multiSearch()
+        self.assertTrue(len(result["results"][0]["items"])==3, result)
+        self.assertTrue(len(result["results"][1]["items"])==4, result)
+
+    def test_searchexecutor(self):
+        executor = SearchExecutor(self.app, 2)
+        self.assertTrue(SearchExecutor(self.app, 2) is executor)
+        larger = SearchExecutor(self.app, 4)
+        self.assertTrue(larger is not executor)
+        # replaced pools still accept tasks of running requests
+        self.assertTrue(list(executor.map(abs, [-1, -2])) == [1, 2])
+        self.assertTrue(SearchExecutor(self.app, 2) is larger)
+        self.app.CloseSearchExecutor()
+        self.assertTrue(SearchExecutor(self.app, 2) is not larger)
+        self.app.CloseSearchExecutor()
+
+
+    def test_searchcache(self):
+        user = User("test")
+        user.groups.append("group:manager")
+        r = self.root
+        self.app.searchCache = ResultCache()
+        view = APIv1(r, self.request)
+        create_bookmark(r, user)
+        create_track(r, user)
+
+        self.request.POST = {"profile":"bookmarks"}
+        result = view.search()
+        self.assertTrue(len(result["items"])==1, result)
+        result["items"].append("changed")
+        result = view.search()
+        self.assertTrue(len(result["items"])==1, result)
+        self.assertTrue(self.app.searchCache.Stats()["hits"]==1)
+
+        # other types do not invalidate
+        create_track(r, user)
+        result = view.search()
+        self.assertTrue(self.app.searchCache.Stats()["hits"]==2)
+
+        create_bookmark(r, user)
+        result = view.search()
+        self.assertTrue(len(result["items"])==2, result)
+        self.assertTrue(self.app.searchCache.Stats()["hits"]==2)
+
+        self.request.POST = {"type":"track"}
+        result = view.listItems()
+        self.assertTrue(len(result["items"])==2, result)
+        result = view.listItems()
+        self.assertTrue(len(result["items"])==2, result)
+        self.assertTrue(self.app.searchCache.Stats()["hits"]==3)
+        create_track(r, user)
+        result = view.listItems()
+        self.assertTrue(len(result["items"])==3, result)
+        self.app.searchCache = None
+
+
+    def test_listcache_deserialize(self):
+        user = User("test")
+        r = self.root
+        self.app.searchCache = ResultCache()
+        try:
+            create_track(r, user)
+            view = APIv1(r, self.request)
+            # deserializer changing the list in place
+            def deserialize(items, view):
+                items.append("changed")
+                return items
+            view.GetViewConf = lambda: Conf(settings={"type": "track", "deserialize": deserialize})
+            self.request.POST = {}
+            result = view.listItems()
+            self.assertTrue(len(result["items"])==2, result)
+            result = view.listItems()
+            self.assertTrue(len(result["items"])==2, result)
+            self.assertTrue(self.app.searchCache.Stats()["hits"]==1)
+        finally:
+            self.app.searchCache = None
+
         
     def test_renderjson(self):
         user = User("test")
@@ -679,6 +827,282 @@ class tWebapi_db(object):
         self.assertTrue(values.get("items")==None)
         
 
+    def test_loadsubtree(self):
+        user = User("test")
+        user.groups.append("group:manager")
+        r = self.root
+        objs=r.GetObjs()
+        for o in objs:
+            r.Delete(o.id, obj=o, user=user)
+        o1 = create_bookmark(r, user)
+        self.remove.append(o1.id)
+        o3 = create_bookmark(r, user)
+        self.remove.append(o3.id)
+        o2 = create_bookmark(o1, user)
+        create_track(o1, user)
+        create_track(o2, user)
+        create_track(o3, user)
+
+        children = LoadSubtree(r, {}, {}, 10, descend=lambda item: True)
+        for container in (r, o1, o2, o3):
+            ids = [o.id for o in container.GetObjs()]
+            self.assertTrue([o.id for o in children.get(container.id, [])]==ids)
+            for o in children.get(container.id, []):
+                self.assertTrue(o.parent.id==container.id)
+                loaded = container.GetObj(o.id)
+                self.assertTrue(o.data.get("link")==loaded.data.get("link"))
+
+        children = LoadSubtree(r, {}, {}, 1, descend=lambda item: True)
+        self.assertTrue(list(children.keys())==[r.id])
+        children = LoadSubtree(r, {"pool_type": "bookmark"}, {}, 10, descend=lambda item: item.id!=o1.id)
+        self.assertTrue(o1.id not in children)
+        self.assertTrue(len(children[r.id])==2)
+
+    def test_subtreerows(self):
+        user = User("test")
+        user.groups.append("group:manager")
+        view = APIv1(self.root, self.request)
+        r = self.root
+        objs=r.GetObjs()
+        for o in objs:
+            r.Delete(o.id, obj=o, user=user)
+        o1 = create_bookmark(r, user)
+        self.remove.append(o1.id)
+        o3 = create_bookmark(r, user)
+        self.remove.append(o3.id)
+        o2 = create_bookmark(o1, user)
+        create_track(o1, user)
+        create_track(o2, user)
+        create_track(o3, user)
+
+        # rendered from rows
+        profile = {"descent": ("nive.definitions.IContainer",), "secure": False,
+                   "toJson": {"bookmark": ("link", "comment", "pool_type"), "track": ("url", "number", "unknown")}}
+        view.GetViewConf = lambda: Conf(settings=profile)
+        rows = view.subtree()
+        # rendered from objects
+        profile = dict(profile, addContext=True)
+        objects = view.subtree()
+        def removeContext(values):
+            values.pop("context", None)
+            for v in values.get("items", ()):
+                removeContext(v)
+        removeContext(objects)
+        self.assertTrue(rows==objects)
+        self.assertTrue(len(rows["items"])==2)
+        self.assertTrue(len(rows["items"][0]["items"])==2)
+        self.assertTrue(rows["items"][0]["pool_type"]=="bookmark")
+        self.assertTrue("unknown" in rows["items"][0]["items"][1])
+
+        profile = {"descent": ("bookmark",), "secure": False, "levels": 1}
+        view.GetViewConf = lambda: Conf(settings=profile)
+        rows = view.subtree()
+        self.assertTrue(len(rows["items"])==2)
+        self.assertTrue(rows["items"][0].get("items")==None)
+
+    def test_subtreecache(self):
+        user = User("test")
+        user.groups.append("group:manager")
+        r = self.root
+        objs=r.GetObjs()
+        for o in objs:
+            r.Delete(o.id, obj=o, user=user)
+        o1 = create_bookmark(r, user)
+        self.remove.append(o1.id)
+        o3 = create_bookmark(r, user)
+        self.remove.append(o3.id)
+        o2 = create_bookmark(o1, user)
+        self.app.searchCache = cache = ResultCache()
+        profile = {"descent": ("nive.definitions.IContainer",)}
+        try:
+            view = APIv1(r, self.request)
+            view.GetViewConf = lambda: Conf(settings=profile)
+            values = view.subtree()
+            self.assertTrue(len(values["items"])==2)
+            values["items"].append("changed")
+            values = view.subtree()
+            self.assertTrue(len(values["items"])==2)
+            self.assertTrue(cache.Stats()["hits"]==1)
+
+            view3 = APIv1(o3, self.request)
+            view3.GetViewConf = lambda: Conf(settings=profile)
+            view3.subtree()
+            self.assertTrue(cache.Stats()["hits"]==1)
+
+            # writes invalidate the parents only
+            create_track(o2, user)
+            values = view.subtree()
+            self.assertTrue(len(values["items"][0]["items"][0]["items"])==1, values)
+            self.assertTrue(cache.Stats()["hits"]==1)
+            view3.subtree()
+            self.assertTrue(cache.Stats()["hits"]==2)
+
+            # excluded
+            profile = dict(profile, cache=False)
+            view.subtree()
+            view.subtree()
+            self.assertTrue(cache.Stats()["hits"]==2)
+
+            # anonymous requests with security policy
+            profile = dict(profile, cache=True)
+            self.config.set_security_policy(AuthTktSecurityPolicy("secret"))
+            for i in range(2):
+                request = testing.DummyRequest()
+                request.context = r
+                view = APIv1(r, request)
+                view.GetViewConf = lambda: Conf(settings=profile)
+                self.assertTrue(len(view.subtree()["items"])==2)
+            self.assertTrue(cache.Stats()["hits"]==3)
+        finally:
+            self.app.searchCache = None
+
+
+    def test_subtreestream(self):
+        tree = {"id": 1, "items": [{"id": 2, "items": iter([{"id": 3}, {}])}, {"id": 4, "items": []}]}
+        expected = {"id": 1, "items": [{"id": 2, "items": [{"id": 3}, {}]}, {"id": 4, "items": []}]}
+        self.assertTrue(json.loads("".join(StreamTree(tree, bufferSize=1)))==expected)
+        tree["items"][0]["items"] = iter([{"id": 3}, {}])
+        truncated = json.loads("".join(StreamTree(tree, maxNodes=3)))
+        self.assertTrue(truncated=={"id": 1, "items": [{"id": 2, "items": [{"id": 3}]}], "truncated": True})
+
+        user = User("test")
+        user.groups.append("group:manager")
+        r = self.root
+        objs=r.GetObjs()
+        for o in objs:
+            r.Delete(o.id, obj=o, user=user)
+        o1 = create_bookmark(r, user)
+        self.remove.append(o1.id)
+        o3 = create_bookmark(r, user)
+        self.remove.append(o3.id)
+        o2 = create_bookmark(o1, user)
+        create_track(o2, user)
+
+        view = APIv1(r, self.request)
+        profile = {"descent": ("nive.definitions.IContainer",)}
+        view.GetViewConf = lambda: Conf(settings=profile)
+        values = view.subtree()
+        profile = dict(profile, stream=True)
+        response = view.subtree()
+        self.assertTrue(response.content_type=="application/json")
+        self.assertTrue(json.loads(b"".join(response.app_iter).decode("utf-8"))==json.loads(JsonDataEncoder().encode(values)))
+        profile = dict(profile, maxNodes=2)
+        response = view.subtree()
+        values = json.loads(b"".join(response.app_iter).decode("utf-8"))
+        self.assertTrue(values["truncated"])
+        self.assertTrue(len(values["items"])==1)
+        self.assertTrue(values["items"][0].get("items")==[])
+
+        # items behind the last streamed node are not loaded
+        children = LoadSubtree(r, {}, {}, 10, descend=lambda item: True, maxNodes=3)
+        self.assertTrue([i.id for i in children[r.id]]==[o1.id, o3.id])
+        self.assertTrue([i.id for i in children[o1.id]]==[o2.id])
+        self.assertTrue(o2.id not in children)
+        children = LoadSubtree(r, {}, {}, 10, descend=lambda item: True, maxNodes=4)
+        self.assertTrue(o2.id in children)
+        children = LoadSubtree(r, {}, {}, 10, descend=lambda item: True, maxNodes=1)
+        self.assertTrue(list(children.keys())==[r.id])
+        self.assertTrue(len(children[r.id])==1)
+        profile = dict(profile, maxNodes=3)
+        response = view.subtree()
+        values = json.loads(b"".join(response.app_iter).decode("utf-8"))
+        self.assertTrue(values["truncated"])
+        self.assertTrue([i["id"] for i in values["items"]]==[o1.id])
+        self.assertTrue([i["id"] for i in values["items"][0]["items"]]==[o2.id])
+
+
+    def test_subtreeplan(self):
+        profile = {"descent": ("nive.definitions.IContainer", "unknown"), "levels": 2,
+                   "toJson": {"track": ("url",)}, "parameter": {"pool_state": 1}}
+        plan = GetSubtreePlan(self.app, profile)
+        self.assertTrue(plan is GetSubtreePlan(self.app, profile))
+        self.assertTrue(plan is not GetSubtreePlan(self.app, dict(profile)))
+        self.assertTrue(plan.fields["track"]==("url",))
+        self.assertTrue(plan.fields["bookmark"]==("id", "link", "comment", "pool_changedby", "pool_change"))
+        self.assertTrue(plan.descend==frozenset(("bookmark", "track")))
+        self.assertTrue(plan.parameter=={"pool_state": 1, "pool_type": ["bookmark", "track"]})
+        self.assertTrue(plan.operators=={"pool_type": "IN"})
+        self.assertTrue(plan.levels==2)
+        self.assertTrue(plan.secure)
+
+
+    def test_subtreelazy(self):
+        user = User("test")
+        user.groups.append("group:manager")
+        r = self.root
+        objs=r.GetObjs()
+        for o in objs:
+            r.Delete(o.id, obj=o, user=user)
+        o1 = create_bookmark(r, user)
+        self.remove.append(o1.id)
+        o3 = create_bookmark(r, user)
+        self.remove.append(o3.id)
+        o2 = create_bookmark(o1, user)
+        for i in range(3):
+            create_track(o2, user)
+
+        view = APIv1(r, self.request)
+        for secure in (False, True):
+            profile = {"descent": ("nive.definitions.IContainer",), "lazy": 1, "pageSize": 2, "secure": secure}
+            view.GetViewConf = lambda: Conf(settings=profile)
+            self.request.POST = {}
+            values = view.subtree()
+            self.assertTrue(len(values["items"])==2)
+            node = values["items"][0]
+            self.assertTrue(node.get("items")==None)
+            self.assertTrue(node["count"]==1)
+            self.assertTrue(values["items"][1]["count"]==0)
+            self.assertTrue(values["items"][1].get("cursor")==None)
+
+            # expand o1
+            self.request.POST = {"cursor": node["cursor"]}
+            values = view.subtree()
+            self.assertTrue(values["count"]==1)
+            self.assertTrue(values.get("cursor")==None)
+            self.assertTrue(len(values["items"])==1)
+            node = values["items"][0]
+            self.assertTrue(node["count"]==3)
+
+            # expand o2 page by page
+            self.request.POST = {"cursor": node["cursor"]}
+            values = view.subtree()
+            self.assertTrue([i["number"] for i in values["items"]]==[123, 123])
+            self.assertTrue(values["count"]==3)
+            self.request.POST = {"cursor": values["cursor"]}
+            values = view.subtree()
+            self.assertTrue(len(values["items"])==1)
+            self.assertTrue(values.get("cursor")==None)
+
+        # invalid cursors
+        for cursor in ("abc", "1-2", "999999-0-1"):
+            self.request.POST = {"cursor": cursor}
+            values = view.subtree()
+            self.assertTrue(values["error"]=="Invalid cursor")
+        view = APIv1(o3, self.request)
+        view.GetViewConf = lambda: Conf(settings=profile)
+        self.request.POST = {"cursor": "%d-0-1" % o2.id}
+        self.assertTrue(view.subtree()["error"]=="Invalid cursor")
+
+        # cursors are limited to the profiles levels and descent types
+        view = APIv1(r, self.request)
+        profile = {"descent": ("bookmark",), "lazy": 1, "levels": 2, "secure": False}
+        view.GetViewConf = lambda: Conf(settings=profile)
+        self.request.POST = {"cursor": "%d-0-1000" % o1.id}
+        values = view.subtree()
+        self.assertTrue(len(values["items"])==1)
+        self.assertTrue(values["items"][0].get("cursor")==None)
+        self.request.POST = {"cursor": "%d-0-1" % o2.id}
+        self.assertTrue(view.subtree()["error"]=="Invalid cursor")
+        profile = {"descent": ("track",), "lazy": 1, "secure": False}
+        self.request.POST = {"cursor": "%d-0-1" % o1.id}
+        self.assertTrue(view.subtree()["error"]=="Invalid cursor")
+        # profiles without lazy
+        profile = {"descent": ("nive.definitions.IContainer",), "secure": False}
+        self.request.POST = {"cursor": "%d-0-1" % o1.id}
+        self.assertTrue(view.subtree()["error"]=="Invalid cursor")
+        self.request.POST = {}
+
+
     def test_rendertmpl(self):
         user = User("test")
         user.groups.append("group:manager")
@@ -738,6 +1162,123 @@ class tWebapi_db(object):
             self.assertTrue(objs+1==len(r.GetObjsList(fields=["id"])))
 
 
+    def test_formcache(self):
+        user = User("test")
+        user.groups.append("group:manager")
+        r = self.root
+        o1 = create_bookmark(r, user)
+        self.remove.append(o1.id)
+        self.app.searchCache = cache = ResultCache()
+        self.request.method = "GET"
+        try:
+            view = APIv1(r, self.request)
+            view.__configuration__ = lambda : Conf(assets=(), views=())
+            self.request.GET = {"pool_type": "bookmark"}
+            rendered = view.newItemForm()
+            self.assertTrue(rendered["content"].find("<form")!=-1)
+            self.assertTrue(view.newItemForm()==rendered)
+            self.assertTrue(self.request.response.headers["X-Result"]=="true")
+            self.assertTrue(cache.Stats()["hits"]==1)
+            # form values are not cached
+            self.request.GET = {"pool_type": "bookmark", "comment": "prefilled"}
+            self.assertTrue(view.newItemForm()["content"].find("prefilled")!=-1)
+            self.assertTrue(cache.Stats()["hits"]==1)
+
+            view = APIv1(o1, self.request)
+            view.__configuration__ = lambda : Conf(assets=(), views=())
+            self.request.GET = {}
+            rendered = view.setItemForm()
+            self.assertTrue(view.setItemForm()==rendered)
+            self.assertTrue(cache.Stats()["hits"]==2)
+            # updates invalidate the edit form
+            o1.Update({"comment": "new comment"}, user)
+            self.assertTrue(view.setItemForm()["content"].find("new comment")!=-1)
+            self.assertTrue(cache.Stats()["hits"]==2)
+
+            # excluded
+            view.GetViewConf = lambda: Conf(settings={"cache": False})
+            view.setItemForm()
+            view.setItemForm()
+            self.assertTrue(cache.Stats()["hits"]==2)
+
+            # forms with csrf tokens
+            view = APIv1(r, self.request)
+            view.__configuration__ = lambda : Conf(assets=(), views=())
+            view._FormHead = lambda form: '<input type="hidden" name="csrf_token" value="secret">'
+            self.request.GET = {"pool_type": "track"}
+            view.newItemForm()
+            view.newItemForm()
+            self.assertTrue(cache.Stats()["hits"]==2)
+
+            # cached per user
+            self.config.testing_securitypolicy(userid="other", identity={"principals": []})
+            request = testing.DummyRequest(method="GET")
+            request.GET = {"pool_type": "bookmark"}
+            request.context = r
+            view = APIv1(r, request)
+            view.__configuration__ = lambda : Conf(assets=(), views=())
+            view.newItemForm()
+            self.assertTrue(cache.Stats()["hits"]==2)
+        finally:
+            self.app.searchCache = None
+            self.request.method = "POST"
+            self.request.GET = {}
+
+
+    def test_validatefield(self):
+        user = User("test")
+        user.groups.append("group:manager")
+        r = self.root
+        view = APIv1(r, self.request)
+        view.__configuration__ = lambda : Conf(assets=(), views=())
+
+        self.request.POST = {"type": "track", "number": "123", "fields": "number"}
+        result = view.validateField()
+        self.assertTrue(result["result"])
+        self.assertTrue(result["errors"]=={})
+        self.request.POST = {"type": "track", "number": "abc"}
+        result = view.validateField()
+        self.assertFalse(result["result"])
+        self.assertTrue(list(result["errors"].keys())==["number"])
+        # requested but missing
+        self.request.POST = {"type": "track", "fields": ["url", "number"], "number": "1"}
+        result = view.validateField()
+        self.assertFalse(result["result"])
+        self.assertTrue(list(result["errors"].keys())==["url"])
+        self.request.POST = {"type": "track", "fields": "unknown"}
+        result = view.validateField()
+        self.assertFalse(result["result"])
+        self.assertTrue("unknown" in result["errors"])
+        # field configurations are cached
+        self.assertTrue(("newItem", "track", "newItem") in self.app._c_formfields)
+        # subset names parsed from requests are equal but not identical
+        typeconf = self.app.configurationQuery.GetObjectConf("track")
+        fields = view._FormFields("newItem", typeconf, "".join(["new", "Item"]))
+        self.assertTrue(view._FormFields("newItem", typeconf, "".join(["new", "Item"])) is fields)
+
+        self.request.POST = {"number": "1"}
+        result = view.validateField()
+        self.assertTrue(self.request.response.status.startswith("400"))
+        self.request.response.status = "200 OK"
+
+        # object form
+        o1 = create_track(r, user)
+        self.remove.append(o1.id)
+        view = APIv1(o1, self.request)
+        view.__configuration__ = lambda : Conf(assets=(), views=())
+        self.request.POST = {"url": "http://www.nive.co"}
+        self.assertTrue(view.validateField()["result"])
+        self.request.POST = {"url": ""}
+        self.assertFalse(view.validateField()["result"])
+
+        # customized form settings
+        view.GetViewConf = lambda: Conf(settings={"form": {"fields": ("number",)}})
+        self.request.POST = {"fields": "url,number", "number": "1"}
+        result = view.validateField()
+        self.assertTrue(list(result["errors"].keys())==["url"])
+        self.request.POST = {}
+
+
     def test_newform_assets(self):
         user = User("test")
         user.groups.append("group:manager")
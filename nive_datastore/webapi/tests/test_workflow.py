@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from nive.definitions import Conf, ILocalGroups
+from nive.security import User, AuthTktSecurityPolicy
+from nive.workflow import WfProcessConf, WfStateConf, WfTransitionConf, WorkflowNotAllowed
+from nive_datastore.webapi.view import APIv1
+from nive_datastore.webapi.workflow import WorkflowStates, SerializeState, GetTransitionCache, ItemPrincipals
+from nive_datastore.tests.db_app import *
+from nive_datastore.tests import __local
+
+from pyramid import testing
+
+
+def shared(transition, context, user, values):
+    return context.meta.get("pool_filename") == "shared"
+
+
+wfconf = WfProcessConf(
+    id = "wftest",
+    name = "Test workflow",
+    states = [
+        WfStateConf(id="draft", name="Draft", actions=["edit", "delete"]),
+        WfStateConf(id="public", name="Public", actions=["edit", "delete"]),
+    ],
+    transitions = [
+        WfTransitionConf(id="publish", name="Publish", fromstate="draft", tostate="public",
+                         roles=("group:editor",), actions=("publish",)),
+        WfTransitionConf(id="share", name="Share", fromstate="draft", tostate="public",
+                         roles=("group:editor",), actions=("share",), conditions=(shared,)),
+        WfTransitionConf(id="revoke", name="Revoke", fromstate="public", tostate="draft",
+                         roles=("group:admin",), actions=("revoke",)),
+    ],
+    apply = None
+)
+
+ownerconf = WfProcessConf(
+    id = "wfowner",
+    name = "Owner workflow",
+    states = [
+        WfStateConf(id="draft", name="Draft", actions=["edit", "delete"]),
+        WfStateConf(id="public", name="Public", actions=["edit", "delete"]),
+    ],
+    transitions = [
+        WfTransitionConf(id="claim", name="Claim", fromstate="draft", tostate="public",
+                         roles=("group:owner",), actions=("claim",)),
+    ],
+    apply = None
+)
+
+
+class LocalGroupsPolicy(AuthTktSecurityPolicy):
+    """
+    nive security policy with a fixed user. Principals include the local groups of the
+    requests context.
+    """
+    def __init__(self, userid):
+        AuthTktSecurityPolicy.__init__(self, "secret")
+        self.userid = userid
+
+    def load_identity(self, request):
+        return {"userid": self.userid, "principals": self._principals(self.userid, request)}
+
+    def _principals(self, userid, request):
+        context = request.context
+        if context is not None and ILocalGroups.providedBy(context):
+            return ["group:editor"] + list(context.GetLocalGroups(userid))
+        return ["group:editor"]
+
+
+class tWorkflow_db(object):
+
+    def setUp(self):
+        request = testing.DummyRequest()
+        request._LOCALE_ = "en"
+        self.request = request
+        self.request.content_type = ""
+        self.request.method = "POST"
+        self.config = testing.setUp(request=request)
+        self._loadApp([wfconf, ownerconf])
+        self.app.Startup(self.config)
+        self.root = self.app.root
+        self.request.context = self.root
+        self.user = User("test")
+        self.user.groups.append("group:editor")
+        GetTransitionCache(wfconf).entries.clear()
+        GetTransitionCache(ownerconf).entries.clear()
+
+    def tearDown(self):
+        for r in self.root.GetObjsList(fields=["id"]):
+            self.root.Delete(r["id"], self.user)
+        self.app.Close()
+        testing.tearDown()
+
+    def _items(self):
+        items = []
+        for state, filename in (("draft", ""), ("draft", "shared"), ("public", ""), (None, "")):
+            item = create_track(self.root, self.user)
+            if state:
+                item.meta["pool_wfp"] = "wftest"
+                item.meta["pool_wfa"] = state
+                item.meta["pool_filename"] = filename
+                item.Commit(self.user)
+            items.append(item)
+        return [self.root.GetObj(item.id) for item in items]
+
+    def _state(self, id):
+        return self.app.db.Query("select pool_wfa from pool_meta where id=%d" % id)[0][0]
+
+    def test_states(self):
+        items = self._items()
+        lookup = WorkflowStates(self.app, self.user)
+        for item in items:
+            info = lookup.GetWfInfo(item)
+            expected = item.workflow.GetWfInfo(self.user)
+            if not expected:
+                self.assertTrue(info == {})
+                continue
+            self.assertTrue(info["state"].id == expected["state"].id)
+            self.assertTrue([t.id for t in info["transitions"]] == [t.id for t in expected["transitions"]])
+            self.assertTrue(SerializeState(info) == SerializeState(expected))
+        self.assertTrue([t.id for t in lookup.GetWfInfo(items[1])["transitions"]] == ["publish", "share"])
+        self.assertTrue([t.id for t in lookup.GetWfInfo(items[2])["transitions"]] == [])
+        # one process, transitions evaluated once per state
+        self.assertTrue(len(lookup._processes) == 1)
+        self.assertTrue(len(GetTransitionCache(wfconf).entries) == 2)
+
+        # entry actions start at the entry point like Process.Action()
+        self.assertRaises(WorkflowNotAllowed, lookup.Action, items[2], "create")
+        self.assertTrue(items[2].meta["pool_wfa"] == wfconf.entryPoint)
+
+    def test_transitioncache(self):
+        items = self._items()
+        cache = GetTransitionCache(wfconf)
+        cache.entries.clear()
+        WorkflowStates(self.app, self.user).GetWfInfo(items[0])
+        self.assertTrue(GetTransitionCache(wfconf) is cache)
+        self.assertTrue([k[0] for k in cache.entries] == ["draft"])
+        # shared by all requests
+        WorkflowStates(self.app, self.user).GetWfInfo(items[1])
+        self.assertTrue(len(cache.entries) == 1)
+        admin = User("admin")
+        admin.groups.append("group:admin")
+        self.assertTrue([t.id for t in WorkflowStates(self.app, admin).GetWfInfo(items[2])["transitions"]] == ["revoke"])
+        self.assertTrue(len(cache.entries) == 2)
+
+        # changed configurations
+        conf = wfconf.copy()
+        self.assertTrue(GetTransitionCache(conf) is not cache)
+        changed = GetTransitionCache(conf)
+        conf.transitions = conf.transitions[:1]
+        self.assertTrue(GetTransitionCache(conf) is not changed)
+
+    def test_action(self):
+        items = self._items()
+        view = APIv1(items[0], self.request)
+        view.User = lambda sessionuser=True: self.user
+        self.request.POST = {"action": "publish", "test": "true"}
+        self.assertTrue(view.action()["result"])
+        self.request.POST = {"action": "share", "test": "true"}
+        self.assertFalse(view.action()["result"])
+        self.request.POST = {"action": "edit", "test": "true"}
+        self.assertTrue(view.action()["result"])
+        self.request.POST = {"action": "revoke", "test": "true"}
+        self.assertFalse(view.action()["result"])
+
+        self.request.POST = {"action": "publish"}
+        result = view.action()
+        self.assertTrue(result["result"])
+        self.assertTrue(result["state"]["id"] == "public")
+        self.assertTrue(result["state"]["transitions"] == [])
+
+    def test_view(self):
+        items = self._items()
+        view = APIv1(self.root, self.request)
+        self.request.POST = {"id": [str(item.id) for item in items]}
+        result = view.states()
+        self.assertTrue(result["result"])
+        states = result["states"]
+        self.assertTrue(len(states) == 4)
+        self.assertTrue(states[str(items[0].id)]["id"] == "draft")
+        self.assertTrue(states[str(items[2].id)]["id"] == "public")
+        self.assertFalse(states[str(items[3].id)]["result"])
+        self.assertTrue(states[str(items[0].id)] == APIv1(items[0], self.request).state())
+
+        self.request.POST = {"id": "abc"}
+        self.assertFalse(view.states()["result"])
+        self.request.POST = {}
+        self.assertFalse(view.states()["result"])
+
+    def test_actionbatch(self):
+        items = self._items()
+        ids = [item.id for item in items]
+        view = APIv1(self.root, self.request)
+        view.User = lambda sessionuser=True: self.user
+        batches = []
+        view.GetViewConf = lambda: Conf(settings={"callback": lambda items, action, view: batches.append((items, action))})
+
+        self.request.POST = {"action": "publish", "id": [str(id) for id in ids]+["999999"]}
+        result = view.actionBatch()
+        # draft items published, public item not allowed, item without workflow and unknown id skipped
+        self.assertTrue(result["result"] == [ids[0], ids[1]])
+        self.assertTrue(len(result["error"]) == 3)
+        self.assertTrue("Not found: Item id 999999" in result["error"])
+        self.assertTrue("No workflow: Item id %d" % (ids[3]) in result["error"])
+        self.assertTrue([o.id for o in batches[0][0]] == result["result"])
+        self.assertTrue(batches[0][1] == "publish")
+        for id in ids[:3]:
+            self.assertTrue(self._state(id) == "public")
+
+        admin = User("admin")
+        admin.groups.append("group:admin")
+        view.User = lambda sessionuser=True: admin
+        view.GetViewConf = lambda: Conf(settings={"profile": {"type": "track", "container": True,
+                                                              "fields": ["id"], "parameter": {"pool_wfa": "public"}}})
+        self.request.POST = {"action": "revoke"}
+        result = view.actionBatch()
+        self.assertTrue(sorted(result["result"]) == ids[:3])
+        for id in ids[:3]:
+            self.assertTrue(self._state(id) == "draft")
+
+        # failing callbacks cancel the transaction
+        def fail(items, action, view):
+            raise ValueError("cancel")
+        view.GetViewConf = lambda: Conf(settings={"callback": fail})
+        self.request.POST = {"action": "publish", "id": [str(id) for id in ids]}
+        self.assertRaises(ValueError, view.actionBatch)
+
+        view.GetViewConf = lambda: None
+        self.request.POST = {"action": "publish"}
+        self.assertTrue(view.actionBatch()["error"] == "Empty id")
+        self.request.POST = {"id": "1"}
+        self.assertTrue(view.actionBatch()["error"] == "Empty action")
+        self.request.POST = {"action": "create", "id": [str(id) for id in ids]}
+        self.assertTrue(view.actionBatch()["error"] == "Invalid action")
+        self.request.POST = {"action": "publish", "profile": "unknown"}
+        self.assertTrue(view.actionBatch()["error"] == "Unknown profile")
+
+        # profile definitions are not accepted from requests
+        self.request.content_type = "application/json"
+        self.request.json_body = {"action": "publish", "transition": "", "id": "",
+                                  "profile": {"type": "track", "container": True,
+                                              "fields": ["id", "-(select 1) as leak"]}}
+        try:
+            self.assertTrue(view.actionBatch()["error"] == "Invalid profile")
+            self.assertTrue(self.request.response.status.startswith("400"))
+        finally:
+            self.request.content_type = ""
+            del self.request.json_body
+
+    def test_localroles(self):
+        # items owned by the user in a container not owned by the user
+        other = User("other")
+        folder = create_bookmark(self.root, other)
+        owned = create_track(folder, self.user)
+        notowned = create_track(folder, other)
+        for item in (owned, notowned):
+            item.meta["pool_wfp"] = "wfowner"
+            item.meta["pool_wfa"] = "draft"
+            item.Commit(self.user)
+        folder = self.root.GetObj(folder.id)
+        self.config.set_security_policy(LocalGroupsPolicy("test"))
+        self.request.context = folder
+
+        self.assertTrue("group:owner" in ItemPrincipals(folder.GetObj(owned.id), self.request))
+        self.assertFalse("group:owner" in ItemPrincipals(folder.GetObj(notowned.id), self.request))
+        self.assertFalse("group:owner" in ItemPrincipals(folder, self.request))
+
+        view = APIv1(folder, self.request)
+        view.User = lambda sessionuser=True: self.user
+        self.request.POST = {"id": [str(owned.id), str(notowned.id)]}
+        states = view.states()["states"]
+        self.assertTrue([t["id"] for t in states[str(owned.id)]["transitions"]] == ["claim"], states)
+        self.assertTrue(states[str(notowned.id)]["transitions"] == [], states)
+
+        self.request.POST = {"action": "claim", "id": [str(owned.id), str(notowned.id)]}
+        result = view.actionBatch()
+        self.assertTrue(result["result"] == [owned.id], result)
+        self.assertTrue(self._state(owned.id) == "public")
+        self.assertTrue(self._state(notowned.id) == "draft")
+
+
+class tWorkflow_db_sqlite(tWorkflow_db, __local.SqliteTestCase):
+    """
+    see tests.__local
+    """
+
+class tWorkflow_db_mysql(tWorkflow_db, __local.MySqlTestCase):
+    """
+    see tests.__local
+    """
+
+class tWorkflow_db_pg(tWorkflow_db, __local.PostgreSqlTestCase):
+    """
+    see tests.__local
+    """
@@ -0,0 +1,560 @@
+# Copyright 2012-2020 Arndt Droullier, Nive GmbH. All rights reserved.
+# Released under GPL3. See license.txt
+
+"""
+Subtree loading
+---------------
+Loading a subtree container by container with `GetObjs()` costs at least two queries per
+container. `LoadSubtree()` loads all items of a subtree level by level instead: the children
+of all containers of one level are selected with a single query (`pool_unitref IN (...)`) and
+their data is loaded in one batch per data table. The nested result is assembled in memory.
+
+A recursive sql query (CTE) is not used because it is not supported by all database versions
+the datastore runs on and the profile filters have to be applied on each level anyway.
+
+If the rendered values do not depend on objects `LoadSubtreeRows()` skips object creation
+altogether. Only the rendered columns of each type are selected and returned as value
+dictionaries. The types to descend into and the types rendered are resolved up front
+by `SubtreeProjection`.
+
+If materialized paths are enabled (see `nive_datastore.hierarchy`) and the number of levels
+is not limited all items below the context are selected with a single range query on
+`pool_path` and grouped by container in memory. Only the data is loaded level by level.
+Limited subtrees are loaded with one query per level to skip the items below the last level.
+
+Deep subtrees can be loaded lazily. `CountChildren()` returns the number of children of
+the last loaded containers and `MakeCursor()` creates a token to load the children page by
+page later (see `page` in `LoadSubtree()`).
+
+Subtree profiles are compiled once into a `SubtreePlan` holding the rendered fields per type,
+the query parameter and operators, the resolved descent types and levels. Plans for
+`AppConf.subtree` and subtree view settings are compiled on application startup, all others
+on first use. ::
+
+    plan = GetSubtreePlan(app, profileSettings)
+
+Large subtrees can be written as json stream with `StreamTree()`. Nodes are serialized depth
+first while the nested `items` are produced. The complete json string is never built.
+If the stream is limited to `maxNodes` the loaders only descend into containers within the
+first `maxNodes` nodes of the depth first output and the children of the context are limited
+to `maxNodes`.
+"""
+
+from nive.definitions import IContainer, IViewModuleConf
+from nive.helper import ClassFactory, JsonDataEncoder, ResolveName
+
+from nive_datastore.cache import MakeCacheKey
+
+from nive_datastore.hierarchy import PathEnabled, PathField, DescendantsRange
+
+# meta columns required to build the tree
+TreeFields = ("id", "pool_unitref", "pool_type")
+
+# maximum number of ids passed to one `IN` query
+MaxInList = 500
+
+# stream output is sent in chunks of about this size
+StreamBufferSize = 64*1024
+
+# cursor token values separator
+CursorSeparator = "-"
+
+# default number of levels and children per cursor page
+DefaultLevels = 10000
+DefaultPageSize = 50
+
+# maximum number of compiled plans per application
+MaxPlans = 500
+
+
+def LoadSubtree(context, parameter, operators, levels, descend, page=None, preload=None, maxNodes=0):
+    """
+    Loads the items below `context` up to `levels` with one query per level. Items are
+    filtered by `parameter` and `operators` like `GetObjs()`. `descend` is called for each
+    loaded container and decides whether its children are loaded. The children of `context`
+    are always loaded. If set `page=(start, max)` limits the children of `context`.
+    If set `preload(ids)` is called with the ids of each loaded level before `descend`.
+    If set `maxNodes` stops loading items not included in the first `maxNodes` nodes
+    in depth first order (see `StreamTree()`).
+
+    Returns a dictionary mapping container ids to the list of child objects sorted by the
+    containers default sort order.
+    """
+    children = {}
+    page, queryLevels = _NodeLimit(page, levels, maxNodes)
+    query = ChildQuery(context, parameter, operators, list(TreeFields)+["pool_datatbl", "pool_dataref"], queryLevels, page)
+    current = [context] if IContainer.providedBy(context) else []
+    while current and levels > 0:
+        levels -= 1
+        # group parents by sort order. usually all containers share the same default sort.
+        bysort = {}
+        for parent in current:
+            bysort.setdefault(parent.GetSort(), []).append(parent)
+        current = []
+        for sort, parents in bysort.items():
+            objs = _LoadObjs(context, parents, query.Select([p.id for p in parents], sort))
+            if preload is not None:
+                preload([obj.id for obj in objs])
+            for obj in objs:
+                children.setdefault(obj.parent.id, []).append(obj)
+                if IContainer.providedBy(obj) and descend(obj):
+                    current.append(obj)
+        # signal loaded objects like GetObjs()
+        for parent in bysort.values():
+            for p in parent:
+                p.Signal("loadObj", children.get(p.id, []))
+        if maxNodes and current:
+            first = _FirstNodes(children, context.id, maxNodes, lambda obj: obj.id)
+            current = [obj for obj in current if obj.id in first]
+    return children
+
+
+def LoadSubtreeRows(context, parameter, operators, levels, projection, allowed=None, page=None, preload=None,
+                    maxNodes=0):
+    """
+    Loads the rendered values of the items below `context` up to `levels` without creating
+    objects. Rows are filtered by `parameter` and `operators` like `LoadSubtree()`. The types
+    to descend into are looked up in `projection.descend`. The children of `context` are
+    always loaded. If set `allowed(id, type id, container id)` is called for each loaded
+    container to descend into. The children of not allowed containers are not loaded.
+    `page`, `preload` and `maxNodes` are used like in `LoadSubtree()`.
+
+    Returns a dictionary mapping container ids to the list of child rows. Each row is a
+    tuple `(id, type id, values)`.
+    """
+    children = {}
+    page, queryLevels = _NodeLimit(page, levels, maxNodes)
+    query = ChildQuery(context, parameter, operators, projection.MetaFields(), queryLevels, page)
+    current = [(context.id, context.GetSort())] if IContainer.providedBy(context) else []
+    while current and levels > 0:
+        levels -= 1
+        bysort = {}
+        for id, sort in current:
+            bysort.setdefault(sort, []).append(id)
+        current = []
+        for sort, ids in bysort.items():
+            rows = _LoadRows(context, query.Select(ids, sort), projection)
+            if preload is not None:
+                preload([row[0] for row in rows])
+            for row in rows:
+                children.setdefault(row[3], []).append(row[:3])
+                typename = row[1]
+                if typename in projection.containers and typename in projection.descend:
+                    if allowed is None or allowed(row[0], typename, row[3]):
+                        current.append((row[0], projection.sort[typename]))
+        if maxNodes and current:
+            first = _FirstNodes(children, context.id, maxNodes, lambda row: row[0])
+            current = [c for c in current if c[0] in first]
+    return children
+
+
+def _NodeLimit(page, levels, maxNodes):
+    # limited trees: the children of the context are limited to maxNodes and the path query
+    # is not used because it selects all items below the context at once
+    if not maxNodes:
+        return page, levels
+    if page is None:
+        page = (0, maxNodes)
+    return page, min(levels, 1)
+
+
+def _FirstNodes(children, rootid, maxNodes, key):
+    # the ids of the loaded nodes with children in the first `maxNodes` nodes of the depth
+    # first output. the context is the first node. nodes of levels not loaded yet are only
+    # inserted after their parents, so loaded nodes never move to the front.
+    ids = set()
+    count = 1
+    stack = [iter(children.get(rootid, ()))]
+    while stack and count < maxNodes:
+        try:
+            node = next(stack[-1])
+        except StopIteration:
+            stack.pop()
+            continue
+        count += 1
+        if count < maxNodes:
+            ids.add(key(node))
+            stack.append(iter(children.get(key(node), ())))
+    return ids
+
+
+def CountChildren(context, parameter, operators, ids):
+    """
+    Returns a dictionary mapping the container ids to the number of children. Children are
+    filtered by `parameter` and `operators` like `LoadSubtree()`. Containers without children
+    are not included.
+    """
+    return ChildQuery(context, parameter, operators, ["pool_unitref"], 1).Count(ids)
+
+
+def MakeCursor(id, start, levels):
+    """
+    Returns the cursor token to load the children of container `id` beginning at `start`.
+    `levels` is the number of levels left to load below the container.
+    """
+    return CursorSeparator.join([str(id), str(start), str(levels)])
+
+
+def ParseCursor(cursor):
+    """
+    Returns `(id, start, levels)` of the cursor token. Raises ValueError for invalid tokens.
+    """
+    values = [int(v) for v in str(cursor).split(CursorSeparator)]
+    if len(values) != 3 or min(values) < 0:
+        raise ValueError("Invalid cursor")
+    return tuple(values)
+
+
+class ChildQuery(object):
+    """
+    Selects the meta records of the children of multiple containers. Without materialized
+    paths each call runs a `pool_unitref IN (...)` query. With paths enabled all items below
+    the context are selected once and returned from memory. The path query selects items at
+    any depth and is only used if the number of levels is not limited (`DefaultLevels`) and
+    the containers use the contexts sort order.
+    `page=(start, max)` limits the children of the context.
+    """
+
+    def __init__(self, context, parameter, operators, fields, levels, page=None):
+        self.context = context
+        self.parameter = parameter
+        self.operators = operators
+        self.fields = fields
+        self.page = page
+        self.usePath = levels >= DefaultLevels and PathEnabled(context.app)
+        self._descendants = None
+
+    def Select(self, ids, sort):
+        """
+        Returns the records of all children of the containers `ids` sorted by `sort`.
+        """
+        if self.page and list(ids) == [self.context.id]:
+            p, o = self._Restraints()
+            p["pool_unitref"] = self.context.id
+            return self.context.root.search.SelectDict(parameter=p, fields=list(self.fields), operators=o,
+                                                        sort=sort, start=self.page[0], max=self.page[1])
+        if self.usePath and sort == self.context.GetSort():
+            if self._descendants is None:
+                self._descendants = self._SelectDescendants(sort)
+            records = []
+            for id in ids:
+                records.extend(self._descendants.get(id, ()))
+            return records
+        records = []
+        for pos in range(0, len(ids), MaxInList):
+            p, o = self._Restraints()
+            p["pool_unitref"] = ids[pos:pos+MaxInList]
+            o["pool_unitref"] = "IN"
+            records.extend(self.context.root.search.SelectDict(parameter=p, fields=list(self.fields),
+                                                                operators=o, sort=sort))
+        return records
+
+    def Count(self, ids):
+        """
+        Returns the number of children for each container in `ids` as dictionary.
+        """
+        counts = {}
+        for pos in range(0, len(ids), MaxInList):
+            p, o = self._Restraints()
+            p["pool_unitref"] = ids[pos:pos+MaxInList]
+            o["pool_unitref"] = "IN"
+            for ref, cnt in self.context.root.search.Select(parameter=p, fields=["pool_unitref", "-COUNT(*)"],
+                                                            operators=o, groupby="pool_unitref"):
+                counts[ref] = cnt
+        return counts
+
+    def _SelectDescendants(self, sort):
+        # all items below the context grouped by container
+        p, o = self._Restraints()
+        descendants = DescendantsRange(self.context)
+        if descendants:
+            p[PathField] = descendants
+            o[PathField] = "BETWEEN"
+        grouped = {}
+        for rec in self.context.root.search.SelectDict(parameter=p, fields=list(self.fields), operators=o, sort=sort):
+            grouped.setdefault(rec["pool_unitref"], []).append(rec)
+        return grouped
+
+    def _Restraints(self):
+        return self.context.root.ObjQueryRestraints(self.context, dict(self.parameter), dict(self.operators))
+
+
+def _LoadObjs(context, parents, records):
+    # loads data and creates objects for the records in chunks of MaxInList ids
+    app = context.app
+    byid = dict([(p.id, p) for p in parents])
+    objs = []
+    for pos in range(0, len(records), MaxInList):
+        chunk = records[pos:pos+MaxInList]
+        entries = app.db.GetBatch([r["id"] for r in chunk], preload="all", meta=chunk)
+        entries = dict([(e.id, e) for e in entries])
+        for row in chunk:
+            entry = entries.get(row["id"])
+            if entry is None:
+                continue
+            obj = _CreateObj(app, entry, row["pool_type"], byid[row["pool_unitref"]])
+            if obj is not None:
+                objs.append(obj)
+    return objs
+
+
+def _CreateObj(app, entry, typename, parent):
+    # see nive.container.ContainerFactory.ObjBatch
+    if not typename:
+        return None
+    configuration = app.configurationQuery.GetObjectConf(typename, skipRoot=1)
+    if not configuration:
+        return None
+    cls = ClassFactory(configuration, app.reloadExtensions, True, base=None)
+    return cls(entry.id, entry, parent=parent, configuration=configuration)
+
+
+def _LoadRows(context, records, projection):
+    # selects the data fields for each type and converts the values
+    root = context.root
+    de = context.app.db.structure._de
+    bytype = {}
+    for rec in records:
+        if projection.data.get(rec["pool_type"]):
+            bytype.setdefault(rec["pool_type"], []).append(rec["id"])
+    data = {}
+    for typename, typeids in bytype.items():
+        flds = ["id"] + projection.data[typename]
+        for pos in range(0, len(typeids), MaxInList):
+            for rec in root.search.SelectDict(pool_type=typename,
+                                              parameter={"id": typeids[pos:pos+MaxInList]},
+                                              operators={"id": "IN"},
+                                              fields=flds):
+                data[rec["id"]] = rec
+    rows = []
+    for rec in records:
+        typename = rec["pool_type"]
+        values = {}
+        datarec = data.get(rec["id"], {})
+        for fld, fieldconf, isdata in projection.columns.get(typename, ()):
+            if fieldconf is None:
+                values[fld] = None
+                continue
+            value = datarec.get(fld) if isdata else rec[fld]
+            values[fld] = de(value, fieldconf.datatype, fieldconf)
+        rows.append((rec["id"], typename, values, rec["pool_unitref"]))
+    return rows
+
+
+def StreamTree(tree, maxNodes=0, encoder=None, bufferSize=StreamBufferSize):
+    """
+    Serializes the subtree `tree` as json and yields the output in chunks. Nodes are
+    dictionaries and contained nodes are listed in `items`. `items` can be any iterable e.g.
+    a generator rendering the nodes on demand.
+
+    If `maxNodes` is set and the subtree contains more nodes the output ends after
+    `maxNodes` nodes. All open nodes are closed and the top level node gets the marker
+    `"truncated": true`.
+    """
+    encode = (encoder or JsonDataEncoder()).encode
+
+    def openNode(node):
+        # returns the json of the node without closing `items` and the contained nodes
+        parts = ["%s: %s" % (encode(k), encode(v)) for k, v in node.items() if k != "items"]
+        items = node.get("items")
+        if items is None:
+            return "{" + ", ".join(parts) + "}", None
+        parts.append('"items": [')
+        return "{" + ", ".join(parts), iter(items)
+
+    text, items = openNode(tree)
+    buffer = [text]
+    size = len(text)
+    count = 1
+    truncated = False
+    # open item lists: [iterator, first item]
+    stack = [[items, True]] if items is not None else []
+    while stack:
+        frame = stack[-1]
+        try:
+            node = next(frame[0])
+        except StopIteration:
+            stack.pop()
+            buffer.append("]}")
+            continue
+        if maxNodes and count >= maxNodes:
+            truncated = True
+            break
+        text, items = openNode(node)
+        count += 1
+        if not frame[1]:
+            text = ", " + text
+        frame[1] = False
+        buffer.append(text)
+        size += len(text)
+        if items is not None:
+            stack.append([items, True])
+        if size >= bufferSize:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if truncated:
+        buffer.append("]}" * (len(stack)-1))
+        buffer.append('], "truncated": true}')
+    yield "".join(buffer)
+
+
+class SubtreeProjection(object):
+    """
+    Type lookup tables for object free subtree rendering. `fields` maps type ids to the
+    rendered field ids, `descent` is a list of type ids and interfaces to descend into.
+
+    - *containers*: type ids of container types
+    - *descend*: type ids to descend into
+    - *columns*: rendered fields of each type as list of `(field id, field configuration, is data field)`
+    - *data*: data field ids to select for each type
+    - *sort*: default sort for each container type
+    - *objectsRequired*: True if one of the rendered fields can only be read from objects
+    """
+
+    def __init__(self, app, fields, descent):
+        self.containers = set()
+        self.descend = set()
+        self.columns = {}
+        self.data = {}
+        self.sort = {}
+        self.objectsRequired = False
+        query = app.configurationQuery
+        for conf in query.GetAllObjectConfs():
+            cls = ClassFactory(conf, app.reloadExtensions, True, base=None)
+            if IContainer.implementedBy(cls):
+                self.containers.add(conf.id)
+                self.sort[conf.id] = cls.defaultSort
+            for t in descent:
+                if (isinstance(t, str) and t == conf.id) or (not isinstance(t, str) and t.implementedBy(cls)):
+                    self.descend.add(conf.id)
+                    break
+            # same lookup order as GetFld(): data fields first
+            datafields = dict([(f.id, f) for f in conf.data])
+            columns = []
+            for fld in fields.get(conf.id, ()):
+                if fld in datafields:
+                    if datafields[fld].datatype == "file":
+                        # files are loaded by the object
+                        self.objectsRequired = True
+                    columns.append((fld, datafields[fld], True))
+                else:
+                    columns.append((fld, query.GetMetaFld(fld), False))
+            self.columns[conf.id] = columns
+            self.data[conf.id] = [c[0] for c in columns if c[2]]
+
+    def MetaFields(self):
+        """
+        Returns the meta field ids selected for all types.
+        """
+        flds = list(TreeFields)
+        for columns in self.columns.values():
+            for fld, fieldconf, isdata in columns:
+                if not isdata and fieldconf and fld not in flds:
+                    flds.append(fld)
+        return flds
+
+
+class SubtreePlan(object):
+    """
+    A subtree profile compiled into lookup tables. Instances are not changed after creation
+    and are shared between requests. Do not modify the returned dictionaries.
+
+    - *fields*: rendered field ids for each type id
+    - *parameter*, *operators*: query restraints for all levels
+    - *descend*: type ids to descend into
+    - *projection*: the `SubtreeProjection` for the fields and descent types
+    - *key*: cache key part of the profile settings
+    """
+
+    def __init__(self, profile, app):
+        self.source = profile
+        get = profile.get
+
+        # rendered fields per type: profile values or the types toJson default
+        toJson = get("toJson")
+        fields = {}
+        for conf in app.configurationQuery.GetAllObjectConfs():
+            if isinstance(toJson, dict) and conf.id in toJson:
+                fields[conf.id] = tuple(toJson[conf.id])
+            elif conf.get("toJson"):
+                fields[conf.id] = tuple(conf.get("toJson"))
+        self.fields = fields
+
+        parameter = dict(get("parameter") or {})
+        if not "pool_type" in parameter:
+            parameter["pool_type"] = list(fields.keys())
+        if isinstance(parameter["pool_type"], (list, tuple)):
+            operators = {"pool_type": "IN"}
+        else:
+            operators = {}
+        operators.update(get("operators") or {})
+        self.parameter = parameter
+        self.operators = operators
+
+        # types to descent in tree structure
+        descent = []
+        for t in get("descent") or ():
+            try:
+                resolved = ResolveName(t)
+            except ImportError:
+                # plain type id
+                resolved = None
+            if resolved:
+                descent.append(resolved)
+            elif t in parameter["pool_type"]:
+                descent.append(t)
+        self.projection = SubtreeProjection(app, fields, descent)
+        self.descend = frozenset(self.projection.descend)
+
+        levels = get("levels")
+        self.levels = DefaultLevels if levels is None else levels
+        self.lazy = get("lazy") or 0
+        self.pageSize = get("pageSize") or DefaultPageSize
+        self.secure = get("secure", True)
+        self.addContext = bool(get("addContext"))
+        self.stream = bool(get("stream"))
+        self.maxNodes = get("maxNodes") or 0
+        self.cache = get("cache", True) and not self.addContext
+        self.key = MakeCacheKey(dict([(k, get(k)) for k in profile.keys()]))
+
+
+def GetSubtreePlan(app, profile):
+    """
+    Returns the compiled `SubtreePlan` for the profile settings. Plans are cached by profile
+    identity.
+    """
+    cache = _PlanCache(app)
+    plan = cache.get(id(profile))
+    if plan is not None and plan.source is profile:
+        return plan
+    plan = SubtreePlan(profile, app)
+    if len(cache) >= MaxPlans:
+        cache.clear()
+    cache[id(profile)] = plan
+    return plan
+
+
+def CompileSubtreePlans(app):
+    """
+    Compiles all subtree profiles defined in `AppConf.subtree` and in customized `subtree`
+    view settings. Called on application startup.
+    """
+    profiles = []
+    if app.configuration.get("subtree"):
+        profiles.extend(app.configuration.subtree.values())
+    for viewmod in app.registry.getAllUtilitiesRegisteredFor(IViewModuleConf):
+        for view in viewmod.views or ():
+            if view.get("attr") == "subtree" and view.get("settings"):
+                profiles.append(view.settings)
+    for profile in profiles:
+        GetSubtreePlan(app, profile)
+    return len(profiles)
+
+
+def _PlanCache(app):
+    try:
+        return app._c_subtreeplans
+    except AttributeError:
+        app._c_subtreeplans = {}
+        return app._c_subtreeplans
@@ -1,22 +1,37 @@
 # Copyright 2012-2020 Arndt Droullier, Nive GmbH. All rights reserved.
 # Released under GPL3. See license.txt
 
+import copy
+import json
+import time
 import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from pyramid.httpexceptions import HTTPForbidden
+from pyramid.httpexceptions import HTTPForbidden, HTTPNotFound
+from pyramid.response import Response
 from pyramid import renderers
 
 from nive.definitions import ViewModuleConf, ViewConf, Conf, ModuleConf
 from nive.definitions import IObject, IContainer
 from nive.definitions import ConfigurationError
 
-from nive.workflow import WorkflowNotAllowed
+from nive.workflow import WorkflowNotAllowed, WfEntryActions
 from nive.views import BaseView
 from nive.components.reform.forms import MakeCustomizedViewForm
 from nive.security import Allow, Everyone, Authenticated, ALL_PERMISSIONS
-from nive.helper import ResolveName
 
 from nive_datastore.i18n import _
+from nive_datastore.webapi.profiles import GetSearchProfile, DeepContainer
+from nive_datastore.webapi.tree import LoadSubtree, LoadSubtreeRows, StreamTree, GetSubtreePlan
+from nive_datastore.webapi.tree import CountChildren, MakeCursor, ParseCursor
+from nive_datastore.webapi.permissions import GetPermissionEvaluator
+from nive_datastore.webapi.workflow import WorkflowStates, SerializeState
+from nive_datastore.webapi.templates import ListingTemplate, ListRenderer
+from nive_datastore.webapi.assets import FormHead, LookupBundle, BundleSeparator, BundleMaxAge
+from nive_datastore.cache import MakeCacheKey, QueryTags, SubtreeTag, FormTag
+from nive_datastore.querylog import TraceQueries
+from nive_datastore.hierarchy import DescendantsRange, PathEnabled, PathField
 import collections
 
 # view module definition ------------------------------------------------------------------
@@ -40,11 +55,21 @@ configuration = ViewModuleConf(
         # list and search
         ViewConf(name="list",       attr="listItems",  permission="api-list",        renderer="json",   context=_ic),
         ViewConf(name="search",     attr="search",     permission="api-search",      renderer="json",   context=_ic),
+        ViewConf(name="facets",     attr="facets",     permission="api-search",      renderer="json",   context=_ic),
+        ViewConf(name="multiSearch",attr="multiSearch",permission="api-search",      renderer="json",   context=_ic),
+        # workflow
+        ViewConf(name="states",     attr="states",     permission="api-list",        renderer="json",   context=_ic),
+        ViewConf(name="actionBatch",attr="actionBatch",permission="api-action",      renderer="json",   context=_ic),
         # rendering
         ViewConf(name="subtree",    attr="subtree",    permission="api-subtree",     renderer="string", context=_ic),
         ViewConf(name="render",     attr="renderTmpl", permission="api-render",                         context=_ic ),
         # forms
         ViewConf(name="newItemForm",attr="newItemForm",permission="api-newItemForm", renderer="string", context=_ic),
+        ViewConf(name="validateField",attr="validateField",permission="api-newItemForm", renderer="json", context=_ic),
+        # administration. no acl entry: only available for admins
+        ViewConf(name="slowQueries",attr="slowQueries",permission="api-slowQueries", renderer="json",   context="nive_datastore.root.root"),
+        # form asset bundles
+        ViewConf(name="assetBundle",attr="assetBundle",permission="api-assets",                         context="nive_datastore.root.root"),
 
         # object views ---------------------------------------------------------------------------
         # read
@@ -58,6 +83,7 @@ configuration = ViewModuleConf(
         ViewConf(name="render",     attr="renderTmpl", permission="api-render",                         context=_io),
         # forms
         ViewConf(name="setItemForm",attr="setItemForm",permission="api-setItemForm", renderer="string", context=_io),
+        ViewConf(name="validateField",attr="validateField",permission="api-setItemForm", renderer="json", context=_io),
         # workflow
         ViewConf(name="action",     attr="action",     permission="api-action",      renderer="json",   context=_io),
         ViewConf(name="state",      attr="state",      permission="api-state",       renderer="json",   context=_io),
@@ -68,6 +94,7 @@ configuration = ViewModuleConf(
         (Allow, Everyone,       "api-render"),
         (Allow, Everyone,       "api-list"),
         (Allow, Everyone,       "api-search"),
+        (Allow, Everyone,       "api-assets"),
 
         (Allow, Authenticated,  "api-newItem"),
         (Allow, Authenticated,  "api-newItemForm"),
@@ -108,6 +135,13 @@ localstorage_views = ViewModuleConf(
 
 DefaultMaxStoreItems = 50
 DefaultMaxBatchItems = 100
+DefaultMaxActionItems = 5000
+DefaultMaxSearchQueries = 10
+DefaultSearchWorkers = 4
+# request parameters allowed for cached initial forms
+FormCacheParams = frozenset(("type", "pool_type", "subset"))
+# markup containing csrf tokens is not cached
+FormTokenMarker = "csrf"
 jsUndefined = ("", "null", "undefined", None)
 
 
@@ -115,6 +149,7 @@ class APIv1(BaseView):
 
     # json datastore api
 
+    @TraceQueries("getItem")
     def getItem(self):
         """
         Returns one or multiple items. This function either returns the current item if called without
@@ -224,15 +259,8 @@ class APIv1(BaseView):
             self.request.response.status = "400 Empty id"
             return {"error": "Empty id"}
 
-        items = []
-        cnt = 0
-        for obj in self.context.GetObjsBatch(id):
-            if not self.Allowed(obj, "api-getItem"):
-                # fails silently in list mode
-                continue
-            items.append(obj)
-            if len(items) == maxBatchItems:
-                break
+        # fails silently in list mode
+        items = self.PermissionEvaluator().FilterAllowed(self.context.GetObjsBatch(id[:maxBatchItems]), "api-getItem")
 
         # turn into json
         items = DeserializeItems(self, items, fields, render)
@@ -568,6 +596,7 @@ class APIv1(BaseView):
         return {"result": validated, "error": errors}
 
     
+    @TraceQueries("deleteItem")
     def deleteItem(self):
         """
         Delete one or more items.
@@ -586,6 +615,8 @@ class APIv1(BaseView):
 
         - *id*: (number,list) the items' id or a list of ids if `strict` is set to `False`
         - *confirmation*: the confirmation token if enabled.
+        - *descendants*: (bool) if set ids can reference items contained in sub containers at any depth, not only
+                         direct children of the context. Requires the `pool_path` meta field.
 
         Returns json encoded result: {"result": list of deleted item ids}
 
@@ -596,6 +627,7 @@ class APIv1(BaseView):
         - *confirmation*: (string) a confirmation token required to be passed in the request.
         - *maxDeleteItems*: (number) the maximum number of items deleted in one call. Recursively deleted
                             items are not counted.
+        - *descendants*: (bool) set to False to disable the `descendants` request parameter.
 
         You can also turn on strict the mode. If turned on `setItem` can only be called for the
         object to be updated itself, not for the container.
@@ -620,6 +652,7 @@ class APIv1(BaseView):
         strict = False
         recursive = True
         confirmation = None
+        descendants = True
         root = self.context.root
 
         # look up the new type in custom view definition
@@ -629,6 +662,7 @@ class APIv1(BaseView):
             recursive = viewconf.settings.get("recursive")
             confirmation = viewconf.settings.get("confirmation")
             maxStoreItems = viewconf.settings.get("maxDeleteItems") or maxStoreItems
+            descendants = viewconf.settings.get("descendants", True)
 
         if confirmation and self.GetFormValue("confirmation")!=confirmation:
             return {"result": [], "error": "Please confirm."}
@@ -669,11 +703,21 @@ class APIv1(BaseView):
             response.status = "413 Too many items"
             return {"error": "Too many items.", "result": []}
 
+        if descendants and self.GetFormValue("descendants") in (True, "1", "true"):
+            objs = self._LoadDescendants(ids)
+        else:
+            objs = self.context.GetObjsBatch(ids)
+
         deleted = []
         error = ""
         user = self.User()
-        for obj in self.context.GetObjsBatch(ids):
-            if not self.Allowed("api-delete", obj):
+        permissions = self.PermissionEvaluator()
+        for obj in objs:
+            if deleted and set(obj.GetParentIDs()) & set(deleted):
+                # already removed with its container
+                deleted.append(obj.id)
+                continue
+            if not permissions.Allowed(obj, "api-delete"):
                 error = "Not allowed"
                 continue
             if not recursive:
@@ -683,16 +727,41 @@ class APIv1(BaseView):
                     error = "Not empty"
                     continue
             id = obj.id
-            result = self.context.Delete(obj, user=user)
+            result = obj.parent.Delete(obj, user=user)
             del obj
             if result:
                 deleted.append(id)
 
         return {"result": deleted, "error": error}
+
+
+    def _LoadDescendants(self, ids):
+        # loads the items contained in the context at any depth. one range query on the
+        # items path checks the ids, the objects are loaded including their parents.
+        if not PathEnabled(self.context.app):
+            raise ConfigurationError("descendants requires the meta field %s" % (PathField))
+        root = self.context.root
+        try:
+            ids = [int(id) for id in ids]
+        except ValueError:
+            return []
+        parameter = {"id": ids}
+        operators = {"id": "IN"}
+        descendants = DescendantsRange(self.context)
+        if descendants:
+            parameter[PathField] = descendants
+            operators[PathField] = "BETWEEN"
+        objs = []
+        for rec in root.search.SelectDict(parameter=parameter, operators=operators, fields=["id"], sort="id"):
+            obj = root.LookupObj(rec["id"])
+            if obj is not None:
+                objs.append(obj)
+        return objs
             
 
     # list and search ----------------------------------------------------------------------------------
 
+    @TraceQueries("listItems")
     def listItems(self):
         """
         Returns a list of batched items for a single or all types stored in the current container.
@@ -721,6 +790,7 @@ class APIv1(BaseView):
         - *deserialize*: (callback) pluginpoint for a custom deserialization callback. The callback is invoked once for
                          the whole result.
                          Takes two parameters `items, view` and should return the processed items.
+        - *cache*: (bool) set to False to exclude the view from result caching. See `nive_datastore.cache`.
 
         Customized `listItems` view ::
 
@@ -743,7 +813,9 @@ class APIv1(BaseView):
         viewconf = self.GetViewConf()
         sort = None
         order = None
+        usecache = True
         if viewconf and viewconf.get("settings"):
+            usecache = viewconf.settings.get("cache", True)
             fields = viewconf.settings.get("fields") or fields
             typename = viewconf.settings.get("type")
             deserialize = viewconf.settings.get("deserialize")
@@ -785,6 +857,13 @@ class APIv1(BaseView):
                     sort = None
 
         parameter = {"pool_unitref": self.context.id}
+        cache = self.context.app.searchCache if usecache else None
+        if cache is not None:
+            key = MakeCacheKey("list", self.context.id, typename, fields, start, size, ascending, sort)
+            cached = cache.Get(key)
+            if cached is not None:
+                return self._CachedResult(cached, deserialize)
+
         data = self.context.root.search.Select(typename,
                                               parameter=parameter,
                                               fields=fields,
@@ -792,18 +871,31 @@ class APIv1(BaseView):
                                               max=size,
                                               ascending=ascending,
                                               sort=sort)
+        values = {"items": data, "start": start}
+        if cache is not None:
+            cache.Set(key, values, tags=QueryTags(typename))
+            values = CopyResult(values)
+        if isinstance(deserialize, collections.abc.Callable):
+            values["items"] = deserialize(values["items"], self)
+        return values
+
+
+    def _CachedResult(self, cached, deserialize):
+        values = CopyResult(cached)
         if isinstance(deserialize, collections.abc.Callable):
-            data = deserialize(data, self)
-        return {"items": data, "start": start}
+            values["items"] = deserialize(values["items"], self)
+        return values
 
 
+    @TraceQueries("search", profile=True)
     def search(self):
         """
         Advanced search functions with many optionsand support for preconfigured search
         profiles. The functions returns a set of batched items encoded as json.
 
         Search profiles can be preconfigured and stored in the datastore application configuration or
-        for each customized view.
+        for each customized view. Profiles are compiled on application startup and the sql statements
+        reused for all calls. See `nive_datastore.webapi.profiles`.
 
         **Request parameter**
 
@@ -817,7 +909,7 @@ class APIv1(BaseView):
         - *items*: list of items
         - *start*: if batched the current start number
         - *size*: maximum batch size
-        - *total*: number of items in total
+        - *total*: number of items in total. Depends on the profiles `total` option.
         - *fields*: (list) a list of data fields used in search
 
         The return value is based on the linked renderer. By default the result is returned as json
@@ -827,7 +919,7 @@ class APIv1(BaseView):
 
         **Settings:**
 
-        - *sort*: (string) is a field name and used to sort the result.
+        - *sort*: (string) is a field name and used to sort the result. `relevance` for profiles using `MATCH`.
         - *order*: (string) either '<','>' or empty. Orders the result list based on values ascending '<' or descending '>'
         - *size*: (number) number of batched items.
         - *start*: (number) start number of batched result sets.
@@ -835,6 +927,8 @@ class APIv1(BaseView):
                   The data fields to be included in the result have to be assigned respectively. In other words
                   if `type` is given the types data fields can be included in the result, otherwise not.
         - *container*: (bool) determines whether to search in the current container or search all items in the tree.
+                       `deep` searches all items below the current container at any depth. Requires the `pool_path`
+                       meta field. See `nive_datastore.hierarchy`.
         - *fields*: (list) a list of data fields to be included in the result set. See `nive.search`.
         - *parameter*: (dict/callback) is a dictionary or callable of fixed query parameters used in the select statement. These values cannot
                        be changed through request form values. The callback takes two parameters `context` and `request` and should return
@@ -863,6 +957,7 @@ class APIv1(BaseView):
                      if not found in the request. The `dynamic` values are mixed with the fixed parameters and passed
                      to the query. If you need custom value processing use a callback with the `parameter` option.
         - *operators*: (dict) fieldname:operator entries used for search conditions. See `nive.search`.
+                       `MATCH` searches the types full-text index. See `nive_datastore.fulltext`.
         - *ignoreEmpty*: (bool) automatically removes empty dynamic values and so these are not included in select statements.
         - *advanced*: (dict) search options like group restraints. See `nive.search` for details and all supported options.
         - *groups*: (string/list) use the groups defintion to restrict the execution to users assigned to one of the groups.
@@ -870,6 +965,10 @@ class APIv1(BaseView):
         - *deserialize*: (callback) pluginpoint for a custom deserialization callback. The callback is invoked once for
                          the whole result.
                          Takes two parameters `items, view` and should return the processed items.
+        - *total*: (string) how the total number of items is calculated. `exact` (default) counts all matching
+                   items, `none` skips the count and returns null, `estimate` uses the database table statistics and
+                   `capped:N` counts up to N items and returns "N+" if there are more.
+        - *cache*: (bool) set to False to exclude the profile from result caching. See `nive_datastore.cache`.
 
         Here is a simple example how to search for all bookmarks ::
 
@@ -931,65 +1030,150 @@ class APIv1(BaseView):
             )
 
         """
-        response = self.request.response
-        profile = deserialize = None
-        maxBatchItems = self.context.app.configuration.get("maxBatchItems") or DefaultMaxBatchItems
+        profile, settings, error = self._LookupSearchProfile()
+        if error:
+            return {"error": error, "items":[]}
+        deserialize = settings.get("deserialize")
 
-        viewconf = self.GetViewConf()
-        # look up the profile in two places
-        if viewconf and viewconf.get("settings"):
-            maxBatchItems = viewconf.settings.get("maxBatchItems") or maxBatchItems
-            deserialize = viewconf.settings.get("deserialize")
-            # 1) in custom view definition
-            profile = viewconf.settings
+        query, error = self._SearchQuery(profile, settings)
+        if error:
+            # set http response code (invalid request)
+            self.request.response.status = "400 Invalid parameter"
+            return {"error": error, "items":[]}
 
-        else:
-            # 2) in app.configuration.search
-            profiles = self.context.app.configuration.get("search")
-            if not profiles:
-                response.status = "400 No search profiles found"
-                return {"error": "No search profiles found", "items":[]}
+        values = self._RunSearch(profile, query)
+        if isinstance(deserialize, collections.abc.Callable):
+            values["items"] = deserialize(values["items"], self)
+        return values
 
-            profilename = self.GetFormValue("profile", "default")
-            if not profilename:
-                response.status = "400 Empty search profile name"
-                return {"error": "Empty search profile name", "items":[]}
-            profile = profiles.get(profilename)
+
+    def multiSearch(self):
+        """
+        Runs multiple search profiles in one call. The queries are executed concurrently in a thread
+        pool, each thread uses its own database connection. Returns all results in one response.
+
+        **Request parameter**
+
+        - *queries*: (list or json string) list of queries. Each query is a dictionary with the search profile name
+                     as `profile` and the profiles dynamic values as `parameter`. ::
+
+                         [{"profile": "bookmarks", "parameter": {"size": 5}},
+                          {"profile": "tracks"}]
+
+        **Return values**
+
+        - *results*: list of search results in the same order as the queries. Each result has the same
+                     values as `search` results plus the profile name as `profile` and the execution time
+                     in milliseconds as `time`. Failed queries return `error` instead.
+        - *time*: total execution time in milliseconds
+
+        By default the result is returned as json encoded result set: ::
+
+            {"results": [{"profile": "bookmarks", "items": [], "start": 1, "size": 0, "total": 0, "time": 2.5}],
+             "time": 3.1}
+
+        **Settings**
+
+        - *maxQueries*: (number) maximum number of queries in one call. Default 10.
+        - *workers*: (number) number of threads used to execute queries. Default 4.
+
+        Profiles are looked up in `app.configuration.search`. The profiles `groups` restrictions apply to
+        each query. Results are cached like `search` results.
+        """
+        t = time.time()
+        viewconf = self.GetViewConf()
+        settings = viewconf.settings if viewconf and viewconf.get("settings") else {}
+        maxQueries = settings.get("maxQueries") or DefaultMaxSearchQueries
+
+        queries = self.GetFormValue("queries")
+        if isinstance(queries, str):
+            try:
+                queries = json.loads(queries)
+            except ValueError:
+                queries = None
+        if not isinstance(queries, (list, tuple)) or not queries:
+            self.request.response.status = "400 No queries"
+            return {"error": "No queries", "results": []}
+        if len(queries) > maxQueries:
+            self.request.response.status = "400 Too many queries"
+            return {"error": "Too many queries", "results": []}
+
+        # profiles, permissions and parameters are resolved in the current thread
+        profiles = self.context.app.configuration.get("search") or {}
+        results = []
+        tasks = []
+        for query in queries:
+            if not isinstance(query, dict):
+                results.append({"error": "Invalid query"})
+                continue
+            name = query.get("profile") or "default"
+            profile = profiles.get(name)
             if not profile:
-                response.status = "400 Unknown profile"
-                return {"error": "Unknown profile", "items":[]}
+                results.append({"profile": name, "error": "Unknown profile"})
+                continue
+            profile = GetSearchProfile(self.context.app, profile)
+            if profile.groups:
+                user = self.User()
+                if not user or not user.InGroups(profile.groups):
+                    results.append({"profile": name, "error": "Profile not allowed"})
+                    continue
+            parameter = query.get("parameter")
+            q, error = self._SearchQuery(profile, settings, web=parameter if isinstance(parameter, dict) else {})
+            if error:
+                results.append({"profile": name, "error": error})
+                continue
+            result = {"profile": name}
+            results.append(result)
+            tasks.append((result, profile, q))
 
-        if profile.get("groups"):
-            grps = profile.get("groups")
-            user = self.User()
-            #TODO check local groups
-            if not user or not user.InGroups(grps):
-                raise HTTPForbidden("Profile not allowed")
+        def run(task):
+            result, profile, query = task
+            t = time.time()
+            try:
+                result.update(self._RunSearch(profile, query))
+            except Exception as e:
+                self.context.app.log.error("multiSearch profile %s failed: %s", result["profile"], str(e))
+                result["error"] = "Query failed"
+            result["time"] = round((time.time()-t)*1000, 2)
+
+        def runWorker(task):
+            try:
+                run(task)
+            finally:
+                # worker threads keep their connection. end the read transaction so the next
+                # task does not read from an old snapshot or leave the connection idle in
+                # transaction.
+                try:
+                    self.context.app.db.Undo()
+                except Exception as e:
+                    self.context.app.log.error("multiSearch rollback failed: %s", str(e))
+
+        if len(tasks) == 1:
+            run(tasks[0])
+        elif tasks:
+            workers = settings.get("workers") or DefaultSearchWorkers
+            list(SearchExecutor(self.context.app, workers).map(runWorker, tasks))
+        return {"results": results, "time": round((time.time()-t)*1000, 2)}
+
+
+    def _SearchQuery(self, profile, settings, web=None):
+        # Extracts the query values for a search profile from the request or `web`.
+        # Returns the query (values, start, size, sort, ascending) and an error message.
+        maxBatchItems = settings.get("maxBatchItems") or \
+                        self.context.app.configuration.get("maxBatchItems") or DefaultMaxBatchItems
 
         # get dynamic values
-        values = {}
-        web = self.GetFormValues()
-        dynamic = profile.get("dynamic", {})
-        if dynamic:
-            ie = profile.get("ignoreEmpty")
-            # values treated as empty
-            null = ("", None)
-            for dynfield, dynvalue in list(dynamic.items()):
-                value = web.get(dynfield, dynvalue)
-                if value in null:
-                    continue
-                values[dynfield] = value
+        values = self._DynamicValues(profile, web)
+        dynamic = profile.dynamic
 
         if "start" in dynamic:
             try:
                 start = ExtractJSValue(values, "start", 0, "int")
             except ValueError:
-                # set http response code (invalid request)
-                response.status = "400 Invalid parameter"
-                return {"error": "Invalid parameter: start", "items":[]}
-            del values["start"]
+                return None, "Invalid parameter: start"
+            values.pop("start", None)
         else:
-            start = profile.get("start",0)
+            start = profile.start
 
         if "size" in dynamic:
             try:
@@ -997,18 +1181,15 @@ class APIv1(BaseView):
                 if size > maxBatchItems:
                     size = maxBatchItems
             except ValueError:
-                # set http response code (invalid request)
-                response.status = "400 Invalid parameter"
-                return {"error": "Invalid parameter: size", "items":[]}
-            del values["size"]
+                return None, "Invalid parameter: size"
+            values.pop("size", None)
         else:
-            size = profile.get("size", maxBatchItems)
+            size = maxBatchItems if profile.size is None else profile.size
 
         if "order" in dynamic:
-            order = values.get("order",None)
-            del values["order"]
+            order = values.pop("order", None)
         else:
-            order = profile.get("order")
+            order = profile.order
         if order == "<":
             ascending = 1
         elif order == ">":
@@ -1016,68 +1197,184 @@ class APIv1(BaseView):
         else:
             ascending = None
 
-        # fixed values
-        typename = profile.get("type") or profile.get("pool_type")
-
         if "sort" in dynamic:
-            sort = values.get("sort",None)
-            if not sort in [v["id"] for v in self.context.app.configurationQuery.GetAllMetaFlds(False)]:
-                if typename:
-                    if not sort in [v["id"] for v in self.context.app.configurationQuery.GetAllObjectFlds(typename)]:
-                        sort = None
-            del values["sort"]
+            sort = values.pop("sort", None)
+            if not sort in profile.sortFields:
+                sort = None
         else:
-            sort = profile.get("sort")
+            sort = profile.sort
 
         # get the configured parameters. if it is a callable call it with current
         # request and context.
-        p = profile.get("parameter", None)
-        if isinstance(p, collections.abc.Callable):
-            if "view" in inspect.getfullargspec(p).args:
-                p = p(*(self.context, self.request, self))
-            else:
-                p = p(*(self.context, self.request))
-        if p:
-            values.update(p)
-
-        if profile.get("container"):
-            values["pool_unitref"] = self.context.id
-        parameter = values
-        operators = profile.get("operators")
-        fields = profile.get("fields")
-
-        # prepare keywords
-        kws = {}
-        if profile.get("advanced"):
-            kws.update(profile["advanced"])
+        self._FixedValues(profile, values)
 
+        # Search Functions use 0 based index, search 1 based index
         if start is not None and start!=0:
-            # Search Functions use 0 based index, search 1 based index
-            kws["start"] = start-1
-        if size is not None:
-            kws["max"] = size
-        if ascending is not None:
-            kws["ascending"] = ascending
-        if sort is not None:
-            kws["sort"] = sort
-
-        # run the query and handle the result
-        if typename:
-            result = self.context.root.search.SearchType(typename, parameter=parameter, fields=fields, operators=operators, **kws)
+            start = start-1
         else:
-            result = self.context.root.search.Search(parameter=parameter, fields=fields, operators=operators, **kws)
+            start = 0
+        return (values, start, size, sort, ascending), None
+
+
+    def _RunSearch(self, profile, query):
+        # runs the query or looks up cached results. does not access the request and can be
+        # called in worker threads.
+        values, start, size, sort, ascending = query
+        cache = self.context.app.searchCache if profile.cache else None
+        if cache is not None:
+            key = MakeCacheKey("search", profile.key, values, start, size, sort, ascending)
+            cached = cache.Get(key)
+            if cached is not None:
+                return CopyResult(cached)
+
+        result = profile.Search(self.context.root.search, values, start=start, max=size, sort=sort, ascending=ascending)
         values = {"items": result["items"],
                   "start": result["start"]+1,
                   "size": result["count"],
                   "total": result["total"],
-                  "fields": fields}
-        if isinstance(deserialize, collections.abc.Callable):
-            values["items"] = deserialize(result["items"], self)
+                  "fields": profile.fields}
+        if cache is not None:
+            cache.Set(key, values, tags=profile.Tags(result["criteria"]))
+            values = CopyResult(values)
+        return values
+
+
+    def facets(self):
+        """
+        Returns the number of items per value for the fields listed in the search profiles `facets` option.
+        The counts are calculated for the same set of items a `search` call with the same profile and request
+        parameter would return. All facets are returned in one response.
+
+        **Request parameter**
+
+        - *profile*: (string) the search profile name if not set in the configuration.
+        - all `dynamic` values of the search profile
+
+        **Return values**
+
+        - *facets*: dictionary with one list of `{"value": value, "count": number}` entries for each facet field.
+                    The lists are ordered by count starting with the highest.
+
+        By default the result is returned as json encoded result set: ::
+
+            {"facets": {"pool_state": [{"value": 1, "count": 12}, {"value": 0, "count": 3}]}}
+
+        **Settings**
+
+        Uses the search profiles. See `search` for all options.
+
+        - *facets*: (list) field ids to count values for. Meta fields or the types data fields. For multiple selection
+                    fields each selected value is counted.
+
+        ::
+
+            settings = {
+                "type": "bookmark",
+                "dynamic": {"text": ""},
+                "operators": {"text": "LIKE"},
+                "facets": ["pool_state", "share"]
+            }
+
+        Like `search` results facets are cached if the result cache is enabled.
+        """
+        profile, settings, error = self._LookupSearchProfile()
+        if error:
+            return {"error": error, "facets": {}}
+        if not profile.facets:
+            self.request.response.status = "400 No facets configured"
+            return {"error": "No facets configured", "facets": {}}
+
+        values = self._DynamicValues(profile)
+        for key in ("start", "size", "order", "sort"):
+            values.pop(key, None)
+        self._FixedValues(profile, values)
+
+        # lookup cached results
+        cache = self.context.app.searchCache if profile.cache else None
+        if cache is not None:
+            key = MakeCacheKey("facets", profile.key, values)
+            cached = cache.Get(key)
+            if cached is not None:
+                # facet results are nested lists of dicts
+                return copy.deepcopy(cached)
+
+        facets = profile.Facets(self.context.root.search, values)
+        result = {"facets": facets}
+        if cache is not None:
+            cache.Set(key, result, tags=profile.Tags(values))
+            result = copy.deepcopy(result)
+        return result
+
+
+    def _LookupSearchProfile(self):
+        # Looks up the search profile either in the views settings or by name in `app.configuration.search`.
+        # Returns the compiled profile, the view settings and an error message.
+        settings = {}
+        viewconf = self.GetViewConf()
+        # look up the profile in two places
+        if viewconf and viewconf.get("settings"):
+            # 1) in custom view definition
+            settings = viewconf.settings
+            profile = settings
+
+        else:
+            # 2) in app.configuration.search
+            response = self.request.response
+            profiles = self.context.app.configuration.get("search")
+            if not profiles:
+                response.status = "400 No search profiles found"
+                return None, settings, "No search profiles found"
+
+            profilename = self.GetFormValue("profile", "default")
+            if not profilename:
+                response.status = "400 Empty search profile name"
+                return None, settings, "Empty search profile name"
+            profile = profiles.get(profilename)
+            if not profile:
+                response.status = "400 Unknown profile"
+                return None, settings, "Unknown profile"
+
+        profile = GetSearchProfile(self.context.app, profile)
+        if profile.groups:
+            user = self.User()
+            #TODO check local groups
+            if not user or not user.InGroups(profile.groups):
+                raise HTTPForbidden("Profile not allowed")
+        return profile, settings, None
+
+
+    def _DynamicValues(self, profile, web=None):
+        # extracts the profiles dynamic values from the request
+        values = {}
+        if web is None:
+            web = self.GetFormValues()
+        dynamic = profile.dynamic
+        if dynamic:
+            # values treated as empty
+            null = ("", None)
+            for dynfield, dynvalue in list(dynamic.items()):
+                value = web.get(dynfield, dynvalue)
+                if value in null:
+                    continue
+                values[dynfield] = value
+        return values
+
+
+    def _FixedValues(self, profile, values):
+        # adds the profiles fixed parameter and container restraint
+        values.update(profile.Parameter(self))
+        if profile.container == DeepContainer:
+            descendants = DescendantsRange(self.context)
+            if descendants:
+                values[PathField] = descendants
+        elif profile.container:
+            values["pool_unitref"] = self.context.id
         return values
 
 
     # tree renderer ----------------------------------------------------------------------------------
 
+    @TraceQueries("subtree", profile=True)
     def subtree(self):
         """
         Returns complex results like parts of a subtree including multiple levels. Contained items
@@ -1085,9 +1382,16 @@ class APIv1(BaseView):
         `render` option to determine the result values rendered in a json document. If `render` is None the item will
         not be rendered at all.
 
+        The subtree is loaded level by level. The items of one level are selected with a single
+        query regardless of the number of containers (see `nive_datastore.webapi.tree`). Profiles are
+        compiled once and must not be changed afterwards.
+
         **Request parameter**
 
         - *profile*: (string) the subtree profile name if not set in the configuration.
+        - *cursor*: (string) cursor token of a lazy loaded container. Returns the container with the next page of
+                    children. Only valid for profiles with `lazy` set. The number of levels is limited to the
+                    profiles `levels`.
 
         **Return values**
 
@@ -1096,14 +1400,33 @@ class APIv1(BaseView):
 
             {"items": {"items": {<values>}, <values>}, <values>}
 
+        If `lazy` is set containers below the eagerly loaded levels are returned with the number of children and a
+        cursor token instead of `items`. Pass the token as `cursor` to load the children page by page: ::
+
+            {"count": 120, "cursor": "12-0-3", <values>}
+            subtree?cursor=12-0-3 -> {"items": [...], "count": 120, "cursor": "12-50-3", <values>}
+
+        The last page has no `cursor`.
+
         **Settings**
 
         - *levels*: (number) the number of levels to include, 0=include all (default)
-        - *secure*: (bool) if true the `api-subtree` permission is checked for each item
+        - *secure*: (bool) if true the `api-subtree` permission is checked for each item. If false and `addContext`
+                    is not set the result is rendered from the selected columns without loading item objects.
         - *descent*: (item type, interface) item types or interfaces to descent into subtree e.g. `(IContainer,)`
         - *toJson*: (dict or tuple) result values. If empty uses the types `toJson` defaults
         - *parameter*: (dict) query parameter for result selection e.g. `{"pool_state": 1}`
         - *addContext*: (bool) adds the item object as `context` to the result
+        - *cache*: (bool) set to False to exclude the profile from result caching. Cached subtrees are invalidated
+                   if the context or any contained item is changed. Results including `addContext` are not cached.
+                   See `nive_datastore.cache`.
+        - *stream*: (bool) writes the json result node by node to the response instead of returning the nested
+                    result. The renderer, the result cache and `addContext` are not used. For large exports.
+        - *lazy*: (number) the number of levels loaded eagerly. Containers below are returned with `count` and
+                  `cursor`. Lazy subtrees are not streamed node by node.
+        - *pageSize*: (number) the number of children returned for a cursor. Default 50.
+        - *maxNodes*: (number) stream only. Ends the output after the number of nodes and adds
+                      `"truncated": true` to the top level node. Items behind the last node are not loaded.
 
         A simple configuration looks as follows ::
 
@@ -1176,105 +1499,193 @@ class APIv1(BaseView):
                 status = "400 Unknown profile"
                 return returnError({"error": "Unknown profile"}, status)
 
-        if isinstance(profile, dict):
-            profile = Conf(**profile)
+        # compiled once per profile
+        plan = GetSubtreePlan(self.context.app, profile)
 
-        values = self._renderTree(self.context, profile)
+        cursor = self.GetFormValue("cursor")
+        if cursor:
+            # the next page of children of a lazy loaded container
+            node = None
+            if plan.lazy:
+                try:
+                    cursor = ParseCursor(cursor)
+                    node, depth = self._CursorNode(cursor[0], plan)
+                except ValueError:
+                    node = None
+            if node is None:
+                self.request.response.status = "400 Invalid cursor"
+                return {"error": "Invalid cursor"}
+            # cursors are passed by the client. never load more levels than the profile allows.
+            cursor = (cursor[0], cursor[1], min(cursor[2], plan.levels-depth))
+            return self._renderTree(node, plan, cursor=cursor)
+
+        if plan.stream:
+            # nodes are rendered while the response is written
+            values = self._renderTree(self.context, plan, stream=True)
+            response = self.request.response
+            response.content_type = "application/json"
+            response.charset = "utf-8"
+            response.app_iter = (chunk.encode("utf-8") for chunk in StreamTree(values, plan.maxNodes))
+            return response
+
+        # cached subtrees are stamped with the version of the context. writes to the context
+        # or any contained item bump the version.
+        # results including item objects are never cached.
+        cache = self.context.app.searchCache
+        if cache is not None and not plan.cache:
+            cache = None
+        if cache is not None:
+            principals = ()
+            if plan.secure:
+                principals = self.PermissionEvaluator().PrincipalsKey()
+            # outdated entries are not used anymore and removed by the lru cache
+            version = cache.Version(self.context.id)
+            key = MakeCacheKey("subtree", self.context.id, version, plan.key, principals)
+            cached = cache.Get(key)
+            if cached is not None:
+                return copy.deepcopy(cached)
+
+        values = self._renderTree(self.context, plan)
+        if cache is not None:
+            cache.Set(key, copy.deepcopy(values), tags=(SubtreeTag,))
         return values
 
 
-    def _renderTree(self, context, profile):
-        # cache field ids and types
-        fields = {}
-        for conf in context.app.configurationQuery.GetAllObjectConfs():
-            if isinstance(profile.get("toJson"), dict) and conf.id in profile.get("toJson"):
-                # custom list of fields in profile for type 
-                fields[conf.id] = profile.get("toJson")[conf.id]
-                continue
-            # use type default
-            render = conf.get("toJson")
-            if not render:
-                continue
-            fields[conf.id] = render
-        
-        # prepare parameter
-        parameter = {}
-        if profile.get("parameter"):
-            parameter.update(profile.parameter)
-        if not "pool_type" in parameter:
-            parameter["pool_type"] = list(fields.keys())
-        
-        # prepare types to descent in tree structure
-        temp = profile.get("descent",[])
-        descenttypes = []
-        for t in temp:
-            resolved = ResolveName(t)
-            if resolved:
-                descenttypes.append(resolved)
-            elif t in parameter["pool_type"]:
-                descenttypes.append(t)
-        if "pool_type" in parameter and isinstance(parameter["pool_type"], (list,tuple)):
-            operators={"pool_type":"IN"}
-        else:
-            operators = {}
-        if profile.get("operators"):
-            operators.update(profile.operators)
-            
-        # lookup levels
-        levels = profile.get("levels")
-        if levels is None:
-            levels = 10000
-
+    def _CursorNode(self, id, plan):
+        # the container referenced by a cursor and its depth below the context. the container must
+        # be located below the context, all containers in between have to be included in the
+        # profiles descent types and accessible, and the depth must be within the profiles levels.
+        # raises ValueError for invalid containers.
+        context = self.context
+        if id == context.id:
+            return context, 0
+        node = context.root.LookupObj(id)
+        if node is None or not IContainer.providedBy(node) or not context.id in node.GetParentIDs():
+            raise ValueError("Invalid cursor")
+        permissions = self.PermissionEvaluator() if plan.secure else None
+        depth = 0
+        for item in [node] + node.GetParents():
+            if item.id == context.id:
+                break
+            depth += 1
+            if item.GetTypeID() not in plan.descend:
+                raise ValueError("Invalid cursor")
+            if permissions is not None and not permissions.Allowed(item, "api-subtree"):
+                raise ValueError("Invalid cursor")
+        if depth >= plan.levels:
+            raise ValueError("Invalid cursor")
+        return node, depth
+
+
+    def _renderTree(self, context, plan, stream=False, cursor=None):
+        fields = plan.fields
+        parameter = plan.parameter
+        operators = plan.operators
+        projection = plan.projection
+        levels = plan.levels
+
+        # lazy subtrees: containers below `eager` levels are returned with count and cursor
+        lazy = plan.lazy
+        page = None
+        if cursor:
+            page = (cursor[1], plan.pageSize)
+            levels = cursor[2]
+        eager = min(levels, lazy) if lazy else levels
+        lazyNodes = []
+
+        def addCursors(values):
+            # one count query for all lazy containers
+            if eager < levels and lazyNodes:
+                counts = CountChildren(context, parameter, operators, [id for id, v in lazyNodes])
+                for id, v in lazyNodes:
+                    v["count"] = counts.get(id, 0)
+                    if v["count"]:
+                        v["cursor"] = MakeCursor(id, 0, levels-eager)
+            if cursor and "items" in values:
+                values["count"] = CountChildren(context, parameter, operators, [context.id]).get(context.id, 0)
+                if page[0]+page[1] < values["count"]:
+                    values["cursor"] = MakeCursor(context.id, page[0]+page[1], levels)
+            return values
+
+        addContext = plan.addContext and not stream
         def itemValues(item):
             iv = {}
             if item.IsRoot():
                 return iv
             name = item.GetTypeID()
-            if profile.get("addContext"):
+            if addContext:
                 iv["context"] = item
             if not name in fields:
                 return iv
             for field in fields[item.GetTypeID()]:
                 iv[field] = item.GetFld(field)
             return iv
-        
-        _c_descent = [[],[]]
+
+        # descent is resolved for type ids instead of objects.
         def descent(item):
-            # cache values: first list = descent, second list = do not descent
-            t = item.GetTypeID()
-            if t in _c_descent[0]:
-                return True
-            if t in _c_descent[1]:
-                return False
-            
-            for t in descenttypes:
-                if isinstance(t, str):
-                    if item.GetTypeID()==t:
-                        if not t in _c_descent[0]:
-                            _c_descent[0].append(t)
-                        return True
-                else:
-                    if t.providedBy(item):
-                        if not t in _c_descent[0]:
-                            _c_descent[0].append(item.GetTypeID())
-                        return True
-            if not t in _c_descent[1]:
-                _c_descent[1].append(item.GetTypeID())
-            return False
-            
+            return item.GetTypeID() in plan.descend
+
+        secure = plan.secure
+        permissions = self.PermissionEvaluator()
+        def allowed(item):
+            return not secure or permissions.Allowed(item, "api-subtree")
+
+        # streamed subtrees render contained items on demand. limited streams stop loading
+        # items behind the last streamed node.
+        sequence = iter if stream and not lazy else list
+        maxNodes = plan.maxNodes if stream else 0
+
+        if not addContext and not projection.objectsRequired and \
+           (not secure or permissions.StaticTypes(projection.columns.keys())):
+            # render from selected columns without loading objects
+            if not allowed(context):
+                return {}
+            def rowAllowed(id, typename, parent):
+                if not secure:
+                    return True
+                if parent == context.id:
+                    parent = context
+                return permissions.RowAllowed(id, typename, parent, "api-subtree")
+
+            rows = LoadSubtreeRows(context, parameter, operators, eager, projection, allowed=rowAllowed, page=page,
+                                   preload=permissions.LoadLocalGroups if secure else None, maxNodes=maxNodes)
+            def rowSubtree(row, parent, lev):
+                id, typename, current = row
+                if not rowAllowed(id, typename, parent):
+                    return {}
+                if typename in plan.descend and typename in projection.containers:
+                    if lev>0:
+                        current["items"] = sequence(rowSubtree(r, id, lev-1) for r in rows.get(id, ()))
+                    else:
+                        lazyNodes.append((id, current))
+                return current
+
+            current = itemValues(context)
+            if eager>0 and IContainer.providedBy(context):
+                current["items"] = sequence(rowSubtree(r, context.id, eager-1) for r in rows.get(context.id, ()))
+            return addCursors(current)
+
+        # load the whole subtree with one query per level
+        if allowed(context):
+            children = LoadSubtree(context, parameter, operators, eager,
+                                   descend=lambda item: descent(item) and allowed(item), page=page,
+                                   preload=permissions.LoadLocalGroups if secure else None, maxNodes=maxNodes)
+        else:
+            children = {}
+
         def itemSubtree(item, lev, includeSubtree=False):
-            if profile.get("secure",True) and not self.request.has_permission("api-subtree", item):
+            if not allowed(item):
                 return {}
             current = itemValues(item)
-            if (includeSubtree or descent(item)) and lev>0 and IContainer.providedBy(item):
-                lev -= 1
-                current["items"] = []
-                items = item.GetObjs(parameter=parameter, operators=operators)
-                for i in items:
-                    current["items"].append(itemSubtree(i, lev))
+            if (includeSubtree or descent(item)) and IContainer.providedBy(item):
+                if lev>0:
+                    lev -= 1
+                    current["items"] = sequence(itemSubtree(i, lev) for i in children.get(item.id, ()))
+                else:
+                    lazyNodes.append((item.id, current))
             return current
 
-        return itemSubtree(context, levels, includeSubtree=True)
+        return addCursors(itemSubtree(context, eager, includeSubtree=True))
         
     
     # form rendering ------------------------------------------------------------
@@ -1290,7 +1701,8 @@ class APIv1(BaseView):
 
         - *assets*: You can call `newItemForm?assets=only` to get the required css+js assets only. The form
                     iteself will not be processed. Use this in combination with `settings["includeAssets"] = False`
-                    for single page applications or to load assets only once.
+                    for single page applications or to load assets only once. If `bundleAssets` is enabled in the
+                    application configuration the assets are linked as bundles (see `assetBundle`).
 
         **Return values**
 
@@ -1305,6 +1717,9 @@ class APIv1(BaseView):
         - *values*: (dict) additional values used for the new item. These values are independent from fields or
                     form defaults.
         - *includeAssets*: (bool) include js/css assets required by the form in the html markup. default true.
+        - *cache*: (bool) set to False to exclude the form from markup caching. The initial form rendered for GET
+                   requests without form values is cached per user if the applications `searchCache` is enabled.
+                   Forms including csrf tokens are not cached.
 
         For example the configuration for a new item form might loook like ::
 
@@ -1357,11 +1772,12 @@ class APIv1(BaseView):
         return the required css and js assets for the specific form only.
         """
         typename = subset = ""
-        values = redirectSuccess = defaults = None
+        values = redirectSuccess = defaults = settings = None
         includeAssets = True
         # look up the new type in custom view definition
         viewconf = self.GetViewConf()
         if viewconf and viewconf.get("settings"):
+            settings = viewconf.settings
             typename = viewconf.settings.get("type")
             subset = viewconf.settings.get("form") or "newItem"
             values = viewconf.settings.get("values")
@@ -1376,6 +1792,14 @@ class APIv1(BaseView):
                 self.AddHeader("X-Result", "false")
                 return {"content": "Type is empty"}
 
+        # the initial empty form
+        cache, key = self._FormCache(settings, typename)
+        if cache is not None:
+            cached = cache.Get(key)
+            if cached is not None:
+                self.AddHeader("X-Result", cached[0])
+                return {"content": cached[1]}
+
         typeconf = self.context.app.configurationQuery.GetObjectConf(typename)
 
         # set up the form. subset might be the form configuration up to here.
@@ -1389,7 +1813,7 @@ class APIv1(BaseView):
 
         if self.GetFormValue("assets")=="only":
             self.AddHeader("X-Result", "true")
-            return {"content": form.HTMLHead(ignore=[a[0] for a in self.configuration.assets])}
+            return {"content": self._FormHead(form)}
 
         # process and render the form.
         result, data, action = form.Process(pool_type=typename, defaults=defaults, values=values, redirectSuccess=redirectSuccess)
@@ -1400,9 +1824,11 @@ class APIv1(BaseView):
         if includeAssets:
             # if assets are enabled add required js+css for form except those defined
             # in the view modules asset list
-            head = form.HTMLHead(ignore=[a[0] for a in self.configuration.assets])
-            return {"content": head+data}
+            head = self._FormHead(form)
+            data = head+data
 
+        if cache is not None and self._FormCacheable(data):
+            cache.Set(key, (str(result).lower(), data), tags=(FormTag, typename))
         return {"content": data}
 
 
@@ -1415,7 +1841,8 @@ class APIv1(BaseView):
 
         - *assets*: You can call `setItemForm?assets=only` to get the required css, js assets only. The form
                     iteself will not be processed. Use this in combination with `settings["includeAssets"] = False`
-                    for single page applications or to load assets only once.
+                    for single page applications or to load assets only once. If `bundleAssets` is enabled in the
+                    application configuration the assets are linked as bundles (see `assetBundle`).
 
         **Return values**
 
@@ -1429,6 +1856,9 @@ class APIv1(BaseView):
         - *values*: (dict) additional values used for the new item. These values are independent from fields or
                     form defaults.
         - *includeAssets*: (bool) include js/css assets required by the form in the html markup. default true.
+        - *cache*: (bool) set to False to exclude the form from markup caching. The initial form is cached per item
+                   version and user if the applications `searchCache` is enabled. Forms including csrf tokens
+                   are not cached.
 
         For example the configuration for a new item form might loook like ::
 
@@ -1477,11 +1907,12 @@ class APIv1(BaseView):
         To get required assets in a seperate call use `?assets=only` as query parameter. This will
         return the required css and js assets for the specific form only.
         """
-        values = redirectSuccess = None
+        values = redirectSuccess = settings = None
         includeAssets = True
         # look up the new type in custom view definition
         viewconf = self.GetViewConf()
         if viewconf and viewconf.get("settings"):
+            settings = viewconf.settings
             subset = viewconf.settings.get("form") or "setItem"
             values = viewconf.settings.get("values")
             redirectSuccess = viewconf.settings.get("redirectSuccess")
@@ -1492,6 +1923,14 @@ class APIv1(BaseView):
         setObject = self.context
         typeconf = setObject.configuration
 
+        # the initial form with the current item values
+        cache, key = self._FormCache(settings, typeconf.id, item=setObject)
+        if cache is not None:
+            cached = cache.Get(key)
+            if cached is not None:
+                self.AddHeader("X-Result", cached[0])
+                return {"content": cached[1]}
+
         # set up the form. subset might be the form configuration up to here.
         form, subset = MakeCustomizedViewForm(view=self,
                                               forContext=setObject,
@@ -1503,7 +1942,7 @@ class APIv1(BaseView):
 
         if self.GetFormValue("assets")=="only":
             self.AddHeader("X-Result", "true")
-            return {"content": form.HTMLHead(ignore=[a[0] for a in self.configuration.assets])}
+            return {"content": self._FormHead(form)}
 
         # process and render the form.
         result, data, action = form.Process(values=values, redirectSuccess=redirectSuccess)
@@ -1514,12 +1953,178 @@ class APIv1(BaseView):
         if includeAssets:
             # if assets are enabled add required js+css for form except those defined
             # in the view modules asset list
-            head = form.HTMLHead(ignore=[a[0] for a in self.configuration.assets])
-            return {"content": head+data}
+            head = self._FormHead(form)
+            data = head+data
 
+        if cache is not None and self._FormCacheable(data):
+            cache.Set(key, (str(result).lower(), data), tags=(FormTag, typeconf.id))
         return {"content": data}
 
 
+    def validateField(self):
+        """
+        Validates one or a few form fields without processing or rendering the form. Use this view
+        for live validation of ajax forms: only the requested fields are converted and validated,
+        the database is only queried if a fields validator or list items require it.
+
+        If a type is given the fields are validated for the `newItem` form of the type, otherwise for
+        the `setItem` form of the current object.
+
+        **Request parameter**
+
+        - *fields*: the field ids to be validated. Either a list or a comma separated string. If not
+                    set all form fields passed in the request are validated.
+        - *<fields>*: the field values.
+        - *type*: the type id for new items. If not set the current objects form is used.
+        - *subset*: the form subset. Defaults to `newItem` or `setItem`.
+
+        Returns json encoded result: {"result": true/false, "errors": {"field id": [messages]}}
+
+        **Settings**
+
+        - *type*: (string) type id of new items. if empty type is extracted from request.
+        - *form*: (dict/string) the form setup or subset. Use the same settings as for `newItemForm`
+                  or `setItemForm`.
+
+        The form fields are resolved once per type and form setup and cached.
+        """
+        typename = subset = ""
+        viewconf = self.GetViewConf()
+        if viewconf and viewconf.get("settings"):
+            typename = viewconf.settings.get("type")
+            subset = viewconf.settings.get("form")
+        typename = typename or self.GetFormValue("type") or self.GetFormValue("pool_type")
+        # objects validate their own form unless a type is given
+        action = "setItem" if IObject.providedBy(self.context) and not typename else "newItem"
+        subset = subset or self.GetFormValue("subset") or action
+
+        response = self.request.response
+        if action == "setItem":
+            typeconf = self.context.configuration
+        else:
+            if not typename:
+                response.status = "400 No type given"
+                return {"error": "No type given", "result": False}
+            typeconf = self.context.app.configurationQuery.GetObjectConf(typename)
+            if not typeconf:
+                response.status = "400 Unknown type"
+                return {"error": "Unknown type", "result": False}
+
+        try:
+            formfields = self._FormFields(action, typeconf, subset)
+        except ConfigurationError:
+            response.status = "400 Unknown form"
+            return {"error": "Unknown form", "result": False}
+
+        values = dict(self.GetFormValues())
+        names = values.pop("fields", None)
+        if not names:
+            names = [f for f in values if f in formfields]
+        elif isinstance(names, str):
+            names = [f.strip() for f in names.split(",") if f.strip()]
+        errors = {}
+        for name in names:
+            if not name in formfields:
+                errors[name] = [self.Translate(_("Unknown field"))]
+        fields = [formfields[name] for name in names if name in formfields]
+        if not fields:
+            return {"result": not errors, "errors": errors}
+
+        # the schema is set up for the selected fields only
+        form, unused = MakeCustomizedViewForm(view=self,
+                                              forContext=self.context,
+                                              formSettingsOrSubset={"fields": fields},
+                                              typeconf=typeconf)
+        form.Setup()
+        data = dict([(f.id, values[f.id]) for f in fields if f.id in values])
+        result, data, err = form.ValidateSchema(data)
+        for e in err or ():
+            errors[e.node.name] = [self.Translate(m) for m in e.messages()]
+        return {"result": result and not errors, "errors": errors}
+
+
+    def _FormHead(self, form):
+        # css and js tags for the form. single files or bundles if `bundleAssets` is enabled.
+        ignore = [a[0] for a in self.configuration.assets]
+        if self.context.app.configuration.get("bundleAssets"):
+            return FormHead(self, form, ignore=ignore)
+        return form.HTMLHead(ignore=ignore)
+
+
+    def assetBundle(self):
+        """
+        Returns a css or js bundle of form assets. Bundles are linked by the form views if
+        `bundleAssets` is enabled in the application configuration. The bundle name is passed as
+        subpath e.g. `assetBundle/<hash>.js`. See `nive_datastore.webapi.assets`.
+
+        **Request parameter**
+
+        - *files*: the bundled files. Used to build the bundle if not known yet.
+
+        Bundles are cached by browsers for one year.
+        """
+        subpath = self.request.subpath
+        name = subpath[0] if subpath else ""
+        files = self.GetFormValue("files", method="GET")
+        specs = files.split(BundleSeparator) if files else None
+        bundle = LookupBundle(self.context.app, self.request, name, specs)
+        if bundle is None:
+            raise HTTPNotFound("Unknown bundle")
+        response = Response(body=bundle.body, content_type=bundle.mime)
+        response.cache_control = "public, max-age=%d, immutable" % (BundleMaxAge)
+        response.etag = bundle.name
+        return response
+
+
+    def _FormCache(self, settings, typename, item=None):
+        # returns the cache and key for the initial form markup or None, None. Only GET requests
+        # without form values render the initial form. The form action url and the principals
+        # are part of the key, defaults and choices may depend on the user. Edit forms are
+        # stamped with the items version.
+        cache = self.context.app.searchCache
+        if cache is None or self.request.method != "GET":
+            return None, None
+        if settings and not settings.get("cache", True):
+            return None, None
+        if set(self.GetFormValues().keys()) - FormCacheParams:
+            return None, None
+        version = None
+        if item is not None:
+            version = (item.id, cache.Version(item.id))
+        key = MakeCacheKey("form", self.request.url, self.request.locale_name, typename, version,
+                           self.PermissionEvaluator().PrincipalsKey())
+        return cache, key
+
+
+    def _FormCacheable(self, markup):
+        # forms with csrf tokens are request specific
+        return not FormTokenMarker in markup.lower()
+
+
+    def _FormFields(self, action, typeconf, subset):
+        # form field configurations by id for the types form. subset is the subset name or the
+        # customized views form settings. fields are resolved once and cached by the subset name
+        # or the settings identity like subtree plans.
+        app = self.context.app
+        try:
+            cache = app._c_formfields
+        except AttributeError:
+            cache = app._c_formfields = {}
+        key = (action, typeconf.id, subset if isinstance(subset, str) else id(subset))
+        cached = cache.get(key)
+        if cached is not None and (cached[0] == subset if isinstance(subset, str) else cached[0] is subset):
+            return cached[1]
+        form, name = MakeCustomizedViewForm(view=self,
+                                            forContext=self.context,
+                                            formSettingsOrSubset=subset,
+                                            typeconf=typeconf,
+                                            loadFromViewModuleConf=self.configuration)
+        form.Setup(subset=name)
+        fields = dict([(f.id, f) for f in form.GetFields()])
+        cache[key] = (subset, fields)
+        return fields
+
+
     def _formDefaults(self, action):
         # customize form widget. values are applied to form.widget
         values = dict(
@@ -1564,15 +2169,17 @@ class APIv1(BaseView):
         test = self.GetFormValue("test")=="true"
         
         result = {"result": False, "messages": None}
+        lookup = WorkflowStates(self.context.app, self.user, self.request)
         if test:
-            result["result"] = self.context.workflow.WfAllow(action, self.user, transition)
+            result["result"] = lookup.Allow(self.context, action, transition)
             if result["result"]:
                 result["messages"] = ["Allowed"]
             else:
                 result["messages"] = ["Not allowed"]
         else:
             try:
-                result["result"] = self.context.workflow.WfAction(action, self.user, transition)
+                result["result"] = self.context.workflow.WfAction(action, self.user, transition,
+                                                                  process=lookup.Process(self.context))
                 result["messages"] = ["OK"]
                 result["state"] = self.state()
             except WorkflowNotAllowed:
@@ -1581,6 +2188,151 @@ class APIv1(BaseView):
         return result
     
 
+    @TraceQueries("actionBatch")
+    def actionBatch(self):
+        """
+        Triggers one workflow action for many contained items. The items are selected by id or
+        by a search profile. Transitions are checked once per state and principals and all state
+        changes are stored in one transaction. If an exception is raised the transaction is rolled
+        back (if supported by the database connection).
+
+        **Request parameter:**
+
+        - *action*: action name to be triggered
+        - *transition*: (optional) transition if multiple match action
+        - *id*: list of item ids.
+        - *profile*: search profile name in `app.configuration.search`. The items matching the profile
+                     are used if no ids are passed. The profile fields must include `id`. Profile
+                     definitions can only be passed as view setting.
+        - *descendants*: if true items contained at any depth are included. Requires the `pool_path`
+                         meta field. Otherwise only direct children of the container are processed.
+
+        Returns json encoded result: {"result": list of processed item ids, "error": list of messages}
+
+        Items not found, without workflow, the user has no `api-action` permission for or the action
+        is not allowed for are skipped and listed in `error`. Actions allowed in the items state without
+        transition are listed in `result` but nothing is stored. The entry actions `create` and
+        `duplicate` cannot be triggered.
+
+        **Settings:**
+
+        - *profile*: (string/dict) the search profile to select items. If set the profile cannot be
+                     changed by request parameter.
+        - *maxActionItems*: (number) the maximum number of items processed in one call. Default 5000.
+        - *values*: (dict) values passed to the transitions execute callbacks.
+        - *callback*: (callback) pluginpoint called once after all actions have been executed
+                      and before the changes are committed. Takes three parameters `items, action, view`.
+                      Raise an exception to cancel the transaction.
+        """
+        settings = {}
+        viewconf = self.GetViewConf()
+        if viewconf and viewconf.get("settings"):
+            settings = viewconf.settings
+        maxActionItems = settings.get("maxActionItems") or \
+                         self.context.app.configuration.get("maxActionItems") or DefaultMaxActionItems
+        response = self.request.response
+
+        action = self.GetFormValue("action")
+        if not action:
+            response.status = "400 Empty action"
+            return {"error": "Empty action", "result": []}
+        if action in WfEntryActions:
+            # entry actions reset the workflow state of new items
+            response.status = "400 Invalid action"
+            return {"error": "Invalid action", "result": []}
+        transition = self.GetFormValue("transition")
+
+        ids = self.GetFormValue("id")
+        profile = settings.get("profile")
+        if not profile:
+            # request profiles are looked up by name only
+            profile = self.GetFormValue("profile")
+            if profile not in jsUndefined and not isinstance(profile, str):
+                response.status = "400 Invalid profile"
+                return {"error": "Invalid profile", "result": []}
+        if ids in jsUndefined and profile:
+            ids, error = self._ProfileIDs(profile, maxActionItems)
+            if error:
+                response.status = "400 "+error
+                return {"error": error, "result": []}
+        if not isinstance(ids, (list, tuple)):
+            ids = [ids] if ids not in jsUndefined else []
+        try:
+            ids = [int(id) for id in ids]
+        except (ValueError, TypeError):
+            response.status = "400 Invalid id"
+            return {"error": "Invalid id", "result": []}
+        if not ids:
+            response.status = "400 Empty id"
+            return {"error": "Empty id", "result": []}
+        if len(ids) > maxActionItems:
+            response.status = "413 Too many items"
+            return {"error": "Too many items.", "result": []}
+
+        if self.GetFormValue("descendants") in (True, "1", "true"):
+            objs = self._LoadDescendants(ids)
+        else:
+            objs = self.context.GetObjsBatch(ids)
+
+        loaded = set(obj.id for obj in objs)
+        errors = ["Not found: Item id %d" % (id) for id in ids if id not in loaded]
+        user = self.User()
+        lookup = WorkflowStates(self.context.app, user, self.request)
+        permissions = self.PermissionEvaluator()
+        processed = []
+        db = self.context.app.db
+        db.Begin()
+        try:
+            for obj in objs:
+                if not permissions.Allowed(obj, "api-action"):
+                    errors.append("Not allowed: Item id %d" % (obj.id))
+                    continue
+                wf = lookup.Process(obj)
+                if wf is None:
+                    errors.append("No workflow: Item id %d" % (obj.id))
+                    continue
+                try:
+                    executed = lookup.Action(obj, action, transition, values=settings.get("values"), process=wf)
+                except WorkflowNotAllowed:
+                    errors.append("Not allowed: Item id %d" % (obj.id))
+                    continue
+                if executed is not None:
+                    # stored without database commit. committed once for all items.
+                    obj.Signal("commit", user=user)
+                    obj.dbEntry.Commit(user=user, dbCommit=False)
+                processed.append(obj)
+            callback = settings.get("callback")
+            if isinstance(callback, collections.abc.Callable):
+                callback(processed, action, self)
+            db.Commit()
+        except:
+            db.Undo()
+            raise
+        return {"result": [obj.id for obj in processed], "error": errors}
+
+
+    def _ProfileIDs(self, profile, maxItems):
+        # runs the search profile and returns the ids of the matching items and an error message
+        if isinstance(profile, str):
+            profiles = self.context.app.configuration.get("search") or {}
+            profile = profiles.get(profile)
+            if not profile:
+                return None, "Unknown profile"
+        profile = GetSearchProfile(self.context.app, profile)
+        if profile.groups:
+            user = self.User()
+            if not user or not user.InGroups(profile.groups):
+                raise HTTPForbidden("Profile not allowed")
+        if not "id" in (profile.fields or ()):
+            return None, "Profile fields must include id"
+        query, error = self._SearchQuery(profile, {"maxBatchItems": maxItems})
+        if error:
+            return None, error
+        values, start, size, sort, ascending = query
+        result = profile.Search(self.context.root.search, values, start=start, max=size, sort=sort, ascending=ascending)
+        return [item["id"] for item in result["items"]], None
+
+
     def state(self):
         """
         Get the current contexts' workflow state.
@@ -1599,34 +2351,96 @@ class APIv1(BaseView):
         - fromstate: the current state
         - tostate: new state after axcecution
         - actions: list of triggering actions for the transition
-        
+
+        Allowed transitions are cached per workflow state and principals. See
+        `nive_datastore.webapi.workflow`.
         """
-        state = self.context.workflow.GetWfInfo(self.user)
-        if not state:
+        state = WorkflowStates(self.context.app, self.user, self.request).GetWfInfo(self.context)
+        if not state or state["state"] is None:
             return {"result":False, "messages": ["No workflow loaded for object"]}
+        return SerializeState(state)
 
-        def _serI(info):
-            return {"id":info.id, "name":info.name} 
-        
-        def _serT(transition):
-            return {"id":transition.id, 
-                    "name":transition.name, 
-                    "fromstate":transition.fromstate,
-                    "tostate":transition.tostate,
-                    "actions":[_serI(a) for a in transition.actions]}
 
-        return {"id": state["state"].id,
-                "name": state["state"].name,
-                "process": _serI(state["process"]),
-                "transitions": [_serT(t) for t in state["transitions"]],
-                "result": True}
+    def states(self):
+        """
+        Get the workflow states of multiple contained items. Returns the same information as
+        `state` for each item. Workflow processes and transition permissions are looked up once
+        for all items.
+
+        **Request parameter:**
+
+        - *id*: list of item ids.
+
+        returns {"result": true, "states": {"<id>": state information}}
+
+        Items the user has no `api-state` permission for are skipped. Items without workflow
+        are included as {"result": false, "messages": [...]}.
+
+        **Settings:**
+
+        - *maxBatchItems*: (number) the maximum number of items returned in one call
+        """
+        maxBatchItems = self.context.app.configuration.get("maxBatchItems") or DefaultMaxBatchItems
+        viewconf = self.GetViewConf()
+        if viewconf and viewconf.get("settings"):
+            maxBatchItems = viewconf.settings.get("maxBatchItems") or maxBatchItems
+
+        ids = self.GetFormValue("id")
+        if not isinstance(ids, (list,tuple)):
+            ids = [ids] if ids not in jsUndefined else []
+        try:
+            ids = [int(id) for id in ids]
+        except (ValueError, TypeError):
+            self.request.response.status = "400 Invalid id"
+            return {"error": "Invalid id", "result": False}
+        if not ids:
+            self.request.response.status = "400 Empty id"
+            return {"error": "Empty id", "result": False}
+
+        items = self.PermissionEvaluator().FilterAllowed(self.context.GetObjsBatch(ids[:maxBatchItems]), "api-state")
+        lookup = WorkflowStates(self.context.app, self.user, self.request)
+        states = {}
+        for item in items:
+            state = lookup.GetWfInfo(item)
+            if not state or state["state"] is None:
+                states[str(item.id)] = {"result":False, "messages": ["No workflow loaded for object"]}
+                continue
+            states[str(item.id)] = SerializeState(state)
+        return {"result": True, "states": states}
+
+
+    def slowQueries(self):
+        """
+        Returns the recent records of the slow query log. Latest first. See `nive_datastore.querylog`.
+
+        **Request parameter**
+
+        - *clear*: (bool) removes all records after returning them.
+
+        **Return values**
+
+        - *records*: list of records. Each record contains `time`, `duration` in seconds, `view`, `profile`,
+                     `sql`, `values` and `explain`.
+        - *threshold*: the threshold in seconds
+        """
+        log = self.context.app.slowQueryLog
+        if log is None:
+            return {"error": "Slow query log not enabled", "records": []}
+        records = log.Records()
+        if ExtractJSValue(self.GetFormValues(), "clear", False, "bool"):
+            log.Clear()
+        return {"records": records, "threshold": log.threshold}
 
 
-    def renderTmpl(self, template=None):
+    def renderTmpl(self, template=None, cache=None):
         """
         Renders the items template defined in the configuration (`ObjectConf.template`). The template
         will be called with a dictionary containing the `item`, `request` and `view`.
 
+        If the applications `fragmentCache` is enabled the rendered markup is cached for types with
+        `ObjectConf.cacheTemplate = True` or if called with `cache=True`. Cached markup is used for
+        the same item version, template, locale and request principals. See `nive_datastore.cache`.
+
         See `pyramid.renderers` for possible template engines.
 
         Link the template in the objects type configuration ::
@@ -1646,11 +2460,31 @@ class APIv1(BaseView):
             )
 
         """
+        fragments = self.context.app.fragmentCache
+        if cache is None:
+            cache = self.context.configuration.get("cacheTemplate", False)
+        if fragments is not None and cache and IObject.providedBy(self.context):
+            key = MakeCacheKey("tmpl", self.context.id, str(self.context.meta.get("pool_change")),
+                               template or self.context.configuration.template, self.request.locale_name,
+                               self.PermissionEvaluator().PrincipalsKey())
+            cached = fragments.Get(key)
+            if cached is not None:
+                body, content_type, charset = cached
+                response = Response(body=body, content_type=content_type, charset=charset)
+                self.CacheHeader(response, user=self.User())
+                return response
+        else:
+            fragments = None
+
         values = {}
         values["item"] = self.context
         values["view"] = self
         values["request"] = self.request
-        return self.DefaultTemplateRenderer(values, template)
+        response = self.DefaultTemplateRenderer(values, template)
+        if fragments is not None:
+            body = response.body
+            fragments.Set(key, (body, response.content_type, response.charset), self.context.id, size=len(body))
+        return response
 
 
     def tmpl(self):
@@ -1673,6 +2507,27 @@ class APIv1(BaseView):
         return {}
 
 
+    # permissions ------------------------------------------------------------
+
+    def filterAllowed(self, items, permission):
+        """
+        Returns the items the current user has `permission` for. Acls are evaluated once per
+        container and type for all items. See `nive_datastore.webapi.permissions`.
+
+        Usage ::
+
+            <div tal:repeat="item view.filterAllowed(context.GetObjs(), 'api-getItem')">...</div>
+
+        :items: list of objects
+        :permission: permission name
+        """
+        return self.PermissionEvaluator().FilterAllowed(items, permission)
+
+
+    def PermissionEvaluator(self):
+        return GetPermissionEvaluator(self.request, self.context.app)
+
+
     # list rendering ------------------------------------------------------------
 
     def renderListItem(self, values, typename=None, template=None, **kw):
@@ -1703,6 +2558,8 @@ class APIv1(BaseView):
             <div tal:content="structure view.renderListItem(values, 'article')"
                  class="col-lg-12"></div>
 
+        Use `renderList` to render all rows of a result list in one pass.
+
         :values:
         :typename:
         :template:
@@ -1713,12 +2570,9 @@ class APIv1(BaseView):
         typename = typename or values.get("type")
         if not typename:
             return "-no type-"
-        if not hasattr(self, "_c_listing_"+typename):
-            typeconf = self.context.app.configurationQuery.GetObjectConf(typename)
-            tmpl = typeconf.get("listing")
-            setattr(self, "_c_listing_"+typename, tmpl)
-        else:
-            tmpl = getattr(self, "_c_listing_"+typename)
+        tmpl = ListingTemplate(self.context.app, typename)
+        if not tmpl:
+            return "-no listing-"
         v2 = {}
         v2.update(values)
         v2["options"] = kw
@@ -1726,6 +2580,51 @@ class APIv1(BaseView):
         return renderers.render(tmpl, v2, request=self.request)
 
 
+    def renderList(self, rows, typename=None, template=None, **kw):
+        """
+        Renders a list of data records with the object configuration defined `listing` renderer
+        like `renderListItem` and returns the concatenated result.
+
+        The listing template is looked up once per type and all rows are rendered in one pass.
+        `view` and `options` are shared by all rows. Rows without typename are rendered with the
+        listing template of `row["type"]`. Rows of types without listing template are rendered
+        as `-no listing-`.
+
+        Usage ::
+
+            <div tal:content="structure view.renderList(result['items'], 'article')"
+                 class="col-lg-12"></div>
+
+        :rows: list of dictionaries
+        :typename:
+        :template:
+        """
+        system = {"view": self, "options": kw}
+        app = self.context.app
+        if template or typename:
+            tmpl = template or ListingTemplate(app, typename)
+            if not tmpl:
+                return "-no listing-" * len(rows)
+            return "".join(ListRenderer(tmpl, self.request, system=system).Render(rows))
+        # mixed types: one renderer per listing template
+        listRenderers = {}
+        result = []
+        for row in rows:
+            name = row.get("type")
+            if not name:
+                result.append("-no type-")
+                continue
+            tmpl = ListingTemplate(app, name)
+            if not tmpl:
+                result.append("-no listing-")
+                continue
+            renderer = listRenderers.get(tmpl)
+            if renderer is None:
+                renderer = listRenderers[tmpl] = ListRenderer(tmpl, self.request, system=system)
+            result.extend(renderer.Render((row,)))
+        return "".join(result)
+
+
 # internal data processing ------------------------------------------------------------
 
 def DeserializeItems(view, items, fields, render=()):
@@ -1760,6 +2659,32 @@ def DeserializeItems(view, items, fields, render=()):
     return values
 
 
+_executorLock = threading.Lock()
+
+def SearchExecutor(app, workers):
+    """
+    Returns the applications thread pool used to run search queries concurrently. Threads
+    and their database connections are reused for all calls. The pool is replaced by a larger
+    one if more `workers` are requested.
+    """
+    with _executorLock:
+        executor = getattr(app, "_c_searchexecutor", None)
+        if executor is None or getattr(app, "_c_searchworkers", 0) < workers:
+            # a replaced pool is not shut down. other requests may still submit tasks to it.
+            # its threads end once the pool is garbage collected.
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nive-search")
+            app._c_searchexecutor = executor
+            app._c_searchworkers = workers
+        return executor
+
+
+def CopyResult(values):
+    # copy cached results before passing them to the caller
+    values = dict(values)
+    values["items"] = [dict(i) if isinstance(i, dict) else i for i in values["items"]]
+    return values
+
+
 def ExtractJSValue(values, key, default, format):
     value = values.get(key, default)
     if value in jsUndefined:
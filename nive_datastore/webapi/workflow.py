@@ -0,0 +1,314 @@
+# Copyright 2012-2020 Arndt Droullier, Nive GmbH. All rights reserved.
+# Released under GPL3. See license.txt
+
+"""
+Batched workflow states
+-----------------------
+`obj.workflow.GetWfInfo(user)` loads the workflow process for each call (configuration lookup,
+state and transition objects) and evaluates the permissions of each transition of the current
+state. List views showing the available transitions for many items repeat the same work for
+each row.
+
+`WorkflowStates` returns the same information for a batch of items:
+
+- workflow processes are loaded once per process id,
+- transition checks are evaluated once per process, state and principals. Transitions with
+  conditions depend on the item and are evaluated for each item.
+
+The result of each item is serialized with `SerializeState()` like the `state` view.
+
+Transition checks are kept in a `TransitionCache` per workflow process configuration and shared
+by all requests. The cache is cleared if the configuration changes, unlocked configurations are
+compared by their transitions. The `action` view executes actions with the process itself
+(`WfAction`), which checks the transitions again. `actionBatch` executes actions with
+`WorkflowStates.Action()` based on the cached checks only. Transitions with conditions are
+evaluated for each item in both cases.
+
+Transition roles are checked against the principals of the user for each item, not the requests
+context. Item local roles like `group:owner` apply to the item only. See `ItemPrincipals()`.
+"""
+
+import weakref
+
+from pyramid.interfaces import ISecurityPolicy
+from pyramid.threadlocal import get_current_registry, get_current_request
+
+from nive.definitions import ConfigurationError, ILocalGroups
+from nive.helper import ResolveName
+from nive.workflow import wfAllStates, WfAllRoles, WfEntryActions, WorkflowNotAllowed
+
+# the number of cached (state, principals) entries per process configuration
+MaxTransitionKeys = 1000
+
+
+class WorkflowStates(object):
+    """
+    Workflow state lookups for multiple items and one user.
+    """
+
+    def __init__(self, app, user, request=None):
+        self.app = app
+        self.user = user
+        self.request = request
+        self._processes = {}
+
+
+    def GetWfInfo(self, item):
+        """
+        Returns the workflow information for the item like `item.workflow.GetWfInfo(user)`
+        or an empty dict if no workflow is loaded for the item.
+        """
+        wf = self.Process(item)
+        if wf is None:
+            return {}
+        wfa = item.meta.get("pool_wfa")
+        state = wf.GetState(wfa)
+        transitions = self.Transitions(wf, wfa, item)
+        actions = list(state.actions) if state is not None else []
+        for t in transitions:
+            if t.actions:
+                actions.extend(t.actions)
+        return {"id": wf.configuration.id,
+                "name": wf.configuration.name,
+                "state": state,
+                "transitions": transitions,
+                "actions": actions,
+                "process": wf,
+                "context": item,
+                "user": self.user}
+
+
+    def Process(self, item):
+        """
+        Returns the items workflow process or None. Processes are loaded once per process id.
+        """
+        if not self.app.configuration.workflowEnabled:
+            return None
+        wfTag = item.meta.get("pool_wfp")
+        if not wfTag:
+            return None
+        if wfTag not in self._processes:
+            wf = self.app.GetWorkflow(wfTag)
+            if wf is None:
+                raise ConfigurationError("Workflow process not found (%s)" % (wfTag))
+            self._processes[wfTag] = wf
+        wf = self._processes[wfTag]
+        item.Signal("wfLoad", workflow=wf)
+        return wf
+
+
+    def Transitions(self, wf, state, item):
+        """
+        Returns the transitions the user is allowed to execute in state like
+        `wf.PossibleTransitions(state, user=user, context=item)`.
+        """
+        if not self.user:
+            return wf.PossibleTransitions(state, context=item)
+        cache = GetTransitionCache(wf.configuration)
+        principals = TransitionPrincipals(item, self.user, self.request)
+        checked = cache.Get(state, principals)
+        if checked is None:
+            # same order as wf.PossibleTransitions(): wildcard transitions come last.
+            # None: transition with conditions. checked for each item.
+            checked = []
+            wildcards = []
+            for i, t in enumerate(wf.transitions):
+                if t.configuration.fromstate == wfAllStates:
+                    wildcards.append((i, True))
+                elif t.configuration.fromstate == state:
+                    checked.append((i, None if t.configuration.conditions else AllowTransition(t, item, self.user, principals)))
+            checked.extend(wildcards)
+            cache.Set(state, principals, checked)
+        transitions = []
+        for i, allowed in checked:
+            t = wf.transitions[i]
+            if allowed or (allowed is None and AllowTransition(t, item, self.user, principals)):
+                transitions.append(t)
+        return transitions
+
+
+    def ActionTransitions(self, wf, state, item, action, transition=None):
+        """
+        Returns the transitions for the action like
+        `wf.PossibleTransitions(state, action, transition, context=item, user=user)`.
+        """
+        transitions = []
+        for t in self.Transitions(wf, state, item):
+            if t.configuration.fromstate != wfAllStates:
+                if action not in t.configuration.actions:
+                    continue
+                if transition and t.id != transition:
+                    continue
+            transitions.append(t)
+        return transitions
+
+
+    def Allow(self, item, action, transition=None):
+        """
+        Checks if the action can be executed for the item like `item.workflow.WfAllow(action, user, transition)`.
+        """
+        wf = self.Process(item)
+        if wf is None:
+            return True
+        item.Signal("wfAllow", name=action, process=wf)
+        state = wf.GetObjState(item)
+        if not state:
+            return False
+        if self.ActionTransitions(wf, state.id, item, action, transition):
+            return True
+        return not transition and action in state.actions
+
+
+    def Action(self, item, action, transition=None, values=None, process=None):
+        """
+        Executes the action for the item like `item.workflow.WfAction(action, user, transition)`.
+        Changes are not committed. `process` is the items workflow process if already loaded.
+
+        returns the executed transition or None
+
+        raises WorkflowNotAllowed
+        """
+        wf = process or self.Process(item)
+        if wf is None:
+            return None
+        if action in WfEntryActions:
+            # like Process.Action(): entry actions start at the entry point
+            item.meta["pool_wfa"] = wf.configuration.entryPoint
+        state = wf.GetObjState(item)
+        ptrans = self.ActionTransitions(wf, state.id, item, action, transition) if state else None
+        if not ptrans:
+            if state and not transition and action in state.actions:
+                return None
+            raise WorkflowNotAllowed("Workflow: Not allowed (%s)" % (action))
+        t = ptrans[0]
+        t.Execute(item, self.user, values=values)
+        t.Finish(action, item, self.user)
+        item.Signal("wfAction", name=action, process=wf)
+        return t
+
+
+class TransitionCache(object):
+    """
+    Transition checks of one workflow process configuration by state and principals. Each
+    entry is a list of `(transition index, allowed)` in process order. `allowed` is None for
+    transitions with conditions.
+    """
+
+    def __init__(self, configuration):
+        self.signature = _Signature(configuration)
+        self.entries = {}
+
+
+    def Get(self, state, principals):
+        return self.entries.get((state, principals))
+
+
+    def Set(self, state, principals, checked):
+        if len(self.entries) >= MaxTransitionKeys:
+            self.entries.clear()
+        self.entries[(state, principals)] = checked
+
+
+_transitionCaches = weakref.WeakKeyDictionary()
+
+def GetTransitionCache(configuration):
+    """
+    Returns the transition cache of the workflow process configuration. A new cache is created
+    if the configuration has changed.
+    """
+    cache = _transitionCaches.get(configuration)
+    if cache is None or (not configuration.locked and cache.signature != _Signature(configuration)):
+        cache = TransitionCache(configuration)
+        _transitionCaches[configuration] = cache
+    return cache
+
+
+def _Signature(configuration):
+    # locked configurations can not change
+    if configuration.locked:
+        return None
+    return tuple((id(t), getattr(t, "fromstate", None), repr(getattr(t, "roles", None)),
+                  repr(getattr(t, "conditions", None)), repr(getattr(t, "actions", None)))
+                 for t in configuration.transitions or ())
+
+
+def TransitionPrincipals(context, user, request=None):
+    """
+    Returns the principals transition roles are checked against as tuple. Uses the same lookup
+    as `nive.workflow.Transition.Allow()` but with the principals for `context` instead of the
+    requests context.
+    """
+    groups = ItemPrincipals(context, request)
+    if groups is None or groups == ["system.Everyone"]:
+        groups = user.GetGroups(context)
+        if context and ILocalGroups.providedBy(context):
+            groups = list(groups) + list(context.GetLocalGroups(str(user)))
+    return tuple(sorted(groups))
+
+
+def ItemPrincipals(context, request=None):
+    """
+    Returns the principals of the authenticated user for `context` or None if no security
+    policy is registered. The principals of the nive security policy depend on the requests
+    context: for other contexts the policy is called with the context replaced.
+    """
+    request = request or get_current_request()
+    policy = get_current_registry().queryUtility(ISecurityPolicy)
+    if policy is None or request is None:
+        return None
+    identity = policy.identity(request)
+    if identity is None:
+        return None
+    lookup = getattr(policy, "_principals", None)
+    if lookup is None or getattr(request, "context", None) is context:
+        return identity.get("principals")
+    return lookup(identity["userid"], _ContextRequest(request, context))
+
+
+def AllowTransition(transition, context, user, principals):
+    """
+    Checks the transitions conditions and roles like `nive.workflow.Transition.Allow()` with the
+    `principals` of the item.
+    """
+    conf = transition.configuration
+    if conf.conditions:
+        for c in conf.conditions:
+            if isinstance(c, str):
+                c = ResolveName(c)
+            if not c(transition=transition, context=context, user=user, values=conf.values):
+                return False
+    if conf.roles == WfAllRoles:
+        return True
+    adminGroups = transition.process.adminGroups
+    for r in principals:
+        if r in adminGroups or r in conf.roles:
+            return True
+    return False
+
+
+class _ContextRequest(object):
+    # request proxy with a different context
+    def __init__(self, request, context):
+        self.__dict__["_request"] = request
+        self.__dict__["context"] = context
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+def SerializeState(info):
+    """
+    Converts the workflow information returned by `GetWfInfo()` to json values.
+    """
+    def _serT(transition):
+        return {"id":transition.id,
+                "name":transition.name,
+                "fromstate":transition.configuration.fromstate,
+                "tostate":transition.configuration.tostate,
+                "actions":list(transition.actions)}
+
+    return {"id": info["state"].id,
+            "name": info["state"].name,
+            "process": {"id": info["id"], "name": info["name"]},
+            "transitions": [_serT(t) for t in info["transitions"]],
+            "result": True}